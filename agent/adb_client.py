@@ -0,0 +1,146 @@
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AdbClient:
+    """Minimal ADB client speaking the smart-socket protocol of the local adb server (TCP 5037).
+
+    The adb server serves exactly one service per connection, so connections cannot be reused across commands.
+    Instead the client keeps a few sockets that are already switched to the device with `host:transport:<serial>`
+    and refills them in the background, which takes the connect and transport round trips off the hot path.
+    Every stream owns its socket, so concurrent commands from several threads are multiplexed by the server.
+    """
+
+    def __init__(self, serial, host="127.0.0.1", port=5037, timeout=10, command_timeout=120, pool_size=2):
+        self.serial = serial
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.command_timeout = command_timeout
+        self.pool_size = pool_size
+        self.warm_sockets = []
+        self.lock = threading.Lock()
+        self.replenisher = ThreadPoolExecutor(max_workers=1)
+
+    def shell(self, command) -> str:
+        output = self.exec_service(f"shell:{command}")
+        return output.decode('utf-8', errors='replace').replace("\r\n", "\n")
+
+    def exec_out(self, command) -> bytes:
+        return self.exec_service(f"exec:{command}")
+
+    def exec_service(self, service) -> bytes:
+        stream = self.open_stream(service)
+        try:
+            return read_until_eof(stream)
+        finally:
+            stream.close()
+
+    def open_stream(self, service) -> socket.socket:
+        """Opens a device service and returns the socket positioned at the start of its output."""
+        stream = self.__take_warm_socket()
+        if stream is not None:
+            try:
+                send_request(stream, service)
+                read_status(stream)
+                stream.settimeout(self.command_timeout)
+                return stream
+            except (OSError, AdbClientError):
+                # the server drops idle transports when the device goes away, retry on a fresh connection
+                stream.close()
+        stream = self.__connect_transport()
+        try:
+            send_request(stream, service)
+            read_status(stream)
+        except BaseException:
+            stream.close()
+            raise
+        stream.settimeout(self.command_timeout)
+        return stream
+
+    def host_command(self, request) -> str:
+        with self.__connect() as connection:
+            send_request(connection, request)
+            read_status(connection)
+            length = int(read_exactly(connection, 4), 16)
+            return read_exactly(connection, length).decode('utf-8', errors='replace')
+
+    def close(self):
+        self.replenisher.shutdown(wait=False)
+        with self.lock:
+            warm_sockets, self.warm_sockets = self.warm_sockets, []
+        for stream in warm_sockets:
+            stream.close()
+
+    def __take_warm_socket(self):
+        with self.lock:
+            stream = self.warm_sockets.pop() if self.warm_sockets else None
+        self.replenisher.submit(self.__replenish)
+        return stream
+
+    def __replenish(self):
+        while True:
+            with self.lock:
+                if len(self.warm_sockets) >= self.pool_size:
+                    return
+            try:
+                stream = self.__connect_transport()
+            except (OSError, AdbClientError):
+                return
+            with self.lock:
+                self.warm_sockets.append(stream)
+
+    def __connect(self):
+        return socket.create_connection((self.host, self.port), timeout=self.timeout)
+
+    def __connect_transport(self):
+        stream = self.__connect()
+        try:
+            stream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            send_request(stream, f"host:transport:{self.serial}")
+            read_status(stream)
+        except BaseException:
+            stream.close()
+            raise
+        return stream
+
+
+def send_request(stream, request):
+    data = request.encode('utf-8')
+    stream.sendall(f"{len(data):04x}".encode('ascii') + data)
+
+
+def read_status(stream):
+    status = read_exactly(stream, 4)
+    if status == b"OKAY":
+        return
+    if status == b"FAIL":
+        length = int(read_exactly(stream, 4), 16)
+        raise AdbClientError(read_exactly(stream, length).decode('utf-8', errors='replace'))
+    raise AdbClientError(f"Unexpected adb server status: {status!r}")
+
+
+def read_exactly(stream, size) -> bytes:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        chunk = stream.recv_into(view[received:])
+        if chunk == 0:
+            raise AdbClientError("adb server closed the connection")
+        received += chunk
+    return bytes(buffer)
+
+
+def read_until_eof(stream) -> bytes:
+    chunks = []
+    while True:
+        chunk = stream.recv(65536)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+class AdbClientError(Exception):
+    pass
@@ -0,0 +1,159 @@
+import queue
+import shlex
+import subprocess
+import threading
+import uuid
+
+SHELL_OPERATORS = "|&;<>()"
+
+
+def to_device_command(command):
+    """Translates a run_adb command into the command line seen by the device shell.
+
+    Returns None when the command is not a plain `shell ...` call, or when the host shell would do more than
+    remove quotes (pipes, redirections, command substitution), so the caller falls back to a host subprocess.
+    """
+    if needs_host_shell(command):
+        return None
+    try:
+        tokens = shlex.split(command)
+    except ValueError:
+        return None
+    if len(tokens) < 2 or tokens[0] != "shell":
+        return None
+    # adb joins its arguments with spaces before handing them to the device shell
+    return " ".join(tokens[1:])
+
+
+def needs_host_shell(command):
+    """Tells whether the host shell would expand or interpret something beyond plain quoting."""
+    quote = None
+    escaped = False
+    for char in command:
+        if escaped:
+            escaped = False
+        elif quote == "'":
+            if char == quote:
+                quote = None
+        elif char in "$`":
+            return True
+        elif char == "\\":
+            escaped = True
+        elif quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char in SHELL_OPERATORS:
+            return True
+    return False
+
+
+class AdbShellSession:
+    """Long-lived `adb shell` process that runs commands sent over its stdin.
+
+    Every command is followed by a unique sentinel line carrying its exit code, so output of consecutive
+    commands never mixes. When the process dies (device dropped, adb server restarted) `run` raises
+    AdbSessionClosed with the output collected so far and the next call starts a new process. Its `sent` tells
+    whether the command may already have run on the device.
+    """
+
+    def __init__(self, adb_path, device_id, timeout=120):
+        self.adb_path = adb_path
+        self.device_id = device_id
+        self.timeout = timeout
+        self.process = None
+        self.lines = None
+        self.last_exit_code = None
+        self.lock = threading.Lock()
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.close()
+        self.process = subprocess.Popen(
+            [self.adb_path, "-s", self.device_id, "shell"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            encoding='utf-8',
+            errors='replace',
+            bufsize=1
+        )
+        self.lines = queue.Queue()
+        threading.Thread(target=self.__read_output, args=(self.process.stdout, self.lines), daemon=True).start()
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.process = None
+
+    def run(self, command) -> tuple[str, int]:
+        with self.lock:
+            if not self.is_alive():
+                self.start()
+            sentinel = f"__ADB_SESSION_{uuid.uuid4().hex}__"
+            try:
+                # subshell keeps `exit`/`cd` from leaking into the session, detached stdin keeps the command from
+                # swallowing the ones that follow
+                self.process.stdin.write(
+                    f"( {command}\n) </dev/null 2>&1; adb_session_rc=$?; echo; echo {sentinel}$adb_session_rc\n"
+                )
+                self.process.stdin.flush()
+            except OSError:
+                raise AdbSessionClosed(self.__drain(), sent=False)
+
+            output = []
+            while True:
+                try:
+                    line = self.lines.get(timeout=self.timeout)
+                except queue.Empty:
+                    self.close()
+                    raise AdbSessionClosed("".join(output) + f"adb shell session timeout after {self.timeout}s")
+                if line is None:
+                    self.close()
+                    raise AdbSessionClosed("".join(output))
+                if line.startswith(sentinel):
+                    self.last_exit_code = int(line[len(sentinel):].strip() or -1)
+                    break
+                output.append(line)
+
+            result = "".join(output)
+            # drop the newline emitted by the bare `echo` in front of the sentinel
+            if result.endswith("\n"):
+                result = result[:-1]
+            return result, self.last_exit_code
+
+    def __drain(self):
+        output = []
+        while self.lines is not None:
+            try:
+                line = self.lines.get(timeout=1)
+            except queue.Empty:
+                break
+            if line is None:
+                break
+            output.append(line)
+        self.close()
+        return "".join(output)
+
+    @staticmethod
+    def __read_output(stream, lines):
+        for line in iter(stream.readline, ''):
+            lines.put(line)
+        lines.put(None)
+
+
+class AdbSessionClosed(Exception):
+    def __init__(self, output, sent=True):
+        super().__init__(output)
+        self.output = output
+        self.sent = sent
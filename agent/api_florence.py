@@ -1,12 +1,14 @@
-import requests
 from PIL import Image
-import json
 
+from http_client import post_json
+from response_cache import response_cache
 from utils import encode_image
 
+IMAGE_FIELDS = ("image",)
+
 
 def create_local_florence_payload(prompt: str, image: Image):
-    base64_image = encode_image(image)
+    base64_image = encode_image(image, "grounding")
     payload = {
         "prompt": prompt,
         "image": base64_image
@@ -16,29 +18,15 @@ def create_local_florence_payload(prompt: str, image: Image):
 
 def query_florence(payload: dict, ip: str) -> tuple:
     url = f'http://{ip}/worker_generate'
-    while True:
-        try:
-            http_response = requests.post(url, json=payload, timeout=10)
-            assert http_response.status_code == 200, f"Request failed with status_code: {http_response.status_code}"
-        except:
-            pass
-        else:
-            break
-    output = json.loads(http_response.content)
+    output = response_cache.fetch(
+        url, payload, lambda: post_json(url, payload, timeout=10, binary_fields=IMAGE_FIELDS))
     points = output["click_point"]
     return points
 
 
 def query_florence_box(payload: dict, ip: str) -> tuple:
     url = f'http://{ip}/worker_generate'
-    while True:
-        try:
-            http_response = requests.post(url, json=payload, timeout=3)
-            assert http_response.status_code == 200, f"Request failed with status_code: {http_response.status_code}"
-        except:
-            pass
-        else:
-            break
-    output = json.loads(http_response.content)
+    output = response_cache.fetch(
+        url, payload, lambda: post_json(url, payload, timeout=3, binary_fields=IMAGE_FIELDS))
     points = output["box"]
     return points
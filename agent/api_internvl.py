@@ -1,8 +1,7 @@
-import base64
-import requests
-from io import BytesIO
-from PIL import Image
-import json
+from http_client import post_json, post_json_async
+from prompt_cache_stats import prompt_cache_stats
+from response_cache import response_cache
+from utils import encode_image
 
 MODEL_NAME = "internlm2"
 BASE_GENERATION_CONFIG = {
@@ -11,17 +10,8 @@ BASE_GENERATION_CONFIG = {
 }
 
 
-def encode_image(image):
-    image = Image.open(image)
-    image = image.convert('RGB')
-    buffered = BytesIO()
-    image.save(buffered, format="JPEG")
-    img_str_bytes = base64.b64encode(buffered.getvalue())
-    return img_str_bytes.decode("utf-8")
-
-
-def create_internvl_payload(prompt: str, images: list, previous_messages=None):
-    base64_images = [encode_image(image) for image in images]
+def create_internvl_payload(prompt: str, images: list, previous_messages=None, call_type="default"):
+    base64_images = [encode_image(image, call_type) for image in images]
     message_contents = [{
         "type": "text",
         "text": prompt
@@ -52,15 +42,18 @@ def create_internvl_payload(prompt: str, images: list, previous_messages=None):
     return payload
 
 
-def query_internvl(payload: dict, ip) -> dict:
+def query_internvl(payload: dict, ip, prompt_type="default") -> dict:
+    API_URL = f"http://{ip}/v1/chat/completions"
+    output = response_cache.fetch(API_URL, payload, lambda: prompt_cache_stats.observe(
+        prompt_type, payload, post_json(API_URL, payload, timeout=10)))
+    return output["choices"][0]
+
+
+async def query_internvl_async(payload: dict, ip, prompt_type="default") -> dict:
     API_URL = f"http://{ip}/v1/chat/completions"
-    while True:
-        try:
-            http_response = requests.post(API_URL, json=payload, timeout=10)
-            assert http_response.status_code == 200, f"Request failed with status_code: {http_response.status_code}"
-        except Exception as e:
-            print(e)
-        else:
-            break
-    output = json.loads(http_response.content)
+
+    async def query():
+        return prompt_cache_stats.observe(prompt_type, payload, await post_json_async(API_URL, payload, timeout=10))
+
+    output = await response_cache.fetch_async(API_URL, payload, query)
     return output["choices"][0]
@@ -1,4 +1,4 @@
-import requests
+from http_client import post_json
 
 
 def inference_chat(chat, model, api_url, token):
@@ -16,18 +16,5 @@ def inference_chat(chat, model, api_url, token):
     }
     for chat_dict in chat:
         data["messages"].append({"role": chat_dict['role'], "content": chat_dict['content']})
-    while True:
-        try:
-            res = requests.post(api_url, headers=headers, json=data)
-            res_json = res.json()
-            res_content = res_json['choices'][0]['message']['content']
-        except:
-            print("Network Error:")
-            try:
-                print(res.json())
-            except:
-                print("Request Failed")
-        else:
-            break
-
-    return res_content
+    res_json = post_json(api_url, data, timeout=200, headers=headers)
+    return res_json['choices'][0]['message']['content']
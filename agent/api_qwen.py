@@ -1,7 +1,8 @@
-import requests
 from PIL import Image
-import json
 
+from http_client import post_json
+from image_upload import image_uploader
+from response_cache import response_cache
 from utils import encode_image
 
 
@@ -16,19 +17,7 @@ def create_analysis_payload(instruction: str, images: list):
 
 def query_analysis(payload: dict, ip: str) -> dict:
     url = f'http://{ip}/worker_generate_analysis'
-    i = 0
-    while True:
-        try:
-            http_response = requests.post(url, json=payload, timeout=200)
-            assert http_response.status_code == 200, f"Request failed with status_code: {http_response.status_code}"
-        except Exception as e:
-            print(e)
-            if i == 10:
-                break
-            i += 1
-        else:
-            break
-    output = json.loads(http_response.content)
+    output = post_json(url, payload, timeout=200)
     return output
 
 
@@ -44,8 +33,8 @@ def create_qwen_payload(instruction, action_history, images: list, use_qwen: boo
 
 
 def create_qwen_payload_for_action(prompt: str, image: Image, instruction: str, action_history, use_eval: bool,
-                                   prompt_reflection, prompt_init_chat):
-    base64_images = encode_image(image)
+                                   prompt_reflection, prompt_init_chat, prompt_layout="legacy"):
+    base64_images = encode_image(image, "action")
     payload = {
         "prompt": prompt,
         "instruction": instruction,
@@ -55,23 +44,30 @@ def create_qwen_payload_for_action(prompt: str, image: Image, instruction: str,
         "prompt_reflection": prompt_reflection,
         "prompt_init_chat": prompt_init_chat
     }
+    # left out for the legacy layout, so payloads (and response cache keys) stay as they were
+    if prompt_layout != "legacy":
+        payload["prompt_layout"] = prompt_layout
     return payload
 
 
 def query_qwen(payload: dict, ip: str) -> dict:
     url = f'http://{ip}/worker_generate_plan'
-    i = 0
-    while True:
-        try:
-            http_response = requests.post(url, json=payload, timeout=200)
-            assert http_response.status_code == 200, f"Request failed with status_code: {http_response.status_code}"
-        except Exception as e:
-            print(e)
-            if i == 10:
-                break
-            i += 1
-        else:
-            break
-    output = json.loads(http_response.content)
+    output = response_cache.fetch(url, payload, lambda: image_uploader.post_json(url, payload, timeout=200))
+
+    return output
+
+
+def query_qwen_session(payload: dict, session) -> dict:
+    # cached under the full plan payload, so responses are shared with query_qwen
+    url = f'http://{session.ip}/worker_generate_plan'
+    output = response_cache.fetch(url, payload, lambda: session.step(payload))
+
+    return output
+
+
+async def query_qwen_async(payload: dict, ip: str) -> dict:
+    url = f'http://{ip}/worker_generate_plan'
+    output = await response_cache.fetch_async(
+        url, payload, lambda: image_uploader.post_json_async(url, payload, timeout=200))
 
     return output
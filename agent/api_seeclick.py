@@ -1,10 +1,9 @@
-import base64
-from io import BytesIO
-import json
 import logging
 from pathlib import Path
 from PIL import Image
-import requests
+
+from http_client import post_json
+from utils import encode_image
 
 SEECLICK_API_URL = "http://106.120.101.63:2334/v1/chat/completions"
 MODEL_NAME = "seeclick"
@@ -25,14 +24,6 @@ def inference_seeclick(instruction: str, image_path: Path, previous_messages=Non
     return response_seeclick
 
 
-def encode_image(image: Image):
-    image = image.convert("RGB")
-    buffered = BytesIO()
-    image.save(buffered, format="JPEG")
-    img_str_bytes = base64.b64encode(buffered.getvalue())
-    return img_str_bytes.decode("utf-8")
-
-
 def create_seeclick_payload(prompt: str, image: Image = None, previous_messages=None):
     message_contents = [{"type": "text", "text": prompt}]
     if image:
@@ -52,17 +43,7 @@ def create_seeclick_payload(prompt: str, image: Image = None, previous_messages=
 
 
 def query_seeclick(payload: dict) -> dict:
-    while True:
-        try:
-            http_response = requests.post(SEECLICK_API_URL, json=payload, timeout=10)
-            assert (
-                    http_response.status_code == 200
-            ), f"Request failed with status_code: {http_response.status_code}"
-        except:
-            pass
-        else:
-            break
-    output = json.loads(http_response.content)
+    output = post_json(SEECLICK_API_URL, payload, timeout=10)
     response = output["choices"][0]
     response = eval(response["message"]["content"])
     return response
@@ -0,0 +1,147 @@
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from exceptions import AdbException
+
+PACKAGE_LINE = re.compile(r"package:(\S+)(?:\s+versionCode:(\d+))?")
+
+
+def parse_package_versions(result) -> dict:
+    """Parses `cmd package list packages --show-versioncode` into package id -> versionCode."""
+    versions = {}
+    for line in result.splitlines():
+        match = PACKAGE_LINE.match(line.strip())
+        if match:
+            versions[match.group(1)] = match.group(2) or "0"
+    return versions
+
+
+class AppInventory:
+    """On-disk inventory of the launchable apps installed on a device.
+
+    Entries are stored per build fingerprint and carry the package versionCode, a scan only runs
+    `dumpsys package` for packages that are new or were updated since the last scan. Pulling the APKs and reading
+    their labels with aapt, the slow part, runs on a bounded worker pool with one temp directory per APK.
+    Packages without activities are remembered too, so they are not pulled again on the next scan.
+    """
+
+    def __init__(self, device, inventory_dir="../app_inventory", max_workers=4):
+        self.device = device
+        self.inventory_dir = inventory_dir
+        self.max_workers = max_workers
+        self.fingerprint = None
+
+    def get_fingerprint(self) -> str:
+        if self.fingerprint is None:
+            self.fingerprint = self.device.run_adb("shell getprop ro.build.fingerprint").strip()
+        return self.fingerprint
+
+    def get_inventory_path(self) -> str:
+        file_name = re.sub(r"[^A-Za-z0-9._-]", "_", self.get_fingerprint()) + ".json"
+        return os.path.join(self.inventory_dir, file_name)
+
+    def load(self) -> dict:
+        path = self.get_inventory_path()
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable app inventory {path}: {e}")
+            return {}
+
+    def save(self, entries):
+        os.makedirs(self.inventory_dir, exist_ok=True)
+        path = self.get_inventory_path()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def scan(self) -> dict:
+        """Updates the inventory and returns package id -> {label, activities, apk_path} of launchable apps."""
+        start = time.time()
+        entries = self.load()
+        versions = parse_package_versions(
+            self.device.run_adb("shell cmd package list packages --show-versioncode"))
+        stale = [package_id for package_id, version_code in versions.items()
+                 if entries.get(package_id, {}).get("version_code") != version_code]
+
+        to_label = []
+        for package_id in stale:
+            try:
+                package_info = self.device.run_adb(f"shell dumpsys package {package_id}")
+                apk_path = re.search(r"(?<=path:).*\.apk", package_info).group().strip()
+            except AttributeError:
+                continue
+            except AdbException as e:
+                print(f"Cannot read the package info of {package_id}: {e}")
+                continue
+            activities = sorted(set(re.findall(re.escape(package_id) + r".*Activity", package_info)))
+            entry = {"version_code": versions[package_id], "label": None, "activities": activities,
+                     "apk_path": apk_path}
+            if activities:
+                to_label.append((package_id, entry))
+            else:
+                entries[package_id] = entry
+
+        if to_label:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                labels = executor.map(lambda item: self.read_label(item[1]["apk_path"]), to_label)
+                for (package_id, entry), label in zip(to_label, labels):
+                    # failed pulls are not stored, so they are retried on the next scan
+                    if label is not None:
+                        entry["label"] = label
+                        entries[package_id] = entry
+
+        self.save(entries)
+        print(f"App inventory: {len(versions)} packages, {len(stale)} new or updated, "
+              f"{len(to_label)} APKs labelled in {time.time() - start:.1f}s")
+        return {
+            package_id: {"label": entry["label"], "activities": set(entry["activities"]),
+                         "apk_path": entry["apk_path"]}
+            for package_id, entry in entries.items()
+            if package_id in versions and entry["label"] is not None
+        }
+
+    def read_label(self, apk_path):
+        download_dir = tempfile.mkdtemp(prefix="tmp_apk_")
+        try:
+            self.device.run_adb(f"pull {shlex.quote(apk_path)} {shlex.quote(download_dir)}")
+            apk_info = subprocess.run(
+                f"{self.device.aapt_path} dump badging "
+                f"{shlex.quote(os.path.join(download_dir, apk_path.split('/')[-1]))}",
+                shell=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                encoding='utf-8'
+            ).stdout
+            self.device.check_adb_answer(apk_info)
+            search = re.search(r"(?<=application-label:).*", apk_info)
+            return search.group().strip().replace("'", "")
+        except AttributeError:
+            return None
+        except (AdbException, OSError) as e:
+            # one APK that cannot be pulled or read is skipped, the rest of the scan goes on
+            print(f"Cannot read the label of {apk_path}: {e}")
+            return None
+        finally:
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+    def get_cached_apps(self):
+        """Returns the launchable apps of the stored inventory that are still installed, without scanning. None if
+        nothing is stored yet."""
+        if not os.path.exists(self.get_inventory_path()):
+            return None
+        # one package list instead of a scan, it drops the apps uninstalled since the inventory was stored
+        installed = parse_package_versions(self.device.run_adb("shell cmd package list packages"))
+        return {package_id: entry for package_id, entry in self.load().items()
+                if package_id in installed and entry.get("label") is not None}
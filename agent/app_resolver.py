@@ -0,0 +1,100 @@
+import re
+import unicodedata
+from dataclasses import dataclass
+
+MIN_CONFIDENCE = 0.8
+# a runner-up scoring within this margin of the best match makes the lookup ambiguous
+AMBIGUITY_MARGIN = 0.1
+
+
+def normalize_app_name(name) -> str:
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w]+", " ", name.lower()).split())
+
+
+def trigrams(text) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(first, second) -> int:
+    if len(first) < len(second):
+        first, second = second, first
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (first_char != second_char)))
+        previous = current
+    return previous[-1]
+
+
+@dataclass(frozen=True)
+class AppMatch:
+    label: str
+    app_id: str
+    confidence: float
+    ambiguous: bool = False
+
+
+class AppResolver:
+    """Maps a free-form app name to an installed app without asking the LLM.
+
+    Built once from `[{"label", "id"}]`. A normalised exact match (ignoring case, accents, punctuation and spaces)
+    has confidence 1. Otherwise candidates sharing a token or trigram with the query are ranked by the best of
+    token overlap, trigram similarity and edit-distance similarity, so a typo or a missing word still scores high.
+    """
+
+    def __init__(self, apps):
+        self.apps = [(app["label"], app["id"], normalize_app_name(app["label"])) for app in apps]
+        self.exact = {}
+        self.token_index = {}
+        self.trigram_index = {}
+        self.trigrams = []
+        for index, (_, _, name) in enumerate(self.apps):
+            self.exact.setdefault(name.replace(" ", ""), index)
+            for token in name.split():
+                self.token_index.setdefault(token, set()).add(index)
+            self.trigrams.append(trigrams(name))
+            for trigram in self.trigrams[index]:
+                self.trigram_index.setdefault(trigram, set()).add(index)
+
+    def resolve(self, app_name):
+        """Returns the best AppMatch or None when no installed app shares anything with the name."""
+        query = normalize_app_name(app_name)
+        if query.replace(" ", "") in self.exact:
+            label, app_id, _ = self.apps[self.exact[query.replace(" ", "")]]
+            return AppMatch(label, app_id, 1.0)
+
+        query_tokens = set(query.split())
+        query_trigrams = trigrams(query)
+        candidates = set()
+        for token in query_tokens:
+            candidates |= self.token_index.get(token, set())
+        for trigram in query_trigrams:
+            candidates |= self.trigram_index.get(trigram, set())
+        if not candidates:
+            return None
+
+        scores = sorted(((self.score(query, query_tokens, query_trigrams, index), index) for index in candidates),
+                        reverse=True)
+        best_score, best_index = scores[0]
+        label, app_id, name = self.apps[best_index]
+        # apps sharing the label cannot be told apart by the LLM either
+        runner_up = next((score for score, index in scores[1:] if self.apps[index][2] != name), 0.0)
+        ambiguous = best_score - runner_up < AMBIGUITY_MARGIN
+        return AppMatch(label, app_id, round(best_score, 3), ambiguous)
+
+    def score(self, query, query_tokens, query_trigrams, index) -> float:
+        _, _, name = self.apps[index]
+        name_tokens = set(name.split())
+        token_score = len(query_tokens & name_tokens) / len(query_tokens | name_tokens)
+        name_trigrams = self.trigrams[index]
+        trigram_score = 2 * len(query_trigrams & name_trigrams) / (len(query_trigrams) + len(name_trigrams))
+        edit_score = 1 - edit_distance(query, name) / max(len(query), len(name))
+        return max(token_score, trigram_score, edit_score)
+
+    @staticmethod
+    def is_confident(match) -> bool:
+        return match is not None and match.confidence >= MIN_CONFIDENCE and not match.ambiguous
@@ -0,0 +1,95 @@
+import os
+import shutil
+import subprocess
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409
+CLONE_MODES = ["reflink", "overlay", "copy"]
+
+
+class AvdFileCloner:
+    """copy_function for shutil.copytree that avoids duplicating the multi-GB images of an AVD.
+
+    reflink: every file is cloned with a copy-on-write reflink (btrfs, XFS, ...), full copy where unsupported.
+    overlay: qcow2 disks become thin overlays backed by the source images. Raw .img disks that are the base of a
+             qcow2 file next to them (userdata-qemu.img, sdcard.img, cache.img, ...) and snapshot files (read-only
+             when the emulator runs with -no-snapshot-save) are hardlinked. A raw disk without such an overlay is
+             written by the emulator and gets a reflink, the remaining small files are copied. Disk state that
+             qemu keeps as internal snapshots of the source qcow2 images is not visible through an overlay, so
+             prefer reflink for AVDs that are started from a quick-boot snapshot.
+    copy:    plain full copy.
+    Files ending in .ini or .lock are always copied, because clone_avd rewrites them in place or the emulator
+    takes them per instance.
+    """
+
+    def __init__(self, mode="reflink", qemu_img_path="qemu-img"):
+        if mode not in CLONE_MODES:
+            raise ValueError(f"Unknown clone mode: {mode}")
+        self.mode = mode
+        self.qemu_img_path = qemu_img_path
+        self.bytes_written = 0
+        self.bytes_shared = 0
+
+    def __call__(self, src, dst):
+        if src.endswith((".ini", ".lock")) or self.mode == "copy":
+            return self.copy(src, dst)
+        if self.mode == "reflink":
+            return self.reflink(src, dst)
+        if src.endswith(".qcow2"):
+            return self.overlay(src, dst)
+        if src.endswith(".img"):
+            # only the qcow2 overlay of a base image is written, the emulator writes a raw disk without one itself
+            return self.hardlink(src, dst) if os.path.exists(src + ".qcow2") else self.reflink(src, dst)
+        if os.sep + "snapshots" + os.sep in src:
+            return self.hardlink(src, dst)
+        return self.copy(src, dst)
+
+    def copy(self, src, dst):
+        shutil.copy2(src, dst)
+        self.bytes_written += os.path.getsize(dst)
+        return dst
+
+    def reflink(self, src, dst):
+        if fcntl is None:
+            return self.copy(src, dst)
+        try:
+            with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            # filesystem without reflink support or source and target on different filesystems
+            return self.copy(src, dst)
+        shutil.copystat(src, dst)
+        self.bytes_shared += os.path.getsize(dst)
+        return dst
+
+    def hardlink(self, src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            return self.copy(src, dst)
+        self.bytes_shared += os.path.getsize(dst)
+        return dst
+
+    def overlay(self, src, dst):
+        try:
+            result = subprocess.run(
+                [self.qemu_img_path, "create", "-f", "qcow2", "-F", "qcow2", "-b", os.path.abspath(src), dst],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                encoding='utf-8'
+            )
+            returncode, output = result.returncode, result.stdout.strip()
+        except OSError as e:
+            returncode, output = -1, str(e)
+        if returncode != 0:
+            print(f"qemu-img overlay failed for {src}, copying instead: {output}")
+            if os.path.exists(dst):
+                os.remove(dst)
+            return self.copy(src, dst)
+        self.bytes_written += os.path.getsize(dst)
+        self.bytes_shared += os.path.getsize(src)
+        return dst
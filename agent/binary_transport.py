@@ -0,0 +1,43 @@
+import base64
+import json
+import struct
+
+FRAME_CONTENT_TYPE = "application/x-agent-frame"
+FRAME_MAGIC = b"AGF1"
+HEADER_LENGTH = struct.Struct(">I")
+
+
+def encode_frame(payload, binary_fields, decode=base64.b64decode) -> bytes:
+    """Serialises a payload with the `binary_fields` as raw bytes instead of base64 strings inside the JSON.
+
+    Layout: magic, big-endian uint32 length of a JSON header, the header, then the blobs back to back. The header
+    holds the remaining fields and the name and length of every blob. String values are taken as base64 and turned
+    into bytes by `decode`.
+    """
+    fields = dict(payload)
+    blobs = []
+    for field in binary_fields:
+        value = fields.pop(field, None)
+        if value is None:
+            continue
+        blobs.append((field, value if isinstance(value, bytes) else decode(value)))
+    header = json.dumps({"fields": fields, "blobs": [[field, len(blob)] for field, blob in blobs]},
+                        separators=(",", ":")).encode("utf-8")
+    return b"".join([FRAME_MAGIC, HEADER_LENGTH.pack(len(header)), header, *(blob for _, blob in blobs)])
+
+
+def decode_frame(body) -> dict:
+    """Inverse of encode_frame, blob fields come back as bytes."""
+    if body[:len(FRAME_MAGIC)] != FRAME_MAGIC:
+        raise ValueError("Not a binary frame")
+    offset = len(FRAME_MAGIC) + HEADER_LENGTH.size
+    header_length, = HEADER_LENGTH.unpack_from(body, len(FRAME_MAGIC))
+    header = json.loads(body[offset:offset + header_length])
+    offset += header_length
+    params = header["fields"]
+    for field, length in header["blobs"]:
+        if offset + length > len(body):
+            raise ValueError(f"Binary frame truncated in field {field}")
+        params[field] = bytes(body[offset:offset + length])
+        offset += length
+    return params
@@ -1,88 +1,36 @@
-import copy
+from chat_history import ChatHistory
 from utils import encode_image
 
 
 def init_action_chat():
-    operation_history = []
     sysetm_prompt = 'You are a helpful AI mobile phone operating assistant. You need to help me operate the phone to complete the user\'s instruction.'
-    operation_history.append({'role': 'system', 'content': [{'type': 'text', 'text': sysetm_prompt}]})
-    return operation_history
+    return ChatHistory().append_text('system', sysetm_prompt)
 
 
 def init_reflect_chat():
-    operation_history = []
     sysetm_prompt = 'You are a helpful AI mobile phone operating assistant.'
-    operation_history.append({'role': 'system', 'content': [{'type': 'text', 'text': sysetm_prompt}]})
-    return operation_history
+    return ChatHistory().append_text('system', sysetm_prompt)
 
 
 def init_process_chat():
-    operation_history = []
     sysetm_prompt = 'You are a helpful AI mobile phone operating assistant. You need to help me say what is completed.'
-    operation_history.append({'role': 'system', 'content': [{'type': 'text', 'text': sysetm_prompt}]})
-    return operation_history
+    return ChatHistory().append_text('system', sysetm_prompt)
 
 
 def init_memory_chat():
-    operation_history = []
     sysetm_prompt = 'You are a helpful AI mobile phone operating assistant.'
-    operation_history.append({'role': 'system', 'content': [{'type': 'text', 'text': sysetm_prompt}]})
-    return operation_history
+    return ChatHistory().append_text('system', sysetm_prompt)
 
 
 def add_response(role, prompt, chat_history, image=None):
-    new_chat_history = copy.deepcopy(chat_history)
-    if image:
-        base64_image = encode_image(image)
-        content = [
-            {
-                'type': 'text',
-                'text': prompt
-            },
-            {
-                'type': 'image_url',
-                'image_url': {
-                    'url': f'data:image/jpeg;base64,{base64_image}'
-                }
-            },
-        ]
-    else:
-        content = [
-            {
-                'type': 'text',
-                'text': prompt
-            },
-        ]
-    new_chat_history.append({'role': role, 'content': content})
-    return new_chat_history
+    image_urls = [f'data:image/jpeg;base64,{encode_image(image)}'] if image else []
+    return ChatHistory.of(chat_history).append_text(role, prompt, image_urls)
 
 
 def add_response_two_image(role, prompt, chat_history, image):
-    new_chat_history = copy.deepcopy(chat_history)
-
-    base64_image1 = encode_image(image[0])
-    base64_image2 = encode_image(image[1])
-    content = [
-        {
-            'type': 'text',
-            'text': prompt
-        },
-        {
-            'type': 'image_url',
-            'image_url': {
-                'url': f'data:image/jpeg;base64,{base64_image1}'
-            }
-        },
-        {
-            'type': 'image_url',
-            'image_url': {
-                'url': f'data:image/jpeg;base64,{base64_image2}'
-            }
-        },
-    ]
-
-    new_chat_history.append({'role': role, 'content': content})
-    return new_chat_history
+    image_urls = [f'data:image/jpeg;base64,{encode_image(image[0])}',
+                  f'data:image/jpeg;base64,{encode_image(image[1])}']
+    return ChatHistory.of(chat_history).append_text(role, prompt, image_urls)
 
 
 def print_status(chat_history):
@@ -105,4 +53,4 @@ Status: "success" or "failure"
 Rate: 1-10 <scale in 1-10 how much convinced are you>
 """}]}
 
-    return operation_history
+    return ChatHistory.of([operation_history])
@@ -12,6 +12,8 @@ def __parse_args() -> argparse.Namespace:
     parser.add_argument("--qwen", type=str, required=False)
     parser.add_argument("--internvl", type=str, required=False)
     parser.add_argument("--florence", type=str, required=False)
+    parser.add_argument("--use-sessions", type=str, required=False,
+                        help="keep the task's static prompts on the host server and send only per-step changes")
     # models
     parser.add_argument("--use-eval", type=str, required=False)
     parser.add_argument("--use-florence-only", type=str, required=False)
@@ -23,6 +25,8 @@ def __parse_args() -> argparse.Namespace:
     # prompts
     parser.add_argument("--do-stop", type=str, required=False)
     parser.add_argument("--option", type=str, required=False)
+    parser.add_argument("--prompt-layout", type=str, choices=['legacy', 'prefix'], required=False,
+                        help="prefix: static instructions first and per-step content last, for prefix caching")
     # android
     parser.add_argument("--adb-path", type=str, required=False)
     parser.add_argument("--aapt-path", type=str, required=False,
@@ -37,6 +41,37 @@ def __parse_args() -> argparse.Namespace:
     parser.add_argument("--avd-name", type=str, required=False)
     parser.add_argument("--run-apps-through-adb", action="store_true", required=False)
     parser.add_argument("--snapshot", type=str, required=False)
+    parser.add_argument("--adb-backend", type=str, choices=['subprocess', 'session', 'native'],
+                        required=False,
+                        help="subprocess: spawn adb for every command\n"
+                             "session: keep one persistent adb shell per device\n"
+                             "native: talk to the adb server on port 5037 directly")
+    parser.add_argument("--screenshot-mode", type=str, choices=['png', 'raw'], required=False,
+                        help="png: screencap -p through a file\n"
+                             "raw: decode raw framebuffer in memory, save file in background")
+    parser.add_argument("--clone-mode", type=str, choices=['reflink', 'overlay', 'copy'], required=False,
+                        help="how AVDs are cloned when an emulator is reset")
+    parser.add_argument("--app-labels-from-inventory", type=str, required=False,
+                        help="take the app labels of the app prompt from the device's app inventory, not apps.json")
+    # settle
+    parser.add_argument("--use-settle", type=str, required=False)
+    parser.add_argument("--settle-metric", type=str, choices=['pixel', 'dhash'], required=False)
+    parser.add_argument("--settle-threshold", type=float, required=False)
+    parser.add_argument("--settle-timeout", type=float, required=False)
+    # encoding
+    parser.add_argument("--jpeg-quality", type=int, required=False)
+    parser.add_argument("--jpeg-subsampling", type=str, choices=['4:4:4', '4:2:2', '4:2:0'], required=False)
+    parser.add_argument("--image-policy", type=str, required=False,
+                        help="per call type downscaling, call_type:max_side[:quality] separated by commas\n"
+                             "call types: action, analysis, reflection, memory, grounding")
+    # cache
+    parser.add_argument("--response-cache", type=str, choices=['off', 'on', 'record', 'replay'], required=False,
+                        help="on: serve cached model responses, query and store misses\n"
+                             "record: always query and store\n"
+                             "replay: only serve cached responses, fail on a miss")
+    parser.add_argument("--response-cache-path", type=str, required=False)
+    parser.add_argument("--response-cache-ttl", type=float, required=False)
+    parser.add_argument("--response-cache-max-entries", type=int, required=False)
     # others
     parser.add_argument("--max-steps", type=str, required=False)
     parser.add_argument("--eval-save-folder", type=str, required=False)
@@ -65,7 +100,8 @@ def __get_config_args() -> argparse.Namespace:
         [
             "qwen",
             "internvl",
-            "florence"
+            "florence",
+            "use_sessions"
         ],
         args
     )
@@ -94,7 +130,8 @@ def __get_config_args() -> argparse.Namespace:
         "Prompts",
         [
             "do_stop",
-            "option"
+            "option",
+            "prompt_layout"
         ],
         args
     )
@@ -109,7 +146,43 @@ def __get_config_args() -> argparse.Namespace:
             "device_id",
             "avd_name",
             "snapshot",
-            "run_apps_through_adb"
+            "run_apps_through_adb",
+            "adb_backend",
+            "screenshot_mode",
+            "clone_mode",
+            "app_labels_from_inventory"
+        ],
+        args
+    )
+    new_config["settle"] = __parse_config_section(
+        config_ini,
+        "Settle",
+        [
+            "use_settle",
+            "settle_metric",
+            "settle_threshold",
+            "settle_timeout"
+        ],
+        args
+    )
+    new_config["encoding"] = __parse_config_section(
+        config_ini,
+        "Encoding",
+        [
+            "jpeg_quality",
+            "jpeg_subsampling",
+            "image_policy"
+        ],
+        args
+    )
+    new_config["cache"] = __parse_config_section(
+        config_ini,
+        "Cache",
+        [
+            "response_cache",
+            "response_cache_path",
+            "response_cache_ttl",
+            "response_cache_max_entries"
         ],
         args
     )
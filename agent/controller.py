@@ -1,23 +1,74 @@
+import functools
 import os
 import re
+import shlex
 import shutil
 import time
 import subprocess
+from dataclasses import dataclass
 
 from PIL import Image
 import json
 
+from adb_client import AdbClient, AdbClientError
+from adb_session import AdbShellSession, AdbSessionClosed, to_device_command
 from api_internvl import create_internvl_payload, query_internvl
+from app_inventory import AppInventory
+from app_resolver import AppResolver, normalize_app_name
+from avd_clone import AvdFileCloner
+from exceptions import AndroidEmulatorException, AdbException
 from prompt import get_relevant_app_prompt
+from screencap import ScreenshotWriter, read_raw_screencap
 
+CLEAR_FIELD_KEY_PRESSES = 30
+KEYCODE_ENTER = "66"
+KEYCODE_DEL = "67"
 
-def clone_avd(src_avd_name, tar_avd_name, android_avd_home):
+STATE_SECTION_MARKER = "__DEVICE_STATE__"
+STATE_PROBE_COMMANDS = [
+    "dumpsys activity activities | grep mLastFocusedRootTask",
+    "dumpsys input_method | grep -E 'mInputShown|isInputViewShown'",
+    "dumpsys input | grep -m 1 SurfaceOrientation",
+]
+
+
+@dataclass(frozen=True)
+class DeviceState:
+    focused_task: str
+    is_home_screen: bool
+    keyboard_open: bool
+    screen_size: tuple[int, int]
+    rotation: int
+
+
+@functools.lru_cache(maxsize=None)
+def read_apps_json(path, mtime) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def load_apps_json(path) -> dict:
+    # parsed once per file version instead of on every AndroidDevice construction
+    return read_apps_json(path, os.path.getmtime(path))
+
+
+def default_qemu_img_path(emu_path):
+    # qemu-img ships next to the emulator binary in the Android SDK
+    emu_dir = os.path.dirname(emu_path or "")
+    return os.path.join(emu_dir, "qemu-img") if emu_dir else "qemu-img"
+
+
+def clone_avd(src_avd_name, tar_avd_name, android_avd_home, clone_mode="reflink", qemu_img_path="qemu-img"):
     src_avd_dir = os.path.join(android_avd_home, src_avd_name + '.avd')
     tar_avd_dir = os.path.join(android_avd_home, tar_avd_name + '.avd')
     src_ini_file = os.path.join(android_avd_home, src_avd_name + '.ini')
     tar_ini_file = os.path.join(android_avd_home, tar_avd_name + '.ini')
     if not os.path.exists(tar_avd_dir):
-        shutil.copytree(str(src_avd_dir), str(tar_avd_dir))
+        start = time.time()
+        cloner = AvdFileCloner(clone_mode, qemu_img_path)
+        shutil.copytree(str(src_avd_dir), str(tar_avd_dir), copy_function=cloner)
+        print(f"Cloned AVD {src_avd_name} -> {tar_avd_name} ({clone_mode}) in {time.time() - start:.1f}s, "
+              f"{cloner.bytes_written} bytes written, {cloner.bytes_shared} bytes shared")
 
     with open(src_ini_file, 'r') as src_ini, open(tar_ini_file, 'w') as tar_ini:
         for line in src_ini:
@@ -56,12 +107,29 @@ class AndroidDevice:
                  avd_name=None,
                  snapshot=None,
                  emu_path=None,
-                 run_apps_adb=True
+                 run_apps_adb=True,
+                 adb_backend="subprocess",
+                 screenshot_mode="png",
+                 clone_mode="reflink",
+                 app_inventory_dir="../app_inventory",
+                 app_labels_from_inventory=False
                  ):
         self.device_id = device_id
         self.adb_path = adb_path
         self.aapt_path = aapt_path
         self.is_emu = False
+        self.adb_backend = adb_backend
+        self.shell_session = None
+        self.adb_client = None
+        if adb_backend == "session":
+            self.shell_session = AdbShellSession(adb_path, device_id)
+        elif adb_backend == "native":
+            self.adb_client = AdbClient(device_id)
+        self.screenshot_mode = screenshot_mode
+        self.screenshot_writer = ScreenshotWriter()
+        self.last_screenshot_stats = None
+        self.screen_size = None
+        self.rotation = None
         print("Android Device: ", is_emu, android_avd_home, avd_name)
         if is_emu:
             self.is_emu = True
@@ -71,6 +139,7 @@ class AndroidDevice:
             self.avd_name = avd_name
             self.snapshot = snapshot
             self.emu_path = emu_path
+            self.clone_mode = clone_mode
             self.start_emulator()
         # ensure adb daemon is running
         subprocess.run(
@@ -83,6 +152,11 @@ class AndroidDevice:
         self.installed_apps_labels = None
         self.installed_apps_dict = None
         self.installed_apps = None
+        self.app_inventory = AppInventory(self, app_inventory_dir)
+        self.app_labels_from_inventory = app_labels_from_inventory
+        self.app_resolver = None
+        # normalised app name -> (label, package id), filled by find_closest_app_internvl
+        self.resolved_apps = {}
         if run_apps_adb:
             print("ANDROID DEVICE INIT APP LIST GET")
             self.installed_apps_dict, self.installed_apps_labels = self.get_app_list_json()
@@ -103,6 +177,7 @@ class AndroidDevice:
         if not self.is_emu:
             return
         self.run_adb(f"emu kill")
+        self.close_shell_session()
         if self.emu_process is not None:
             self.emu_process.terminate()
             self.emu_process = None
@@ -120,6 +195,17 @@ class AndroidDevice:
         self.run_adb("-e reboot")
         self.wait_until_device_has_started()
 
+    def load_snapshot(self, snapshot=None):
+        if not self.is_emu:
+            return
+        snapshot = snapshot or self.snapshot
+        result = self.run_adb(f"emu avd snapshot load {snapshot}")
+        if "KO" in result:
+            raise AndroidEmulatorException(f"Cannot load snapshot {snapshot}: {result.strip()}")
+        self.screen_size = None
+        self.rotation = None
+        self.wait_until_device_has_started()
+
     def is_emulator(self):
         return self.is_emu
 
@@ -154,13 +240,15 @@ class AndroidDevice:
                 os.remove(cache_avd_ini_path)
             time.sleep(2)
             # Clone the source AVD and start the emulator
-            clone_avd(self.source_avd_name, self.avd_name, self.android_avd_home)
+            clone_avd(self.source_avd_name, self.avd_name, self.android_avd_home, self.clone_mode,
+                      default_qemu_img_path(self.emu_path))
         except OSError as e:
             print(f"Failed to reset the emulator: {e}")
             import traceback
             print(traceback.format_exc())
 
     def reset_adb(self):
+        self.close_shell_session()
         subprocess.run(
             f"{self.adb_path} kill-server",
             shell=True,
@@ -177,7 +265,17 @@ class AndroidDevice:
         )
         time.sleep(1)
 
+    def close_shell_session(self):
+        if self.shell_session is not None:
+            self.shell_session.close()
+
     def run_adb(self, command) -> str:
+        if self.adb_backend != "subprocess":
+            device_command = to_device_command(command)
+            if device_command is not None and self.shell_session is not None:
+                return self.run_adb_session(device_command)
+            if device_command is not None and self.adb_client is not None:
+                return self.run_adb_native(device_command)
         adb_command = f"{self.adb_path} -s {self.device_id} {command}"
         result = subprocess.run(
             adb_command,
@@ -189,6 +287,33 @@ class AndroidDevice:
         self.check_adb_answer(result)
         return result
 
+    def run_adb_session(self, device_command) -> str:
+        try:
+            try:
+                result, _ = self.shell_session.run(device_command)
+            except AdbSessionClosed as e:
+                # a command that reached the device (e.g. `input tap`) must not run twice, only an unsent one is
+                # repeated on a new session
+                if e.sent:
+                    raise
+                result, _ = self.shell_session.run(device_command)
+        except AdbSessionClosed as e:
+            self.check_adb_answer(e.output)
+            raise AdbException(f"Persistent adb shell closed: {e.output.strip()}")
+        self.check_adb_answer(result)
+        return result
+
+    def run_adb_native(self, device_command) -> str:
+        try:
+            result = self.adb_client.shell(device_command)
+        except AdbClientError as e:
+            self.check_adb_answer(str(e))
+            raise AdbException(f"adb server error: {e}")
+        except OSError as e:
+            raise AdbException(f"Cannot reach adb server: {e}")
+        self.check_adb_answer(result)
+        return result
+
     def check_adb_answer(self, result):
         if f"device '{self.device_id}' not found" in result \
                 or "adb: device offline" in result:
@@ -196,15 +321,96 @@ class AndroidDevice:
                                "Restart emulator / check USB/WIFI adb connection / restart adb server")
 
     def get_screen_size(self) -> tuple[int, int]:
-        result = self.run_adb(f"shell wm size")
+        if self.screen_size is None:
+            self.screen_size = self.parse_screen_size(self.run_adb(f"shell wm size"))
+        return self.screen_size
+
+    @staticmethod
+    def parse_screen_size(result) -> tuple[int, int]:
         resolution_line = result.strip().splitlines()[-1]
         width, height = map(int, resolution_line.split(' ')[-1].split('x'))
         return width, height
 
+    def get_device_state(self) -> DeviceState:
+        """Collects focus, keyboard, rotation and (when not cached yet) screen size in a single adb call."""
+        commands = list(STATE_PROBE_COMMANDS)
+        if self.screen_size is None:
+            commands.append("wm size")
+        probe = f"; echo {STATE_SECTION_MARKER}; ".join(commands)
+        result = self.run_adb(f"shell \"{probe}\"")
+        sections = result.split(STATE_SECTION_MARKER)
+        sections += [""] * (len(commands) - len(sections))
+        focused_task, input_method, orientation = sections[:3]
+
+        rotation = self.parse_rotation(orientation)
+        if rotation != self.rotation:
+            # wm size follows the display configuration, re-read it after the device was rotated
+            if self.rotation is not None:
+                self.screen_size = None
+            self.rotation = rotation
+        if self.screen_size is None:
+            size_output = sections[3] if len(commands) > 3 else self.run_adb(f"shell wm size")
+            self.screen_size = self.parse_screen_size(size_output)
+
+        return DeviceState(
+            focused_task=focused_task.strip(),
+            is_home_screen="type=home" in focused_task,
+            keyboard_open="mInputShown=true" in input_method or "isInputViewShown=true" in input_method,
+            screen_size=self.screen_size,
+            rotation=rotation
+        )
+
+    @staticmethod
+    def parse_rotation(result) -> int:
+        rotation = re.search(r"SurfaceOrientation:\s*(\d+)", result)
+        return int(rotation.group(1)) if rotation else 0
+
     def get_screenshot(self, file_path) -> Image:
-        self.run_adb(f"exec-out screencap -p > {file_path}")
-        Image.open(file_path, formats=["png"]).convert('RGB').save(file_path)
-        return Image.open(file_path)
+        start = time.time()
+        if self.screenshot_mode == "raw":
+            image, bytes_read = self.get_raw_screenshot()
+            # the image is served from memory, the file is written in the background for logs and trajectories
+            image.filename = file_path
+            self.screenshot_writer.save(image, file_path)
+        else:
+            self.run_adb(f"exec-out screencap -p > {file_path}")
+            bytes_read = os.path.getsize(file_path)
+            Image.open(file_path, formats=["png"]).convert('RGB').save(file_path)
+            image = Image.open(file_path)
+        self.last_screenshot_stats = {"latency": time.time() - start, "bytes": bytes_read}
+        print(f"Screenshot ({self.screenshot_mode}): {self.last_screenshot_stats['latency']:.3f}s, "
+              f"{bytes_read} bytes")
+        return image
+
+    def get_raw_screenshot(self) -> tuple[Image.Image, int]:
+        if self.adb_client is not None:
+            try:
+                stream = self.adb_client.open_stream("exec:screencap")
+            except AdbClientError as e:
+                self.check_adb_answer(str(e))
+                raise AdbException(f"adb server error: {e}")
+            try:
+                return read_raw_screencap(stream.recv_into)
+            finally:
+                stream.close()
+
+        process = subprocess.Popen(
+            [self.adb_path, "-s", self.device_id, "exec-out", "screencap"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        try:
+            return read_raw_screencap(process.stdout.readinto)
+        except ValueError:
+            self.check_adb_answer(process.stderr.read().decode('utf-8', errors='replace'))
+            raise
+        finally:
+            process.stdout.close()
+            process.wait()
+            process.stderr.close()
+
+    def wait_for_screenshots(self):
+        self.screenshot_writer.wait()
 
     def is_keyboard_open(self):
         result = self.run_adb(f"shell dumpsys input_method")
@@ -212,30 +418,29 @@ class AndroidDevice:
 
         return keyboard_open
 
-    def tap(self, x, y):
+    def tap(self, x, y, wait=True):
         self.run_adb(f" shell input tap {x} {y}")
-        time.sleep(1)
+        if wait:
+            time.sleep(1)
 
     def type(self, text):
-        for _ in range(30):
-            self.run_adb(f"shell input keyevent 67")
+        self.run_device_command(f"input keyevent {' '.join([KEYCODE_DEL] * CLEAR_FIELD_KEY_PRESSES)}")
 
         text = text.replace("\\n", "_").replace("\n", "_")
-        for char in text:
-            if char == ' ':
-                self.run_adb(f"shell input text %s")
-            elif char == '_':
-                self.run_adb(f"shell input keyevent 66")
-            elif 'a' <= char <= 'z' or 'A' <= char <= 'Z' or char.isdigit():
-                self.run_adb(f" shell input text {char}")
-            elif char in '-.,!?@\'°/:;()':
-                self.run_adb(f"shell input text \"{char}\"")
+        for kind, segment in split_text_segments(text):
+            if kind == "enter":
+                self.run_device_command(f"input keyevent {' '.join([KEYCODE_ENTER] * len(segment))}")
+            elif kind == "text":
+                self.run_device_command(f"input text {shlex.quote(segment.replace(' ', '%s'))}")
             else:
-                self.run_adb(f"shell am broadcast -a ADB_INPUT_TEXT --es msg \"{char}\"")
+                self.run_device_command(f"am broadcast -a ADB_INPUT_TEXT --es msg {shlex.quote(segment)}")
         time.sleep(0.3)
         self.run_adb(f"shell input keyevent 66")
         time.sleep(0.5)
 
+    def run_device_command(self, device_command) -> str:
+        return self.run_adb(f"shell {shlex.quote(device_command)}")
+
     def slide(self, action, x, y):
         print(">>> slide: ", action)
         if "bottom-to-up" in action:
@@ -285,54 +490,7 @@ class AndroidDevice:
     def get_application_list(self, renew=False) -> dict:
         if self.installed_apps is not None and not renew:
             return self.installed_apps
-
-        installed_apps = dict()
-        path_to_download_apk = './tmp_apk'
-
-        packages = self.run_adb(f"shell cmd package list packages")
-        package_list = packages.splitlines()
-        for package in package_list:
-            try:
-                package_id = package.split(":")[1]
-
-                package_info = self.run_adb(f"shell dumpsys package {package_id}")
-
-                apk_path = re.search(r"(?<=path:).*\.apk", package_info).group().strip()
-
-                activities = set()
-                for match in re.findall(package_id + r".*Activity", package_info):
-                    activities.add(match)
-                if len(activities) == 0:
-                    continue
-
-                if not os.path.exists(path_to_download_apk):
-                    os.makedirs(path_to_download_apk, exist_ok=True)
-                apk_name = apk_path.split("/")[-1]
-                try:
-                    self.run_adb(f"pull {apk_path} {path_to_download_apk}")
-                    apk_info = subprocess.run(
-                        f"{self.aapt_path} dump badging {os.path.join(path_to_download_apk, apk_name)}",
-                        shell=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.STDOUT,
-                        encoding='utf-8'
-                    ).stdout
-                    self.check_adb_answer(apk_info)
-                    search = re.search(r"(?<=application-label:).*", apk_info)
-                    apk_label = search.group().strip().replace("'", "")
-                except Exception:
-                    continue
-                finally:
-                    os.remove(os.path.join(path_to_download_apk, apk_name))
-                installed_apps[package_id] = {
-                    "label": apk_label,
-                    "activities": activities,
-                    "apk_path": apk_path,
-
-                }
-            except Exception:
-                continue
-        self.installed_apps = installed_apps
+        self.installed_apps = self.app_inventory.scan()
         return self.installed_apps
 
     # DO NOT USE WITH EMULATOR
@@ -341,24 +499,46 @@ class AndroidDevice:
         self.run_adb(f"shell pm clear --cache-only {app_id}")
 
     def get_app_list_json(self):
-        with open("../apps.json", "r") as f:
-            content = json.load(f)
-            app_list, labels = [], []
-            for key, value in content.items():
-                app_list.append({"label": value["label"], "id": key})
-                labels.append(value["label"])
+        # the curated apps.json stays the label list of the app prompt unless the device inventory is asked for
+        content = self.app_inventory.get_cached_apps() if self.app_labels_from_inventory else None
+        if content is None:
+            content = load_apps_json("../apps.json")
+        app_list, labels = [], []
+        for key, value in content.items():
+            app_list.append({"label": value["label"], "id": key})
+            labels.append(value["label"])
 
-            return app_list, labels
+        return app_list, labels
 
     def find_closest_app_internvl(self, app_name, ip_internvl):
+        key = normalize_app_name(app_name)
+        if key in self.resolved_apps:
+            app, app_id = self.resolved_apps[key]
+            print(f"Application (memoised): {app}")
+            self.run_app(app_id)
+            return app
+
+        if self.app_resolver is None and self.installed_apps_dict is not None:
+            self.app_resolver = AppResolver(self.installed_apps_dict)
+        match = self.app_resolver.resolve(app_name) if self.app_resolver is not None else None
+        if AppResolver.is_confident(match):
+            print(f"Application (local match, confidence {match.confidence}): {match.label}")
+            self.resolved_apps[key] = (match.label, match.app_id)
+            self.run_app(match.app_id)
+            return match.label
+        if match is not None:
+            print(f"Local app match {match.label} not trusted (confidence {match.confidence}, "
+                  f"ambiguous {match.ambiguous}), asking InternVL")
+
         prompt = get_relevant_app_prompt(app_name, self.installed_apps_labels)
         payload = create_internvl_payload(prompt, [])
         try:
-            analysis = query_internvl(payload, ip=ip_internvl)["message"]["content"]
+            analysis = query_internvl(payload, ip=ip_internvl, prompt_type="app")["message"]["content"]
             app = re.search(r"app:\s*(.*)", analysis).group(1)
             print("Application: ", app)
             app_id = [item["id"] for item in self.installed_apps_dict if item['label'].lower() == app.lower()]
             print("Found app id to launch: ", app_id[0])
+            self.resolved_apps[key] = (app, app_id[0])
             self.run_app(app_id[0])
             return app
         except Exception as e:
@@ -366,9 +546,22 @@ class AndroidDevice:
             return None
 
 
-class AndroidEmulatorException(Exception):
-    pass
-
-
-class AdbException(Exception):
-    pass
+def split_text_segments(text) -> list[tuple[str, str]]:
+    """Groups text into runs typed with one adb call each.
+
+    `_` becomes enter, printable ASCII goes through `input text` and everything `input text` cannot type
+    (non-ASCII, `%` which it treats as an escape) is sent as one ADB_INPUT_TEXT broadcast per run.
+    """
+    segments = []
+    for char in text:
+        if char == '_':
+            kind = "enter"
+        elif ' ' <= char <= '~' and char != '%':
+            kind = "text"
+        else:
+            kind = "broadcast"
+        if segments and segments[-1][0] == kind:
+            segments[-1] = (kind, segments[-1][1] + char)
+        else:
+            segments.append((kind, char))
+    return segments
@@ -0,0 +1,196 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from controller import AndroidDevice, AndroidEmulatorException, AdbException, clone_avd, default_qemu_img_path
+
+# a waiting lease notices every LEASE_POLL_INTERVAL seconds that the pool lost all its emulators
+LEASE_POLL_INTERVAL = 5.0
+
+
+def default_avd_home():
+    return os.environ.get("ANDROID_AVD_HOME", os.path.join(os.path.expanduser("~"), ".android", "avd"))
+
+
+class EmulatorPool:
+    """Keeps `size` booted emulators and hands them out to workers.
+
+    Every emulator runs its own clone of the source AVD on a distinct console port. A returned emulator is reset by
+    loading the quick-boot snapshot through the emulator console instead of being killed and cold booted again.
+    An emulator that cannot be reset at all is killed and a new one booted in its place.
+    """
+
+    def __init__(self,
+                 size,
+                 avd_name,
+                 emu_path="emulator",
+                 adb_path="adb",
+                 aapt_path="aapt",
+                 snapshot="default_boot",
+                 android_avd_home=None,
+                 base_port=5554,
+                 adb_backend="subprocess",
+                 clone_mode="reflink"
+                 ):
+        self.size = size
+        self.avd_name = avd_name
+        self.emu_path = emu_path
+        self.adb_path = adb_path
+        self.aapt_path = aapt_path
+        self.snapshot = snapshot
+        self.android_avd_home = android_avd_home or default_avd_home()
+        self.base_port = base_port
+        self.adb_backend = adb_backend
+        self.clone_mode = clone_mode
+        self.devices = []
+        self.available = queue.Queue()
+        self.lease_started = {}
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.metrics = {
+            "boot_times": [],
+            "reset_times": [],
+            "cold_restarts": 0,
+            "replaced": 0,
+            "lost": 0,
+            "leases": 0,
+            "busy_time": 0.0
+        }
+
+    def start(self):
+        self.started_at = time.time()
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            futures = [executor.submit(self.__boot_emulator, index) for index in range(self.size)]
+        errors = []
+        for future in futures:
+            try:
+                device = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            # booted emulators are kept even if another one failed, so shutdown() kills them
+            self.devices.append(device)
+            self.available.put(device)
+        if errors:
+            raise errors[0]
+        return self
+
+    def lease(self, timeout=None) -> AndroidDevice:
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self.lock:
+                if not self.devices:
+                    raise AndroidEmulatorException("Every emulator of the pool was lost")
+            wait = LEASE_POLL_INTERVAL if deadline is None else min(LEASE_POLL_INTERVAL, deadline - time.time())
+            try:
+                device = self.available.get(timeout=max(0.0, wait))
+                break
+            except queue.Empty:
+                if deadline is not None and time.time() >= deadline:
+                    raise
+        with self.lock:
+            self.lease_started[device.device_id] = time.time()
+            self.metrics["leases"] += 1
+        return device
+
+    def release(self, device):
+        with self.lock:
+            self.metrics["busy_time"] += time.time() - self.lease_started.pop(device.device_id)
+        start = time.time()
+        try:
+            device.load_snapshot(self.snapshot)
+        except (AndroidEmulatorException, AdbException) as e:
+            print(f"Snapshot reset of {device.device_id} failed, cold restarting: {e}")
+            try:
+                device.restart_emulator()
+            except Exception as e:
+                print(f"Cold restart of {device.device_id} failed, replacing it: {e}")
+                device = self.replace(device)
+            with self.lock:
+                self.metrics["cold_restarts"] += 1
+        with self.lock:
+            self.metrics["reset_times"].append(time.time() - start)
+        if device is not None:
+            self.available.put(device)
+
+    def replace(self, device):
+        """Kills an emulator that cannot be reset and boots a new one on its port, None when that fails too."""
+        with self.lock:
+            self.devices.remove(device)
+            self.metrics["replaced"] += 1
+        try:
+            device.kill_emulator()
+        except Exception as e:
+            print(f"Killing {device.device_id} failed: {e}")
+        index = (int(device.device_id.split("-")[-1]) - self.base_port) // 2
+        try:
+            replacement = self.__boot_emulator(index)
+        except Exception as e:
+            with self.lock:
+                self.metrics["lost"] += 1
+                print(f"Replacing {device.device_id} failed, {len(self.devices)} emulators left: {e}")
+            return None
+        with self.lock:
+            self.devices.append(replacement)
+        return replacement
+
+    @contextmanager
+    def leased(self, timeout=None):
+        device = self.lease(timeout)
+        try:
+            yield device
+        finally:
+            self.release(device)
+
+    def shutdown(self):
+        with self.lock:
+            devices = list(self.devices)
+        for device in devices:
+            device.kill_emulator()
+        self.devices = []
+
+    def utilisation(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        with self.lock:
+            busy_time = self.metrics["busy_time"] + sum(time.time() - start for start in self.lease_started.values())
+        return busy_time / (self.size * (time.time() - self.started_at))
+
+    def report(self):
+        boot_times, reset_times = self.metrics["boot_times"], self.metrics["reset_times"]
+        print(f"Emulator pool: {self.size} emulators, {self.metrics['leases']} leases, "
+              f"utilisation {self.utilisation():.0%}")
+        if boot_times:
+            print(f"  boot  mean {sum(boot_times) / len(boot_times):.1f}s, max {max(boot_times):.1f}s")
+        if reset_times:
+            print(f"  reset mean {sum(reset_times) / len(reset_times):.1f}s, max {max(reset_times):.1f}s, "
+                  f"cold restarts {self.metrics['cold_restarts']}, replaced {self.metrics['replaced']}, "
+                  f"lost {self.metrics['lost']}")
+
+    def __boot_emulator(self, index) -> AndroidDevice:
+        # console and adb use two consecutive ports per emulator
+        port = self.base_port + 2 * index
+        pool_avd_name = f"{self.avd_name}_pool_{index}"
+        clone_avd(self.avd_name, pool_avd_name, self.android_avd_home, self.clone_mode,
+                  default_qemu_img_path(self.emu_path))
+        start = time.time()
+        device = AndroidDevice(
+            device_id=f"emulator-{port}",
+            adb_path=self.adb_path,
+            aapt_path=self.aapt_path,
+            is_emu=True,
+            android_avd_home=self.android_avd_home,
+            source_avd_name=self.avd_name,
+            avd_name=pool_avd_name,
+            snapshot=self.snapshot,
+            emu_path=self.emu_path,
+            run_apps_adb=False,
+            adb_backend=self.adb_backend,
+            clone_mode=self.clone_mode
+        )
+        with self.lock:
+            self.metrics["boot_times"].append(time.time() - start)
+        return device
@@ -0,0 +1,6 @@
+class AndroidEmulatorException(Exception):
+    pass
+
+
+class AdbException(Exception):
+    pass
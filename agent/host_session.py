@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import threading
+
+from http_client import HttpClientError, is_failover_error, post_json, replica_urls
+from image_upload import image_uploader
+
+# stands for the action history in the evaluator prompts, the host puts the history of the session there
+ACTION_HISTORY_MARKER = "<|action_history|>"
+# the session was evicted or the server restarted (410), or it is out of step with the agent (409)
+SESSION_RESET_STATUS_CODES = {409, 410}
+
+
+def prefix_hash(text) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class HostSession:
+    """Keeps the static part of a task on the host server, so a plan step only sends what changed.
+
+    The instruction and the evaluator prompts are sent once to `/session`. Each step then sends the screenshot inline
+    (by image_id when a step is repeated) plus the prompt and the action history as the length of the part shared
+    with the previous step and the new rest.
+    A session the server evicted or lost track of is opened again and the step sent in full, a session whose
+    replica failed is opened on another replica.
+    """
+
+    def __init__(self, ip, prompt_reflection):
+        self.ip = ip
+        # evaluator prompts built with ACTION_HISTORY_MARKER as the action history
+        self.prompt_reflection = prompt_reflection
+        self.base_url = None
+        self.session_id = None
+        self.prompt = ""
+        self.action_history = []
+        self.lock = threading.Lock()
+        self.metrics = {"sessions": 0, "steps": 0, "resets": 0, "full_bytes": 0, "sent_bytes": 0, "host_time": 0.0}
+
+    def open(self, payload, failed_url=None):
+        params = {
+            "instruction": payload["instruction"],
+            "use_eval": payload["use_eval"],
+            "prompt_init_chat": payload["prompt_init_chat"],
+            "prompt_reflection": self.prompt_reflection,
+        }
+        if "prompt_layout" in payload:
+            params["prompt_layout"] = payload["prompt_layout"]
+        # pinned to one replica, the session only exists on the server that created it
+        urls = replica_urls(f"http://{self.ip}")
+        # a replica that just failed a step goes last, its circuit may not be open yet
+        urls = [url for url in urls if url != failed_url] + [url for url in urls if url == failed_url]
+        for i, base_url in enumerate(urls):
+            try:
+                self.session_id = post_json(f"{base_url}/session", params, timeout=30)["session_id"]
+            except HttpClientError as e:
+                if i == len(urls) - 1 or not is_failover_error(e):
+                    raise
+                print(f"{base_url} failed, trying the next replica: {e}")
+                continue
+            self.base_url = base_url
+            break
+        self.prompt = ""
+        self.action_history = []
+        self.count("sessions")
+
+    def delta(self, payload) -> dict:
+        prompt_keep = len(os.path.commonprefix([self.prompt, payload["prompt"]]))
+        history_keep = len(os.path.commonprefix([self.action_history, payload["action_history"]]))
+        return {
+            "session_id": self.session_id,
+            "prompt_keep": prompt_keep,
+            "prompt_base": prefix_hash(self.prompt[:prompt_keep]),
+            "prompt_append": payload["prompt"][prompt_keep:],
+            "action_history_keep": history_keep,
+            "action_history_append": payload["action_history"][history_keep:],
+            "image": payload["image"],
+        }
+
+    def step(self, payload) -> dict:
+        failed_url = None
+        for attempt in range(2):
+            if self.session_id is None:
+                self.open(payload, failed_url)
+            delta = self.delta(payload)
+            try:
+                output = image_uploader.post_json(f"{self.base_url}/session_generate_plan", delta, timeout=200)
+            except HttpClientError as e:
+                if attempt == 1 or (e.status_code not in SESSION_RESET_STATUS_CODES and not is_failover_error(e)):
+                    raise
+                print(f"Session {self.session_id} lost, opening a new one: {e}")
+                self.count("resets")
+                if e.status_code not in SESSION_RESET_STATUS_CODES:
+                    # the replica is down, the session is opened on another one
+                    failed_url = self.base_url
+                self.session_id = None
+                continue
+            self.prompt = payload["prompt"]
+            self.action_history = list(payload["action_history"])
+            self.record(payload, delta, output)
+            return output
+
+    def close(self):
+        if self.session_id is None:
+            return
+        try:
+            post_json(f"{self.base_url}/session_close", {"session_id": self.session_id}, timeout=10)
+        except HttpClientError as e:
+            # the server evicts it after the idle timeout anyway
+            print(f"Closing session {self.session_id} failed: {e}")
+        self.session_id = None
+
+    def record(self, payload, delta, output):
+        # the screenshot goes inline with both, so it is counted once for each
+        image_bytes = len(payload["image"])
+        full = {name: value for name, value in payload.items() if name != "image"}
+        sent = {name: value for name, value in delta.items() if name != "image"}
+        with self.lock:
+            self.metrics["steps"] += 1
+            self.metrics["full_bytes"] += len(json.dumps(full)) + image_bytes
+            self.metrics["sent_bytes"] += len(json.dumps(sent)) + image_bytes
+            self.metrics["host_time"] += (output.get("timings") or {}).get("total", 0.0)
+
+    def count(self, name):
+        with self.lock:
+            self.metrics[name] += 1
+
+    def report(self):
+        if self.metrics["steps"]:
+            print(f"Host session: {self.metrics['steps']} steps in {self.metrics['sessions']} sessions "
+                  f"({self.metrics['resets']} reopened), sent {self.metrics['sent_bytes'] / 1024:.1f} KiB "
+                  f"instead of {self.metrics['full_bytes'] / 1024:.1f} KiB, host time per step "
+                  f"{self.metrics['host_time'] / self.metrics['steps']:.2f}s")
@@ -0,0 +1,509 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from binary_transport import FRAME_CONTENT_TYPE, encode_frame
+from utils import image_encode_cache
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 10.0
+# every request earns 0.2 retries, at most 10 retries can be saved up
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MAX = 10.0
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30.0
+POOL_SIZE = 8
+HEALTH_CHECK_INTERVAL = 5.0
+HEALTH_CHECK_TIMEOUT = 2.0
+# latency percentiles are taken over the last LATENCY_SAMPLES successful requests of an endpoint
+LATENCY_SAMPLES = 1000
+# the host servers answer /test_connection, vLLM answers /v1/models
+HEALTH_CHECK_PATHS = ["/test_connection", "/v1/models"]
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# servers without the binary transport fail parsing a frame as JSON with one of these
+FRAME_REJECTED_STATUS_CODES = {400, 415, 422}
+# FastAPI servers crash parsing a frame as JSON, but a 500 may as well be transient, so it only counts as
+# rejecting frames when the same request sent as JSON succeeds
+FRAME_UNCERTAIN_STATUS_CODES = {500}
+
+
+class HttpClientError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(HttpClientError):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failed requests and rejects calls for `reset_timeout` seconds.
+
+    Afterwards a single trial request is let through (half-open), its result closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at < self.reset_timeout or self.trial_running:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self) -> bool:
+        """Returns True when this failure opened the circuit."""
+        with self.lock:
+            self.failures += 1
+            was_open = self.opened_at is not None
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            self.trial_running = False
+            return self.opened_at is not None and not was_open
+
+    def trip(self):
+        with self.lock:
+            self.opened_at = time.time()
+            self.trial_running = False
+
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+
+class RetryBudget:
+    """Caps retries to a fraction of the request rate, so an outage does not multiply the load on the server."""
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, max_tokens=RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class EndpointClient:
+    """Keep-alive connection pools, retry policy and metrics of one `scheme://host:port`.
+
+    Blocking calls use a requests.Session, coroutines an httpx.AsyncClient, both share the circuit breaker,
+    the retry budget and the metrics of the endpoint. Payloads with `binary_fields` are sent as a binary frame
+    until a path rejects one, that path then gets JSON for the rest of the run.
+    """
+
+    def __init__(self, base_url, max_attempts=MAX_ATTEMPTS, pool_size=POOL_SIZE):
+        self.base_url = base_url
+        self.max_attempts = max_attempts
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        self.async_session = None
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.circuit = CircuitBreaker()
+        self.retry_budget = RetryBudget()
+        self.lock = threading.Lock()
+        # url path -> "binary" or "json", unknown paths are tried with a binary frame first
+        self.transports = {}
+        self.outstanding = 0
+        self.health_path = None
+        self.metrics = {
+            "requests": 0,
+            "bytes_sent": 0,
+            "errors": 0,
+            "retries": 0,
+            "rejected": 0,
+            "circuit_opened": 0,
+            "ejected": 0,
+            "readmitted": 0,
+            "latencies": deque(maxlen=LATENCY_SAMPLES)
+        }
+
+    def post_json(self, url, payload, timeout, headers=None, binary_fields=None) -> dict:
+        self.track_outstanding(1)
+        try:
+            return self.request_json(url, payload, timeout, headers, binary_fields)
+        finally:
+            self.track_outstanding(-1)
+
+    async def post_json_async(self, url, payload, timeout, headers=None, binary_fields=None) -> dict:
+        self.track_outstanding(1)
+        try:
+            return await self.request_json_async(url, payload, timeout, headers, binary_fields)
+        finally:
+            self.track_outstanding(-1)
+
+    def request_json(self, url, payload, timeout, headers=None, binary_fields=None) -> dict:
+        self.start_request()
+        body = self.frame_body(url, payload, binary_fields)
+        last_error = None
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                delay = self.retry_delay(attempt)
+                if delay is None:
+                    break
+                time.sleep(delay)
+            self.check_circuit(last_error)
+            start = time.time()
+            try:
+                http_response = self.send(url, payload, body, timeout, headers)
+                if body is not None and self.repeats_as_json(url, http_response.status_code):
+                    frame_status_code = http_response.status_code
+                    http_response = self.send(url, payload, None, timeout, headers)
+                    if self.rejects_frame(url, frame_status_code, http_response.status_code):
+                        body = None
+            except requests.RequestException as e:
+                last_error = e
+            else:
+                if http_response.status_code == 200:
+                    self.accept_frame(url, body)
+                    return self.record_success(self.decode_json(url, http_response), start)
+                last_error = self.status_error(url, http_response.status_code)
+            self.record_failure(url, last_error)
+        raise HttpClientError(f"Request to {url} failed after retries: {last_error}")
+
+    async def request_json_async(self, url, payload, timeout, headers=None, binary_fields=None) -> dict:
+        self.start_request()
+        body = self.frame_body(url, payload, binary_fields)
+        last_error = None
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                delay = self.retry_delay(attempt)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+            self.check_circuit(last_error)
+            start = time.time()
+            try:
+                http_response = await self.send_async(url, payload, body, timeout, headers)
+                if body is not None and self.repeats_as_json(url, http_response.status_code):
+                    frame_status_code = http_response.status_code
+                    http_response = await self.send_async(url, payload, None, timeout, headers)
+                    if self.rejects_frame(url, frame_status_code, http_response.status_code):
+                        body = None
+            except httpx.HTTPError as e:
+                last_error = e
+            else:
+                if http_response.status_code == 200:
+                    self.accept_frame(url, body)
+                    return self.record_success(self.decode_json(url, http_response), start)
+                last_error = self.status_error(url, http_response.status_code)
+            self.record_failure(url, last_error)
+        raise HttpClientError(f"Request to {url} failed after retries: {last_error}")
+
+    def send(self, url, payload, body, timeout, headers):
+        data, headers = self.request_body(payload, body, headers)
+        return self.session.post(url, data=data, headers=headers, timeout=timeout)
+
+    async def send_async(self, url, payload, body, timeout, headers):
+        data, headers = self.request_body(payload, body, headers)
+        return await self.get_async_session().post(url, content=data, headers=headers, timeout=timeout)
+
+    def request_body(self, payload, body, headers):
+        if body is None:
+            data = json.dumps(payload).encode("utf-8")
+            headers = {**(headers or {}), "Content-Type": "application/json"}
+        else:
+            data = body
+            headers = {**(headers or {}), "Content-Type": FRAME_CONTENT_TYPE}
+        self.count("bytes_sent", len(data))
+        return data, headers
+
+    def frame_body(self, url, payload, binary_fields):
+        """Binary frame of the payload, None when it has no binary fields or the path only takes JSON."""
+        if not binary_fields or self.transports.get(urlsplit(url).path) == "json":
+            return None
+        return encode_frame(payload, binary_fields, image_encode_cache.decoded)
+
+    def repeats_as_json(self, url, status_code) -> bool:
+        """Whether a failed frame is sent again as JSON right away, after a 500 that repeat is paid as a retry."""
+        # only a path that never answered a frame can reject it, later errors are handled as usual
+        if self.transports.get(urlsplit(url).path) == "binary":
+            return False
+        if status_code in FRAME_REJECTED_STATUS_CODES:
+            return True
+        if status_code not in FRAME_UNCERTAIN_STATUS_CODES or not self.retry_budget.withdraw():
+            return False
+        self.count("retries")
+        return True
+
+    def rejects_frame(self, url, frame_status_code, json_status_code) -> bool:
+        """Pins the path to JSON after the frame failed and the request was repeated as JSON."""
+        if frame_status_code in FRAME_UNCERTAIN_STATUS_CODES and json_status_code != 200:
+            return False
+        print(f"{url} does not accept binary frames (status_code: {frame_status_code}), falling back to JSON")
+        self.transports[urlsplit(url).path] = "json"
+        return True
+
+    def accept_frame(self, url, body):
+        if body is not None:
+            self.transports[urlsplit(url).path] = "binary"
+
+    def get_async_session(self) -> httpx.AsyncClient:
+        # created lazily, an AsyncClient belongs to the event loop it is first used on
+        if self.async_session is None:
+            self.async_session = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size))
+        return self.async_session
+
+    def track_outstanding(self, delta):
+        with self.lock:
+            self.outstanding += delta
+
+    def check_health(self):
+        """Probes the endpoint, ejects it when it is down and readmits it once it answers again."""
+        healthy = None
+        for path in [self.health_path] if self.health_path else HEALTH_CHECK_PATHS:
+            try:
+                http_response = requests.get(f"{self.base_url}{path}", timeout=HEALTH_CHECK_TIMEOUT)
+            except requests.RequestException:
+                healthy = False
+                break
+            if http_response.status_code != 404:
+                self.health_path = path
+                healthy = http_response.status_code == 200
+                break
+        # None: the server has no health endpoint, only failing requests eject it
+        if healthy and self.circuit.is_open():
+            self.circuit.record_success()
+            self.count("readmitted")
+            print(f"{self.base_url} is healthy again, readmitted")
+        elif healthy is False and not self.circuit.is_open():
+            self.circuit.trip()
+            self.count("ejected")
+            print(f"{self.base_url} failed its health check, ejected")
+
+    def start_request(self):
+        self.count("requests")
+        self.retry_budget.deposit()
+
+    def retry_delay(self, attempt):
+        """Full-jitter backoff before a retry, None when the retry budget is exhausted."""
+        if not self.retry_budget.withdraw():
+            return None
+        self.count("retries")
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    def check_circuit(self, last_error):
+        if not self.circuit.allow():
+            self.count("rejected")
+            raise CircuitOpenError(f"{self.base_url} is unhealthy, circuit open after {last_error or 'failures'}")
+
+    def status_error(self, url, status_code) -> HttpClientError:
+        error = HttpClientError(f"Request to {url} failed with status_code: {status_code}", status_code)
+        if status_code not in RETRYABLE_STATUS_CODES:
+            self.count("errors")
+            # the server answered, so it is reachable, a half-open circuit must not wait for this trial forever
+            self.circuit.record_success()
+            raise error
+        return error
+
+    def decode_json(self, url, http_response) -> dict:
+        try:
+            return http_response.json()
+        except ValueError as e:
+            self.count("errors")
+            self.circuit.record_success()
+            raise HttpClientError(f"Request to {url} returned invalid JSON: {e}", http_response.status_code)
+
+    def record_success(self, output, start) -> dict:
+        with self.lock:
+            self.metrics["latencies"].append(time.time() - start)
+        self.circuit.record_success()
+        return output
+
+    def record_failure(self, url, error):
+        print(f"{url}: {error}")
+        self.count("errors")
+        if self.circuit.record_failure():
+            self.count("circuit_opened")
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.metrics[name] += value
+
+    def snapshot(self) -> dict:
+        """Counters plus latency mean and percentiles in seconds over the last LATENCY_SAMPLES successful requests,
+        the latency is None without successful requests."""
+        with self.lock:
+            metrics = dict(self.metrics)
+            latencies = sorted(metrics.pop("latencies"))
+        metrics["latency"] = None
+        if latencies:
+            metrics["latency"] = {"mean": sum(latencies) / len(latencies),
+                                  "p50": latencies[len(latencies) // 2],
+                                  "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                                  "max": latencies[-1]}
+        return metrics
+
+    def report(self):
+        metrics = self.snapshot()
+        latency = metrics.pop("latency")
+        latency = "no successful requests" if latency is None else \
+            f"mean {latency['mean']:.2f}s, p50 {latency['p50']:.2f}s, max {latency['max']:.2f}s"
+        print(f"HTTP {self.base_url}: {', '.join(f'{key} {value}' for key, value in metrics.items())}, {latency}")
+
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+def get_client(url) -> EndpointClient:
+    parts = urlsplit(url)
+    base_url = f"{parts.scheme}://{parts.netloc}"
+    with clients_lock:
+        if base_url not in clients:
+            clients[base_url] = EndpointClient(base_url)
+        return clients[base_url]
+
+
+class ReplicaSet:
+    """Replicas of one server given as `host:port,host:port,...`.
+
+    Requests go to the replica with the fewest outstanding requests among those whose circuit is closed. A daemon
+    thread probes every replica each HEALTH_CHECK_INTERVAL seconds, which ejects replicas that went down before
+    a request hits them and readmits ejected ones as soon as they answer again.
+    """
+
+    def __init__(self, scheme, addresses):
+        self.replicas = [get_client(f"{scheme}://{address.strip()}") for address in addresses]
+        threading.Thread(target=self.run_health_checks, daemon=True).start()
+
+    def ranked(self) -> list:
+        return sorted(self.replicas, key=self.load)
+
+    @staticmethod
+    def load(client):
+        with client.lock:
+            return client.circuit.is_open(), client.outstanding, client.metrics["requests"]
+
+    def run_health_checks(self):
+        while True:
+            for client in self.replicas:
+                client.check_health()
+            time.sleep(HEALTH_CHECK_INTERVAL)
+
+
+replica_sets = {}
+replica_sets_lock = threading.Lock()
+
+
+def replica_urls(url) -> list:
+    """`url` on each replica of its host list, best replica first. A single host is returned unchanged."""
+    parts = urlsplit(url)
+    if "," not in parts.netloc:
+        return [url]
+    with replica_sets_lock:
+        if parts.netloc not in replica_sets:
+            replica_sets[parts.netloc] = ReplicaSet(parts.scheme, parts.netloc.split(","))
+        replica_set = replica_sets[parts.netloc]
+    return [urlunsplit(parts._replace(netloc=urlsplit(client.base_url).netloc)) for client in replica_set.ranked()]
+
+
+def resolve_url(url) -> str:
+    return replica_urls(url)[0]
+
+
+def is_failover_error(error) -> bool:
+    # a request the server refused would be refused by every replica
+    return error.status_code is None or error.status_code in RETRYABLE_STATUS_CODES
+
+
+def post_json(url, payload, timeout, headers=None, binary_fields=None) -> dict:
+    urls = replica_urls(url)
+    for i, replica_url in enumerate(urls):
+        try:
+            return get_client(replica_url).post_json(replica_url, payload, timeout, headers, binary_fields)
+        except HttpClientError as e:
+            if i == len(urls) - 1 or not is_failover_error(e):
+                raise
+            print(f"{replica_url} failed, trying the next replica: {e}")
+
+
+async def post_json_async(url, payload, timeout, headers=None, binary_fields=None) -> dict:
+    urls = replica_urls(url)
+    for i, replica_url in enumerate(urls):
+        try:
+            return await get_client(replica_url).post_json_async(replica_url, payload, timeout, headers,
+                                                                 binary_fields)
+        except HttpClientError as e:
+            if i == len(urls) - 1 or not is_failover_error(e):
+                raise
+            print(f"{replica_url} failed, trying the next replica: {e}")
+
+
+class BackgroundLoop:
+    """Event loop on a daemon thread, so the synchronous step loop can run coroutines while it keeps working."""
+
+    def __init__(self):
+        self.loop = None
+        self.lock = threading.Lock()
+
+    def submit(self, coroutine) -> concurrent.futures.Future:
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+
+background_loop = BackgroundLoop()
+
+
+def submit(coroutine) -> concurrent.futures.Future:
+    return background_loop.submit(coroutine)
+
+
+def get_metrics() -> dict:
+    with clients_lock:
+        return {base_url: client.metrics for base_url, client in clients.items()}
+
+
+def export_metrics(path):
+    """Writes the counters and latencies of every endpoint, each replica on its own, to a JSON file."""
+    with clients_lock:
+        endpoint_clients = list(clients.values())
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({client.base_url: client.snapshot() for client in endpoint_clients}, f, indent=4)
+
+
+def report():
+    with clients_lock:
+        endpoint_clients = list(clients.values())
+    for client in endpoint_clients:
+        client.report()
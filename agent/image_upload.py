@@ -0,0 +1,126 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from http_client import HttpClientError, is_failover_error, post_json, post_json_async, replica_urls
+from utils import image_encode_cache
+
+
+def image_id(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ImageUploader:
+    """Sends each screenshot inline once per server and refers to it by `image_id` when it is sent again.
+
+    The host stores every inline image and returns its `image_id` with the response. The ids stored on a server are
+    remembered (bounded LRU), so a retried step or a reopened session sends only the id. A request for an id the
+    server evicted in the meantime fails with 404 and is repeated with the image inline. Servers without an image
+    store return no id and always get the image inline. When a replica fails the request it goes to the next one,
+    again with the image inline.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.uploaded = {}
+        self.lock = threading.Lock()
+        self.metrics = {"inline": 0, "references": 0, "resent": 0}
+
+    def post_json(self, url, payload, timeout, field="image") -> dict:
+        urls = replica_urls(url)
+        for i, replica_url in enumerate(urls):
+            try:
+                return self.post_to_replica(replica_url, payload, timeout, field)
+            except HttpClientError as e:
+                if i == len(urls) - 1 or not is_failover_error(e):
+                    raise
+                print(f"{replica_url} failed, trying the next replica: {e}")
+
+    async def post_json_async(self, url, payload, timeout, field="image") -> dict:
+        urls = replica_urls(url)
+        for i, replica_url in enumerate(urls):
+            try:
+                return await self.post_to_replica_async(replica_url, payload, timeout, field)
+            except HttpClientError as e:
+                if i == len(urls) - 1 or not is_failover_error(e):
+                    raise
+                print(f"{replica_url} failed, trying the next replica: {e}")
+
+    def post_to_replica(self, url, payload, timeout, field) -> dict:
+        # the image and the requests referring to it have to reach the same server, the next replica gets it inline
+        base_url, key = self.prepare(url, payload, field)
+        if key is not None and self.is_uploaded(base_url, key):
+            try:
+                return post_json(url, self.reference(payload, field, key), timeout)
+            except HttpClientError as e:
+                if e.status_code != 404:
+                    raise
+                self.evicted(base_url, key)
+        output = post_json(url, payload, timeout, binary_fields=(field,))
+        return self.sent_inline(base_url, key, output)
+
+    async def post_to_replica_async(self, url, payload, timeout, field) -> dict:
+        base_url, key = self.prepare(url, payload, field)
+        if key is not None and self.is_uploaded(base_url, key):
+            try:
+                return await post_json_async(url, self.reference(payload, field, key), timeout)
+            except HttpClientError as e:
+                if e.status_code != 404:
+                    raise
+                self.evicted(base_url, key)
+        output = await post_json_async(url, payload, timeout, binary_fields=(field,))
+        return self.sent_inline(base_url, key, output)
+
+    def prepare(self, url, payload, field):
+        """Returns (base url, image id), the id is None when the payload has no image."""
+        parts = urlsplit(url)
+        base_url = f"{parts.scheme}://{parts.netloc}"
+        image = payload.get(field)
+        if image is None:
+            return base_url, None
+        return base_url, image_id(image if isinstance(image, bytes) else image_encode_cache.decoded(image))
+
+    def sent_inline(self, base_url, key, output) -> dict:
+        self.count("inline")
+        # a server without an image store does not answer with the id
+        if key is None or not isinstance(output, dict) or output.get("image_id") != key:
+            return output
+        with self.lock:
+            uploaded = self.uploaded.setdefault(base_url, OrderedDict())
+            uploaded[key] = True
+            uploaded.move_to_end(key)
+            while len(uploaded) > self.max_entries:
+                uploaded.popitem(last=False)
+        return output
+
+    def is_uploaded(self, base_url, key) -> bool:
+        with self.lock:
+            uploaded = self.uploaded.get(base_url, {})
+            if key not in uploaded:
+                return False
+            uploaded.move_to_end(key)
+        return True
+
+    def evicted(self, base_url, key):
+        with self.lock:
+            self.uploaded.get(base_url, {}).pop(key, None)
+            self.metrics["resent"] += 1
+
+    def reference(self, payload, field, key) -> dict:
+        self.count("references")
+        reference = {name: value for name, value in payload.items() if name != field}
+        reference["image_id"] = key
+        return reference
+
+    def count(self, name):
+        with self.lock:
+            self.metrics[name] += 1
+
+    def report(self):
+        if self.metrics["inline"]:
+            print(f"Image uploads: {self.metrics['inline']} requests with the image inline, "
+                  f"{self.metrics['references']} by image_id, {self.metrics['resent']} sent again after eviction")
+
+
+image_uploader = ImageUploader()
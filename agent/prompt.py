@@ -1,34 +1,43 @@
+# static instructions first, then the task, then the history growing at the end, then what changes every step,
+# so consecutive prompts of a task share the longest possible prefix for the server's prefix cache
+PREFIX_LAYOUT = "prefix"
+PROMPT_LAYOUTS = ["legacy", PREFIX_LAYOUT]
+
+
 def get_action_prompt(instruction, keyboard, summary_history, action_history, thought_history, add_info,
-                      completed_content, memory, do_stop, option, use_open_app):
+                      completed_content, memory, do_stop, option, use_open_app, layout="legacy"):
     print("Using open app module: ", use_open_app)
-    prompt = f"This image is a phone screenshot. The user's instruction is: {instruction}.\n\n"
+    task = f"This image is a phone screenshot. The user's instruction is: {instruction}.\n\n"
     if add_info:
-        prompt += "### Hint ###\n"
-        prompt += "Hints to help you complete the user's instructions are as follows:\n"
-        prompt += add_info
-        prompt += "\n\n"
+        task += "### Hint ###\n"
+        task += "Hints to help you complete the user's instructions are as follows:\n"
+        task += add_info
+        task += "\n\n"
 
+    progress = ""
     if completed_content:
-        prompt += "### Progress ###\n"
-        prompt += "Completed contents:\n" + completed_content + "\n\n"
+        progress += "### Progress ###\n"
+        progress += "Completed contents:\n" + completed_content + "\n\n"
 
+    history = ""
     if action_history:
-        prompt += "### History Operations ###\n"
-        prompt += "Refer to the completed operations to decide the next operation. These operations are as follows:\n"
+        history += "### History Operations ###\n"
+        history += "Refer to the completed operations to decide the next operation. These operations are as follows:\n"
         for i in range(len(action_history)):
-            prompt += f"Step-{i + 1}: [Thought: {thought_history[i]};Operation: {summary_history[i].split(' to ')[0].strip()};]\n"
-        prompt += "\n"
+            history += f"Step-{i + 1}: [Thought: {thought_history[i]};Operation: {summary_history[i].split(' to ')[0].strip()};]\n"
+        history += "\n"
 
+    recorded = ""
     if memory:
-        prompt += "### Memory ###\n"
-        prompt += "Recorded contents for use in subsequent operations:\n"
-        prompt += "Memory:\n" + memory + "\n"
+        recorded += "### Memory ###\n"
+        recorded += "Recorded contents for use in subsequent operations:\n"
+        recorded += "Memory:\n" + memory + "\n"
 
     # if error_flag:
     #     prompt += "### Last Operation ###\n"
     #     prompt += f"Previous operation \"{last_summary}\" with Action \"{last_action}\" did not meet expectations. Reflect and revise your operation this time.\n\n"
 
-    prompt += "### Response Requirements ###\n"
+    prompt = "### Response Requirements ###\n"
     prompt += "You must choose one of the following actions on the current page:\n"
     if keyboard:
         prompt += '''
@@ -64,49 +73,49 @@ def get_action_prompt(instruction, keyboard, summary_history, action_history, th
     prompt += "Ground truth: Please generate a text if you click on search box/bar/address bar etc. which should be written there. Only return text. Make step by step typing.\n"
     prompt += "(Use English for the output, return these six parts, return output in the same lines)\n"
 
-    return prompt
+    if layout == PREFIX_LAYOUT:
+        return prompt + "\n" + task + history + progress + recorded
+    return task + progress + history + recorded + prompt
 
 
 def get_action_prompt_with_analysis(instruction, keyboard, summary_history, action_history, thought_history,
                                     analysis_history, add_info, completed_content, memory, do_stop, option,
-                                    use_open_app):
-    prompt = "### Background ###\n"
-    prompt += f"This image is a phone screenshot. The user's end goal instruction is: {instruction}. Analyze this instruction step by step, think about where to do this task and what is the exact goal.\n\n"
-    prompt += f"Your responsibility is to do steps in a way that you will achieve this goal which can be reaching some point in phone only or doing exact task or search for answear to question.\n\n"
+                                    use_open_app, layout="legacy"):
+    task = "### Background ###\n"
+    task += f"This image is a phone screenshot. The user's end goal instruction is: {instruction}. Analyze this instruction step by step, think about where to do this task and what is the exact goal.\n\n"
+    task += f"Your responsibility is to do steps in a way that you will achieve this goal which can be reaching some point in phone only or doing exact task or search for answear to question.\n\n"
 
     if add_info:
-        prompt += "### Hint ###\n"
-        prompt += "Hints to help you complete the user's instructions are as follows:\n"
-        prompt += add_info
-        prompt += "\n\n"
-
-    prompt += "### Must follow rules ###\n"
-    prompt += "You are always responsible for searching for items to click. Always be specific about what to click at. Never trigger click action if you do not see element on screen.\n"
-    prompt += "Focus on purpose of task, analyse it step by step. When question is about some information extraction, then return data that is answering question in 'answer' when successfull.\n"
-    prompt += "If you are given to do task in app, then look for it in phone, those can be installed. Never look for apps on google.\n"
-    prompt += "You have to do exactly what is told to you. If instruction says to do some actions in specific app then you must do this in this specific app. Never do things in other way.\n"
-
+        task += "### Hint ###\n"
+        task += "Hints to help you complete the user's instructions are as follows:\n"
+        task += add_info
+        task += "\n\n"
+
+    rules = "### Must follow rules ###\n"
+    rules += "You are always responsible for searching for items to click. Always be specific about what to click at. Never trigger click action if you do not see element on screen.\n"
+    rules += "Focus on purpose of task, analyse it step by step. When question is about some information extraction, then return data that is answering question in 'answer' when successfull.\n"
+    rules += "If you are given to do task in app, then look for it in phone, those can be installed. Never look for apps on google.\n"
+    rules += "You have to do exactly what is told to you. If instruction says to do some actions in specific app then you must do this in this specific app. Never do things in other way.\n"
+
+    history = ""
     if len(action_history) > 0:
-        prompt += "### History Operations ###\n"
-        prompt += "Refer to thoughts of agent doing those operations and tasks that agent was given for each step. Remember that agent could do those tasks wrong, so it is not sure that those tasks were done correctly. Refer to analysis part to check if those tasks were done correctly:\n"
+        history += "### History Operations ###\n"
+        history += "Refer to thoughts of agent doing those operations and tasks that agent was given for each step. Remember that agent could do those tasks wrong, so it is not sure that those tasks were done correctly. Refer to analysis part to check if those tasks were done correctly:\n"
         for i in range(len(action_history)):
-            prompt += f"Step-{i + 1}: [Thought: {thought_history[i]};Operation: {summary_history[i].split(' to ')[0].strip()}]\n"
-        prompt += "\n"
-
-    if analysis_history:
-        prompt += "### Given agent operations analysis history ###\n"
-        prompt += "Refer to the analysis of operations done by agent. These operations are as follows:\n"
+            history += f"Step-{i + 1}: [Thought: {thought_history[i]};Operation: {summary_history[i].split(' to ')[0].strip()}]\n"
+            # each step is followed by its analysis, so the history only grows at the end
+            if layout == PREFIX_LAYOUT and i < len(analysis_history):
+                history += f"Step-{i + 1}: [Analysis of operation done by agent: {analysis_history[i].strip()}\n"
+        history += "\n"
+
+    if analysis_history and layout != PREFIX_LAYOUT:
+        history += "### Given agent operations analysis history ###\n"
+        history += "Refer to the analysis of operations done by agent. These operations are as follows:\n"
         for i in range(len(analysis_history)):
-            prompt += f"Step-{i + 1}: [Analysis of operation done by agent: {analysis_history[i].strip()}\n"
-        prompt += "\n"
-
-    prompt += "### Must follow rules ###\n"
-    prompt += "You are always responsible for searching for items to click. Always be specific about what to click at. Never trigger click action if you do not see element on screen.\n"
-    prompt += "Focus on purpose of task, analyse it step by step. When question is about some information extraction, then return data that is answering question in 'answer' when successfull.\n"
-    prompt += "If you are given to do task in app, then look for it in phone, those can be installed. Never look for apps on google.\n"
-    prompt += "You have to do exactly what is told to you. If instruction says to do some actions in specific app then you must do this in this specific app. Never do things in other way.\n"
+            history += f"Step-{i + 1}: [Analysis of operation done by agent: {analysis_history[i].strip()}\n"
+        history += "\n"
 
-    prompt += "### Response Requirements ###\n"
+    prompt = "### Response Requirements ###\n"
     prompt += "You must choose one of the following actions on the current page:\n"
     if keyboard:
         prompt += '''
@@ -149,7 +158,9 @@ def get_action_prompt_with_analysis(instruction, keyboard, summary_history, acti
     prompt += "Ground truth: Please generate a text if you click on search box/bar/address bar etc. which should be written there. Only return text.\n"
     prompt += "(Use English for the output, return these seven parts, return output in the same lines, you must return same seven keys with their values)\n"
 
-    return prompt
+    if layout == PREFIX_LAYOUT:
+        return rules + prompt + "\n" + task + history + rules
+    return task + rules + history + rules + prompt
 
 
 def get_relevant_app_prompt(app_name, apps_label):
@@ -234,13 +245,14 @@ def get_reflect_prompt(instruction, clickable_infos1, clickable_infos2, width, h
     return prompt
 
 
-def get_memory_prompt(insight):
+def get_memory_prompt(insight, layout="legacy"):
+    important = ""
     if insight != "":
-        prompt = "### Important content ###\n"
-        prompt += " ".join(insight)
-        prompt += "\n\n"
+        important = "### Important content ###\n"
+        important += " ".join(insight)
+        important += "\n\n"
 
-        prompt += "### Response requirements ###\n"
+        prompt = "### Response requirements ###\n"
         prompt += "Please think about whether there is any content closely related to ### Important content ### on the current page? If there is, please output the content. If not, please output \"None\".\n\n"
 
     else:
@@ -251,10 +263,13 @@ def get_memory_prompt(insight):
     prompt += "Your output format is:\n"
     prompt += "Important content: The content or None. Please do not repeatedly output the information in ### Memory ###."
 
-    return prompt
+    if layout == PREFIX_LAYOUT:
+        return prompt + ("\n\n" + important if important else "")
+    return important + prompt
 
 
-def get_process_prompt(instruction, thought_history, summary_history, action_history, completed_content, add_info):
+def get_process_prompt(instruction, thought_history, summary_history, action_history, completed_content, add_info,
+                       layout="legacy"):
     prompt = "### Background ###\n"
     prompt += f"There is an user's instruction which is: {instruction}. You are a mobile phone operating assistant and are operating the user's mobile phone.\n\n"
 
@@ -265,24 +280,28 @@ def get_process_prompt(instruction, thought_history, summary_history, action_his
         prompt += "\n\n"
 
     if len(thought_history) > 1:
-        prompt += "### History operations ###\n"
-        prompt += "To complete the requirements of user's instruction, you have performed a series of operations. These operations are as follow:\n"
+        history = "### History operations ###\n"
+        history += "To complete the requirements of user's instruction, you have performed a series of operations. These operations are as follow:\n"
         for i in range(len(summary_history)):
             operation = summary_history[i].split(" to ")[0].strip()
-            prompt += f"Step-{i + 1}: [Operation thought: " + operation + "; Operation action: " + action_history[
+            history += f"Step-{i + 1}: [Operation thought: " + operation + "; Operation action: " + action_history[
                 i] + "]\n"
-        prompt += "\n"
+        history += "\n"
 
-        prompt += "### Progress thinking ###\n"
-        prompt += "After completing the history operations, you have the following thoughts about the progress of user's instruction completion:\n"
-        prompt += "Completed contents:\n" + completed_content + "\n\n"
+        history += "### Progress thinking ###\n"
+        history += "After completing the history operations, you have the following thoughts about the progress of user's instruction completion:\n"
+        history += "Completed contents:\n" + completed_content + "\n\n"
 
-        prompt += "### Response requirements ###\n"
-        prompt += "Now you need to update the \"Completed contents\". Completed contents is a general summary of the current contents that have been completed based on the ### History operations ###.\n\n"
+        requirements = "### Response requirements ###\n"
+        requirements += "Now you need to update the \"Completed contents\". Completed contents is a general summary of the current contents that have been completed based on the ### History operations ###.\n\n"
 
-        prompt += "### Output format ###\n"
-        prompt += "Your output format is:\n"
-        prompt += "Completed contents:\nUpdated Completed contents. Don't output the purpose of any operation. Just summarize the contents that have been actually completed in the ### History operations ###."
+        requirements += "### Output format ###\n"
+        requirements += "Your output format is:\n"
+        requirements += "Completed contents:\nUpdated Completed contents. Don't output the purpose of any operation. Just summarize the contents that have been actually completed in the ### History operations ###."
+        if layout == PREFIX_LAYOUT:
+            prompt += requirements + "\n\n" + history
+        else:
+            prompt += history + requirements
 
     else:
         prompt += "### Current operation ###\n"
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+CACHE_MODES = ["off", "on", "record", "replay"]
+# strings this long are images (base64 or data urls), they enter the key as their hash
+INLINE_VALUE_LIMIT = 1024
+
+
+class ReplayMissError(Exception):
+    pass
+
+
+def canonical_key(endpoint, payload) -> str:
+    """Content address of a request: endpoint path plus the payload as sorted JSON with images replaced by hashes.
+
+    The host is left out, so responses recorded against one server can be replayed against another.
+    """
+
+    def canonicalize(value):
+        if isinstance(value, dict):
+            return {key: canonicalize(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [canonicalize(item) for item in value]
+        if isinstance(value, str) and len(value) > INLINE_VALUE_LIMIT:
+            return "sha256:" + hashlib.sha256(value.encode("utf-8")).hexdigest()
+        return value
+
+    canonical = json.dumps([endpoint, canonicalize(payload)], sort_keys=True, separators=(",", ":"),
+                           ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite store of model responses keyed by canonical_key.
+
+    off:    every call goes to the server.
+    on:     cached responses are served, misses are queried and stored.
+    record: every call goes to the server and overwrites the stored response.
+    replay: only cached responses are served, a miss raises ReplayMissError, so runs need no model server.
+    Entries older than `ttl` seconds are ignored (except in replay mode) and the least recently used entries
+    beyond `max_entries` are evicted.
+    """
+
+    def __init__(self, path="../cache/responses.sqlite", mode="off", ttl=7 * 24 * 3600, max_entries=10000):
+        self.path = path
+        self.mode = "off"
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.connection = None
+        self.lock = threading.Lock()
+        self.metrics = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self.configure(mode, path, ttl, max_entries)
+
+    def configure(self, mode, path=None, ttl=None, max_entries=None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown response cache mode: {mode}")
+        with self.lock:
+            if path is not None and path != self.path and self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            self.mode = mode
+            self.path = path or self.path
+            self.ttl = float(ttl) if ttl is not None else self.ttl
+            self.max_entries = int(max_entries) if max_entries is not None else self.max_entries
+
+    def get_connection(self) -> sqlite3.Connection:
+        if self.connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # shared by the step loop and the background event loop, access is serialised by self.lock
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, response TEXT, "
+                "created REAL, last_used REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        return self.connection
+
+    def get(self, key):
+        with self.lock:
+            connection = self.get_connection()
+            row = connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.mode != "replay" and time.time() - row[1] > self.ttl):
+                self.metrics["misses"] += 1
+                return None
+            connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            connection.commit()
+            self.metrics["hits"] += 1
+            return json.loads(row[0])
+
+    def put(self, key, endpoint, response):
+        now = time.time()
+        with self.lock:
+            connection = self.get_connection()
+            connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                               (key, endpoint, json.dumps(response), now, now))
+            evicted = connection.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used DESC "
+                "LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+            connection.commit()
+            self.metrics["stores"] += 1
+            self.metrics["evictions"] += evicted
+
+    def lookup(self, url, payload):
+        """Returns (key, cached response or None). Raises ReplayMissError for a miss in replay mode."""
+        if self.mode == "off":
+            return None, None
+        endpoint = urlsplit(url).path
+        key = canonical_key(endpoint, payload)
+        response = self.get(key) if self.mode != "record" else None
+        if response is None and self.mode == "replay":
+            raise ReplayMissError(f"No recorded response for {endpoint} (key {key})")
+        return key, response
+
+    def fetch(self, url, payload, query):
+        """Serves `url` + `payload` from the cache or calls `query()` and stores its response."""
+        key, response = self.lookup(url, payload)
+        if response is not None:
+            return response
+        response = query()
+        if key is not None:
+            self.put(key, urlsplit(url).path, response)
+        return response
+
+    async def fetch_async(self, url, payload, query):
+        if self.mode == "off":
+            return await query()
+        # hashing the payload and the SQLite reads and writes would block the event loop
+        key, response = await asyncio.to_thread(self.lookup, url, payload)
+        if response is not None:
+            return response
+        response = await query()
+        if key is not None:
+            await asyncio.to_thread(self.put, key, urlsplit(url).path, response)
+        return response
+
+    def report(self):
+        if self.mode != "off":
+            print(f"Response cache ({self.mode}): {self.metrics['hits']} hits, {self.metrics['misses']} misses, "
+                  f"{self.metrics['stores']} stored, {self.metrics['evictions']} evicted")
+
+
+response_cache = ResponseCache()
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import re
@@ -7,15 +8,21 @@ import time
 from PIL import Image
 
 import config_manager
+import http_client
 from api_florence import create_local_florence_payload, query_florence
-from api_internvl import create_internvl_payload, query_internvl
-from api_qwen import query_qwen, create_qwen_payload_for_action
+from api_internvl import create_internvl_payload, query_internvl_async
+from api_qwen import query_qwen, query_qwen_session, create_qwen_payload_for_action
 from chat_internvl import add_response, init_process_chat
 from controller import AndroidDevice, AndroidEmulatorException, AdbException
+from host_session import ACTION_HISTORY_MARKER, HostSession
+from image_upload import image_uploader
 from prompt import get_action_prompt, get_analysis_prompt, get_action_prompt_with_analysis, \
     get_memory_prompt, get_process_prompt, build_final_eval_v3_final_prompt_web, \
     build_final_eval_v3_final_prompt_general, build_init_eval_general, build_init_eval_web
-from utils import draw_click, add_action, draw_rectangle
+from prompt_cache_stats import prompt_cache_stats
+from response_cache import response_cache
+from settle import ScreenSettler
+from utils import draw_click, add_action, draw_rectangle, image_encode_cache
 
 
 def take_screenshot(device, file_name, file_path) -> Image:
@@ -45,7 +52,8 @@ def get_prompt(action_history, add_info, analysis_history, completed_requirement
             memory,
             config.prompts.do_stop,
             config.prompts.option,
-            use_open_app
+            use_open_app,
+            config.prompts.prompt_layout
         )
     else:
         prompt_action = get_action_prompt(
@@ -59,7 +67,8 @@ def get_prompt(action_history, add_info, analysis_history, completed_requirement
             memory,
             config.prompts.do_stop,
             config.prompts.option,
-            use_open_app
+            use_open_app,
+            config.prompts.prompt_layout
         )
     return prompt_action
 
@@ -69,6 +78,10 @@ def run(config, and_device):
         return None
 
     prepare_folders(config)
+    image_encode_cache.configure(config.encoding.jpeg_quality, config.encoding.jpeg_subsampling,
+                                 config.encoding.image_policy)
+    response_cache.configure(config.cache.response_cache, config.cache.response_cache_path,
+                             config.cache.response_cache_ttl, config.cache.response_cache_max_entries)
 
     instruction = config.input.instruction
     action_path = config.input.action_file
@@ -101,12 +114,29 @@ def run(config, and_device):
                 f"Look on your history actions, when you are deciding about next action. "
                 f"Do not use the same thoughts in the row. Avoid using the same output.")
 
+    settler = None
+    if config.settle.use_settle:
+        settler = ScreenSettler(
+            and_device,
+            metric=config.settle.settle_metric,
+            threshold=config.settle.settle_threshold,
+            timeout=config.settle.settle_timeout
+        )
+
+    host_session = None
+    if config.server.use_sessions:
+        host_session = HostSession(config.server.qwen, [
+            build_final_eval_v3_final_prompt_web(instruction, ACTION_HISTORY_MARKER),
+            build_final_eval_v3_final_prompt_general(instruction, ACTION_HISTORY_MARKER)
+        ])
+
     screenshots = []
     iteration = 0
     for iteration in range(int(config.other.max_steps)):
-        use_open_app = and_device.is_home_screen()
+        device_state = and_device.get_device_state()
+        use_open_app = device_state.is_home_screen
 
-        x, y = and_device.get_screen_size()
+        x, y = device_state.screen_size
         tap_x, tap_y, lift_x, lift_y = -1, -1, -1, -1
 
         screenshots.append(take_screenshot(
@@ -124,7 +154,7 @@ def run(config, and_device):
             completed_requirements=completed_requirements,
             config=config,
             instruction=instruction,
-            keyboard=and_device.is_keyboard_open(),
+            keyboard=device_state.keyboard_open,
             memory=memory,
             summary_history=summary_history,
             thought_history=thought_history,
@@ -132,7 +162,8 @@ def run(config, and_device):
         )
 
         if not config.models.use_florence_only:
-            output_action = query_qwen_llm(action_history, config, instruction, prompt_action, screenshots)
+            output_action = query_qwen_llm(action_history, config, instruction, prompt_action, screenshots,
+                                           host_session)
 
             print("Finished LLM Querying")
             action = output_action["action"]
@@ -155,7 +186,8 @@ def run(config, and_device):
             add_action(action_log=action_log_name + "_description", chat=save_to_logs_description)
         else:
             payload = create_local_florence_payload(instruction, screenshots[-1])
-            output_action = {"response": query_florence(payload=payload, ip=config.server.florence)}
+            click_point = query_florence(payload=payload, ip=config.server.florence)
+            output_action = {"response": image_encode_cache.get(screenshots[-1], "grounding").to_source(click_point)}
             action = "click"
             summary = ""
             thought = ""
@@ -172,7 +204,7 @@ def run(config, and_device):
             break
 
         if "go to app" in action.lower():
-            action_go_to_app(action, and_device, config)
+            action_go_to_app(action, and_device, config, settler)
         elif "type" in action.lower():
             if not action_type(
                     android_device=and_device,
@@ -182,7 +214,8 @@ def run(config, and_device):
                     action_path=action_path,
                     iteration=iteration,
                     instruction=instruction,
-                    groundtruth=groundtruth
+                    groundtruth=groundtruth,
+                    settler=settler
             ):
                 continue
         elif "click" in action.lower():
@@ -193,7 +226,8 @@ def run(config, and_device):
                     eval_save_folder=eval_save_folder,
                     action_path=action_path,
                     iteration=iteration,
-                    instruction=instruction
+                    instruction=instruction,
+                    settler=settler
             ):
                 continue
             if and_device.is_keyboard_open():
@@ -213,17 +247,28 @@ def run(config, and_device):
         end = time.time()
 
         print("decision what to click", end - start)
-        time.sleep(11)
+
+        thought_history.append(thought)
+        summary_history.append(summary)
+        action_history.append(command + " " + description)
+
+        # the modules only depend on this step's screenshots and histories, so they run during the settle wait
+        prompt_memory = get_memory_prompt(summary_history, config.prompts.prompt_layout) \
+            if config.modules.use_memory else None
+        module_futures = launch_modules(config, iteration, instruction, prev_command, screenshots, analysis_history,
+                                        thought_history, summary_history, action_history, completed_requirements,
+                                        add_info, prompt_memory, chat_action)
+
+        settle_time = None
+        if settler is not None:
+            settle_time = settler.wait(action)
+        else:
+            time.sleep(11)
 
         analysis = None
-        if config.modules.use_analysis and iteration >= 1:
+        if "analysis" in module_futures:
             try:
-                print(">>> Start analysis module")
-                analysis_prompt = get_analysis_prompt(instruction, prev_command, analysis_history)
-
-                payload = create_internvl_payload(analysis_prompt, [screenshots[-2], screenshots[-1]])
-                print("Before querying for analysis, prev_command: ", prev_command)
-                analysis = query_internvl(payload, ip=config.server.internvl)["message"]["content"]
+                analysis = module_futures["analysis"].result()
                 print(">>> Analysis riasa: ", analysis)
                 if analysis:
                     analysis = analysis.replace("Analysis:", "")
@@ -249,37 +294,24 @@ def run(config, and_device):
                 "reflection_done": reflect_done,
                 "analysis": analysis if analysis else "null",
                 "description": description,
-                "answer": answer
+                "answer": answer,
+                "settle_time": settle_time
             }
         })
 
-        thought_history.append(thought)
-        summary_history.append(summary)
-        action_history.append(command + " " + description)
-
-        if config.modules.use_reflection:
-            print(screenshots[-1].filename, "-" * 50)
-            prompt_porcess = get_process_prompt(instruction, thought_history, summary_history, action_history,
-                                                completed_requirements, add_info)
-            chat_process = init_process_chat()
-            payload = create_internvl_payload(prompt_porcess, [screenshots[-1]], chat_process)
-            process_output = query_internvl(payload, ip=config.server.internvl)["message"]["content"]
+        if "reflection" in module_futures:
+            process_output = module_futures["reflection"].result()
             print(process_output)
 
             try:
                 completed_requirements = re.search(r"Completed contents:(.*)", process_output).group(1).strip()
             except:
                 pass
-            add_response("assistant", process_output, chat_process)
-
-        if config.modules.use_memory:
-            insight = summary_history
-            prompt_memory = get_memory_prompt(insight)
 
-            payload = create_internvl_payload(prompt_memory, [screenshots[-1]], chat_action)
+        if "memory" in module_futures:
             chat_action = add_response("user", prompt_memory, chat_action)
 
-            output_memory = query_internvl(payload=payload, ip=config.server.internvl)['message']['content'] + "\n"
+            output_memory = module_futures["memory"].result() + "\n"
 
             chat_action = add_response("assistant", output_memory, chat_action)
 
@@ -292,7 +324,19 @@ def run(config, and_device):
         f"{action_path}/screenshot_{iteration + 1}.jpg",
         f"../output/eval_trajectories/{eval_save_folder}/"))
 
+    and_device.wait_for_screenshots()
     close_opened_screenshots(screenshots)
+    if settler is not None:
+        settler.report()
+    http_client.report()
+    http_client.export_metrics(f"../output/trajectories/{eval_save_folder}/http_metrics_{action_path}.json")
+    image_uploader.report()
+    if host_session is not None:
+        host_session.close()
+        host_session.report()
+    prompt_cache_stats.report()
+    image_encode_cache.report()
+    response_cache.report()
 
     trajectory_log["steps"].append({
         "img": screenshots[-1].filename,
@@ -315,7 +359,50 @@ def run(config, and_device):
     return action_history
 
 
-def query_qwen_llm(action_history, config, instruction, prompt_action, screenshots):
+def launch_modules(config, iteration, instruction, prev_command, screenshots, analysis_history, thought_history,
+                   summary_history, action_history, completed_requirements, add_info, prompt_memory,
+                   chat_action) -> dict:
+    """Starts the enabled analysis, reflection and memory queries concurrently, returns their futures by module."""
+    futures = {}
+    if config.modules.use_analysis and iteration >= 1:
+        print(">>> Start analysis module")
+        futures["analysis"] = http_client.submit(query_analysis_module(
+            config, instruction, prev_command, list(analysis_history), screenshots[-2:]))
+    if config.modules.use_reflection:
+        print(screenshots[-1].filename, "-" * 50)
+        prompt_porcess = get_process_prompt(instruction, thought_history, summary_history, action_history,
+                                            completed_requirements, add_info, config.prompts.prompt_layout)
+        futures["reflection"] = http_client.submit(query_reflection_module(config, prompt_porcess, screenshots[-1]))
+    if config.modules.use_memory:
+        futures["memory"] = http_client.submit(query_memory_module(config, prompt_memory, screenshots[-1],
+                                                                   chat_action))
+    return futures
+
+
+async def query_analysis_module(config, instruction, prev_command, analysis_history, screenshots):
+    analysis_prompt = get_analysis_prompt(instruction, prev_command, analysis_history)
+    # encoding the screenshots would hold up the background loop and the other modules' requests on it
+    payload = await asyncio.to_thread(create_internvl_payload, analysis_prompt, screenshots, call_type="analysis")
+    print("Before querying for analysis, prev_command: ", prev_command)
+    output = await query_internvl_async(payload, ip=config.server.internvl, prompt_type="analysis")
+    return output["message"]["content"]
+
+
+async def query_reflection_module(config, prompt_porcess, screenshot):
+    payload = await asyncio.to_thread(create_internvl_payload, prompt_porcess, [screenshot], init_process_chat(),
+                                      call_type="reflection")
+    output = await query_internvl_async(payload, ip=config.server.internvl, prompt_type="reflection")
+    return output["message"]["content"]
+
+
+async def query_memory_module(config, prompt_memory, screenshot, chat_action):
+    payload = await asyncio.to_thread(create_internvl_payload, prompt_memory, [screenshot], chat_action,
+                                      call_type="memory")
+    output = await query_internvl_async(payload=payload, ip=config.server.internvl, prompt_type="memory")
+    return output['message']['content']
+
+
+def query_qwen_llm(action_history, config, instruction, prompt_action, screenshots, host_session=None):
     print("Querying LLM -> screenshot file: ", screenshots[-1].filename)
     prompt_reflection = []
     prompt_init_chat = []
@@ -324,9 +411,19 @@ def query_qwen_llm(action_history, config, instruction, prompt_action, screensho
     prompt_init_chat.append(build_init_eval_web())
     prompt_init_chat.append(build_init_eval_general())
     payload = create_qwen_payload_for_action(prompt_action, screenshots[-1], instruction, action_history,
-                                             config.models.use_eval, prompt_reflection, prompt_init_chat)
+                                             config.models.use_eval, prompt_reflection, prompt_init_chat,
+                                             config.prompts.prompt_layout)
     print("Querying LLM #2")
-    output_action = query_qwen(payload=payload, ip=config.server.qwen)
+    if host_session is not None:
+        output_action = query_qwen_session(payload=payload, session=host_session)
+    else:
+        output_action = query_qwen(payload=payload, ip=config.server.qwen)
+    if output_action.get("timings"):
+        print("Host stage timings:", {stage: round(seconds, 2) for stage, seconds in output_action["timings"].items()})
+    # the host grounds on the image it was sent, which the action policy may have downscaled
+    encoded = image_encode_cache.get(screenshots[-1], "action")
+    output_action["response"] = encoded.to_source(output_action.get("response"))
+    output_action["bbox"] = encoded.to_source(output_action.get("bbox"))
     return output_action
 
 
@@ -366,7 +463,7 @@ def actions_home(and_device):
     and_device.home()
 
 
-def action_go_to_app(action, and_device, config):
+def action_go_to_app(action, and_device, config, settler=None):
     print('#' * 5 + "go to app" + '#' * 5)
     print("ACTION: ", action.lower())
     app_name = action.lower().split("-").pop().strip()
@@ -376,11 +473,12 @@ def action_go_to_app(action, and_device, config):
         print("Closest app: ", closest_app)
     else:
         print("Something went wrong while extracting app name")
-    time.sleep(3)
+    if settler is None:
+        time.sleep(3)
 
 
 def action_type(android_device, screenshots, output_action, eval_save_folder, action_path, iteration, instruction,
-                groundtruth):
+                groundtruth, settler=None):
     if not android_device.is_keyboard_open():
         print('#' * 5 + "click action" + '#' * 5)
         click_point = output_action["response"]
@@ -400,14 +498,15 @@ def action_type(android_device, screenshots, output_action, eval_save_folder, ac
             colour=(255, 0, 0),
             label=instruction
         )
-        android_device.tap(x=click_point[0], y=click_point[1])
+        android_device.tap(x=click_point[0], y=click_point[1], wait=settler is None)
     print('#' * 5 + "type action" + '#' * 5)
     time.sleep(1)
     android_device.type(groundtruth)
     return True
 
 
-def action_click(and_device, output_action, screenshots, eval_save_folder, action_path, iteration, instruction):
+def action_click(and_device, output_action, screenshots, eval_save_folder, action_path, iteration, instruction,
+                 settler=None):
     print('#' * 5 + "click action" + '#' * 5)
     click_point = output_action["response"]
     print(">>> click point", click_point)
@@ -426,8 +525,13 @@ def action_click(and_device, output_action, screenshots, eval_save_folder, actio
         colour=(255, 0, 0),
         label=instruction
     )
-    and_device.tap(x=click_point[0], y=click_point[1])
-    time.sleep(4)
+    if settler is None:
+        and_device.tap(x=click_point[0], y=click_point[1])
+        time.sleep(4)
+    else:
+        and_device.tap(x=click_point[0], y=click_point[1], wait=False)
+        # the keyboard check right after the click needs the screen to have reacted
+        settler.wait("click")
     return True
 
 
@@ -446,15 +550,21 @@ def get_android_device(configuration):
             emu_path=android_cfg.emu_path,
             avd_name=android_cfg.avd_name,
             snapshot=android_cfg.snapshot,
-            run_apps_adb=True
-
+            run_apps_adb=True,
+            adb_backend=android_cfg.adb_backend,
+            screenshot_mode=android_cfg.screenshot_mode,
+            clone_mode=android_cfg.clone_mode,
+            app_labels_from_inventory=android_cfg.app_labels_from_inventory
         )
     else:
         new_device = AndroidDevice(
             device_id=android_cfg.device_id,
             adb_path=android_cfg.adb_path,
             aapt_path=android_cfg.aapt_path,
-            run_apps_adb=True
+            run_apps_adb=True,
+            adb_backend=android_cfg.adb_backend,
+            screenshot_mode=android_cfg.screenshot_mode,
+            app_labels_from_inventory=android_cfg.app_labels_from_inventory
         )
     return new_device
 
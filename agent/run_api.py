@@ -7,11 +7,12 @@ import time
 from PIL import Image
 
 import config_manager
+import http_client
 from api_model import inference_chat
 from chat_internvl import add_response, init_action_chat, init_eval_chat
 from controller import AndroidDevice, AndroidEmulatorException, AdbException
 from prompt import get_action_prompt, build_final_eval_v3_final_prompt_web
-from utils import draw_click, draw_rectangle
+from utils import draw_click, draw_rectangle, image_encode_cache
 
 model_name = ""
 API_URL = ""
@@ -43,7 +44,8 @@ def get_prompt(action_history, add_info, analysis_history, completed_requirement
         memory,
         config.prompts.do_stop,
         config.prompts.option,
-        use_open_app
+        use_open_app,
+        config.prompts.prompt_layout
     )
     return prompt_action
 
@@ -53,6 +55,8 @@ def run(config, and_device):
         return None
 
     prepare_folders(config)
+    image_encode_cache.configure(config.encoding.jpeg_quality, config.encoding.jpeg_subsampling,
+                                 config.encoding.image_policy)
 
     instruction = config.input.instruction
     action_path = config.input.action_file
@@ -88,9 +92,10 @@ def run(config, and_device):
     screenshots = []
     iteration = 0
     for iteration in range(int(config.other.max_steps)):
-        use_open_app = and_device.is_home_screen()
+        device_state = and_device.get_device_state()
+        use_open_app = device_state.is_home_screen
 
-        x, y = and_device.get_screen_size()
+        x, y = device_state.screen_size
         tap_x, tap_y, lift_x, lift_y = -1, -1, -1, -1
 
         screenshots.append(take_screenshot(
@@ -108,7 +113,7 @@ def run(config, and_device):
             completed_requirements=completed_requirements,
             config=config,
             instruction=instruction,
-            keyboard=and_device.is_keyboard_open(),
+            keyboard=device_state.keyboard_open,
             memory=memory,
             summary_history=summary_history,
             thought_history=thought_history,
@@ -219,7 +224,10 @@ def run(config, and_device):
         f"{action_path}/screenshot_{iteration + 1}.jpg",
         f"../output/eval_trajectories/{eval_save_folder}/"))
 
+    and_device.wait_for_screenshots()
     close_opened_screenshots(screenshots)
+    http_client.report()
+    image_encode_cache.report()
 
     trajectory_log["steps"].append({
         "img": screenshots[-1].filename,
@@ -356,15 +364,21 @@ def get_android_device(configuration):
             emu_path=android_cfg.emu_path,
             avd_name=android_cfg.avd_name,
             snapshot=android_cfg.snapshot,
-            run_apps_adb=True
-
+            run_apps_adb=True,
+            adb_backend=android_cfg.adb_backend,
+            screenshot_mode=android_cfg.screenshot_mode,
+            clone_mode=android_cfg.clone_mode,
+            app_labels_from_inventory=android_cfg.app_labels_from_inventory
         )
     else:
         new_device = AndroidDevice(
             device_id=android_cfg.device_id,
             adb_path=android_cfg.adb_path,
             aapt_path=android_cfg.aapt_path,
-            run_apps_adb=True
+            run_apps_adb=True,
+            adb_backend=android_cfg.adb_backend,
+            screenshot_mode=android_cfg.screenshot_mode,
+            app_labels_from_inventory=android_cfg.app_labels_from_inventory
         )
     return new_device
 
@@ -0,0 +1,76 @@
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+RAW_HEADER = struct.Struct("<III")
+# android PixelFormat -> (bytes per pixel, PIL raw mode of the pixel data)
+RAW_PIXEL_FORMATS = {
+    1: (4, "RGBX"),  # RGBA_8888, alpha is ignored
+    2: (4, "RGBX"),  # RGBX_8888
+    3: (3, "RGB"),  # RGB_888
+    5: (4, "BGRX"),  # BGRA_8888
+}
+COLOR_SPACE_FIELD_SIZE = 4
+
+
+def read_raw_screencap(read_into) -> tuple[Image.Image, int]:
+    """Reads `screencap` output (no -p) and decodes it into an RGB image.
+
+    `read_into` is a `readinto`/`recv_into` style callable of the pipe or socket the frame arrives on. Pixels are
+    read straight into one preallocated buffer. PIL maps RGB and RGBX pixels without copying and RGBX is then
+    converted to the RGB expected by the rest of the agent, BGRX pixels are decoded into RGB instead. Either way
+    there is at most one copy. Returns the image and the number of bytes read.
+    """
+    header = bytearray(RAW_HEADER.size)
+    if read_fully(read_into, memoryview(header)) != RAW_HEADER.size:
+        raise ValueError("Empty screencap output")
+    width, height, pixel_format = RAW_HEADER.unpack(header)
+    if pixel_format not in RAW_PIXEL_FORMATS:
+        raise ValueError(f"Unsupported screencap pixel format: {pixel_format}")
+    bytes_per_pixel, raw_mode = RAW_PIXEL_FORMATS[pixel_format]
+    pixels_size = width * height * bytes_per_pixel
+
+    # since Android 9 the header carries an extra color space field, so the pixels start 4 bytes later
+    buffer = bytearray(pixels_size + COLOR_SPACE_FIELD_SIZE)
+    received = read_fully(read_into, memoryview(buffer))
+    if received == pixels_size + COLOR_SPACE_FIELD_SIZE:
+        offset = COLOR_SPACE_FIELD_SIZE
+    elif received == pixels_size:
+        offset = 0
+    else:
+        raise ValueError(f"Truncated screencap output: {received} of {pixels_size} bytes")
+
+    pixels = memoryview(buffer)[offset:offset + pixels_size]
+    image = Image.frombuffer("RGB", (width, height), pixels, "raw", raw_mode, 0, 1)
+    # a mapped buffer keeps its raw mode, RGBX here
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image, RAW_HEADER.size + received
+
+
+def read_fully(read_into, view) -> int:
+    received = 0
+    while received < len(view):
+        chunk = read_into(view[received:])
+        if not chunk:
+            break
+        received += chunk
+    return received
+
+
+class ScreenshotWriter:
+    """Saves screenshots on a background thread so the agent loop does not wait for the encoder and the disk."""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = []
+
+    def save(self, image, file_path):
+        self.pending = [future for future in self.pending if not future.done()]
+        self.pending.append(self.executor.submit(image.save, file_path))
+
+    def wait(self):
+        for future in self.pending:
+            future.result()
+        self.pending = []
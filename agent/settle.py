@@ -0,0 +1,97 @@
+import time
+
+from PIL import Image, ImageChops, ImageStat
+
+# action type -> (minimum wait, ceiling timeout) in seconds
+SETTLE_PROFILES = {
+    "go to app": (1.0, 8.0),
+    "type": (0.3, 4.0),
+    "click": (0.5, 6.0),
+    "swipe": (0.5, 4.0),
+    "home": (0.3, 3.0),
+    "default": (0.5, 11.0),
+}
+FRAME_SCALE = 8
+DHASH_SIZE = 8
+
+
+def classify_action(action):
+    action = action.lower()
+    for action_type in ["go to app", "type", "click", "swipe", "home"]:
+        if action_type in action:
+            return action_type
+    return "default"
+
+
+def pixel_difference(previous, current):
+    """Mean absolute difference of two grayscale frames, 0-255."""
+    return ImageStat.Stat(ImageChops.difference(previous, current)).mean[0]
+
+
+def dhash(image, hash_size=DHASH_SIZE):
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            right = pixels[row * (hash_size + 1) + column + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def dhash_difference(previous, current):
+    """Number of differing bits between the dHashes of two frames, 0-64."""
+    return bin(dhash(previous) ^ dhash(current)).count("1")
+
+
+class ScreenSettler:
+    """Waits until the screen stops changing after an action instead of sleeping for a fixed time.
+
+    Frames are raw framebuffer captures reduced to a small grayscale thumbnail. The screen is considered settled
+    once `stable_frames` consecutive frames differ by at most `threshold`, or when the action's ceiling timeout
+    is reached.
+    """
+
+    def __init__(self, device, metric="pixel", threshold=2.0, timeout=11.0, poll_interval=0.2, stable_frames=2):
+        self.device = device
+        self.difference = dhash_difference if metric == "dhash" else pixel_difference
+        self.threshold = float(threshold)
+        self.timeout = float(timeout)
+        self.poll_interval = poll_interval
+        self.stable_frames = stable_frames
+        self.metrics = {}
+
+    def capture_frame(self):
+        image, _ = self.device.get_raw_screenshot()
+        return image.reduce(FRAME_SCALE).convert("L")
+
+    def wait(self, action) -> float:
+        action_type = classify_action(action)
+        minimum, timeout = SETTLE_PROFILES[action_type]
+        timeout = min(timeout, self.timeout)
+
+        start = time.time()
+        time.sleep(minimum)
+        previous = self.capture_frame()
+        stable = 0
+        while time.time() - start < timeout:
+            time.sleep(self.poll_interval)
+            frame = self.capture_frame()
+            if self.difference(previous, frame) <= self.threshold:
+                stable += 1
+                if stable >= self.stable_frames:
+                    break
+            else:
+                stable = 0
+            previous = frame
+
+        elapsed = time.time() - start
+        self.metrics.setdefault(action_type, []).append(elapsed)
+        print(f">>> Screen settled after {action_type} in {elapsed:.2f}s")
+        return elapsed
+
+    def report(self):
+        for action_type, durations in self.metrics.items():
+            print(f"Settle {action_type}: {len(durations)} waits, mean {sum(durations) / len(durations):.2f}s, "
+                  f"max {max(durations):.2f}s")
@@ -1,6 +1,12 @@
 import base64
+import hashlib
 import json
 import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
 from io import BytesIO
 from typing import List, Tuple
 
@@ -55,12 +61,143 @@ def add_title_box(img: Image, title: str):
     return new_image
 
 
-def encode_image(image: ImageFile) -> str:
-    buffered = BytesIO()
-    converted_image = image.convert("RGB")
-    converted_image.save(buffered, format="JPEG")
-    img_str_bytes = base64.b64encode(buffered.getvalue())
-    return img_str_bytes.decode("utf-8")
+@dataclass(frozen=True)
+class ImagePolicy:
+    # 0 keeps the original resolution, None uses the cache-wide JPEG quality
+    max_side: int = 0
+    quality: int = None
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    jpeg: bytes
+    base64: str
+    encode_time: float
+    source_size: tuple[int, int]
+    size: tuple[int, int]
+
+    def to_source(self, coordinates):
+        """Maps a point [x, y] or box [x1, y1, x2, y2] given in the sent image back to screenshot coordinates."""
+        if not coordinates or self.size == self.source_size:
+            return coordinates
+        scale_x = self.source_size[0] / self.size[0]
+        scale_y = self.source_size[1] / self.size[1]
+        return [round(value * (scale_x if i % 2 == 0 else scale_y)) for i, value in enumerate(coordinates)]
+
+
+def parse_image_policies(policies) -> dict:
+    """Parses `call_type:max_side[:quality]` entries separated by commas, e.g. `analysis:1024,memory:896:70`."""
+    parsed = {}
+    for entry in (policies or "").split(","):
+        if not entry.strip():
+            continue
+        call_type, *values = entry.strip().split(":")
+        parsed[call_type] = ImagePolicy(int(values[0]) if values else 0, int(values[1]) if len(values) > 1 else None)
+    return parsed
+
+
+class ImageEncodeCache:
+    """Encodes every screenshot to JPEG and base64 once per image policy, however many payloads it is sent in.
+
+    Lookups go through the image object first (entries are dropped when the image is collected) and then through
+    a hash of the pixels, which catches the same screenshot loaded again from disk. Each hit adds the time the
+    original encode took to `saved_time`. A call type (action, analysis, reflection, memory, grounding) can have
+    its own policy that downscales the image to a longest side and sets the JPEG quality.
+    """
+
+    def __init__(self, quality=75, subsampling="4:2:0", max_entries=16):
+        self.quality = quality
+        self.subsampling = subsampling
+        self.policies = {}
+        self.max_entries = max_entries
+        # PIL images are unhashable, so they are tracked by id() with a finalizer instead of a WeakKeyDictionary
+        self.by_identity = {}
+        self.by_content = OrderedDict()
+        # base64 -> JPEG of the entries in by_content, so a binary frame does not decode what was just encoded
+        self.by_base64 = {}
+        self.lock = threading.Lock()
+        self.metrics = {"hits": 0, "misses": 0, "encode_time": 0.0, "saved_time": 0.0}
+
+    def configure(self, quality, subsampling, policies=None):
+        with self.lock:
+            self.quality = int(quality)
+            self.subsampling = subsampling
+            self.policies = parse_image_policies(policies) if isinstance(policies, str) else dict(policies or {})
+            self.by_identity = {}
+            self.by_content.clear()
+            self.by_base64.clear()
+
+    def get(self, image, call_type="default") -> EncodedImage:
+        if isinstance(image, (str, os.PathLike)):
+            image = Image.open(image)
+        policy = self.policies.get(call_type, ImagePolicy())
+        with self.lock:
+            encoded = self.by_identity.get((id(image), policy))
+        if encoded is not None:
+            return self.hit(encoded)
+
+        content_key = (hashlib.blake2b(image.tobytes(), digest_size=16,
+                                       person=f"{image.mode}{image.size}".encode("utf-8")[:16]).digest(), policy)
+        with self.lock:
+            encoded = self.by_content.get(content_key)
+            if encoded is not None:
+                self.by_content.move_to_end(content_key)
+                self.remember(image, policy, encoded)
+        if encoded is not None:
+            return self.hit(encoded)
+
+        start = time.perf_counter()
+        resized = image.convert("RGB")
+        if policy.max_side and max(resized.size) > policy.max_side:
+            scale = policy.max_side / max(resized.size)
+            size = (max(1, round(resized.width * scale)), max(1, round(resized.height * scale)))
+            resized = resized.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        buffered = BytesIO()
+        resized.save(buffered, format="JPEG", quality=policy.quality or self.quality, subsampling=self.subsampling)
+        jpeg = buffered.getvalue()
+        encoded = EncodedImage(jpeg, base64.b64encode(jpeg).decode("utf-8"), time.perf_counter() - start,
+                               image.size, resized.size)
+        with self.lock:
+            self.metrics["misses"] += 1
+            self.metrics["encode_time"] += encoded.encode_time
+            self.remember(image, policy, encoded)
+            self.by_content[content_key] = encoded
+            self.by_base64[encoded.base64] = encoded.jpeg
+            if len(self.by_content) > self.max_entries:
+                _, evicted = self.by_content.popitem(last=False)
+                self.by_base64.pop(evicted.base64, None)
+        return encoded
+
+    def decoded(self, data_base64) -> bytes:
+        """JPEG bytes of a base64 string, taken from the cache when this cache encoded it."""
+        with self.lock:
+            jpeg = self.by_base64.get(data_base64)
+        return jpeg if jpeg is not None else base64.b64decode(data_base64)
+
+    def remember(self, image, policy, encoded):
+        self.by_identity[(id(image), policy)] = encoded
+        weakref.finalize(image, self.by_identity.pop, (id(image), policy), None)
+
+    def hit(self, encoded) -> EncodedImage:
+        with self.lock:
+            self.metrics["hits"] += 1
+            self.metrics["saved_time"] += encoded.encode_time
+        return encoded
+
+    def report(self):
+        print(f"Image encoding: {self.metrics['misses']} encodes in {self.metrics['encode_time']:.2f}s, "
+              f"{self.metrics['hits']} reused, {self.metrics['saved_time']:.2f}s saved")
+
+
+image_encode_cache = ImageEncodeCache()
+
+
+def encode_image(image: ImageFile, call_type="default") -> str:
+    return image_encode_cache.get(image, call_type).base64
+
+
+def encode_image_jpeg(image: ImageFile, call_type="default") -> bytes:
+    return image_encode_cache.get(image, call_type).jpeg
 
 
 def add_action(action_log: str, chat):
@@ -1,17 +1,21 @@
 import base64
-import json
 import string
-import time
 from io import BytesIO
 
-import requests
 from PIL import Image
 
+from async_http import post_json
+from binary_transport import base64_jpeg, image_bytes
+
 API_URL = 'http://127.0.0.1:21006/worker_generate'
 
 
 def encode_image(image: str):
-    image = Image.open(BytesIO(base64.b64decode(image)))
+    # JPEG screenshots are forwarded without decoding, other formats are converted
+    encoded = base64_jpeg(image)
+    if encoded is not None:
+        return encoded
+    image = Image.open(BytesIO(image_bytes(image)))
     image = image.convert('RGB')
     buffered = BytesIO()
     image.save(buffered, format="JPEG")
@@ -29,19 +33,7 @@ def create_local_florence_payload(prompt: str, images: list):
     return payload
 
 
-def query_florence(payload: dict) -> tuple:
-    print("inside query_florence => api/api_florence")
-    while True:
-        try:
-            time.sleep(2)
-            http_response = requests.post(API_URL, json=payload, timeout=20)
-            print("query_florence => api/api")
-            assert http_response.status_code == 200, f"Request failed with status_code: {http_response.status_code}"
-        except:
-            print("timeout => florence")
-            pass
-        else:
-            break
-    output = json.loads(http_response.content)
+async def query_florence(payload: dict) -> tuple:
+    output = await post_json(API_URL, payload, timeout=20)
     print(output)
     return output
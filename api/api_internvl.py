@@ -1,10 +1,15 @@
 import base64
 import json
+import time
 from io import BytesIO
 
-import requests
+import httpx
 from PIL import Image
 
+from async_http import MAX_ATTEMPTS, UpstreamError, backoff, post_json, session
+from binary_transport import base64_jpeg, image_bytes
+from prompt_cache_stats import prompt_cache_stats
+
 API_URL = 'http://0.0.0.0:9000/v1/chat/completions'
 
 MODEL_NAME = "internlm2"
@@ -12,10 +17,16 @@ BASE_GENERATION_CONFIG = {
     "top_p": 1,
     "temperature": 0,
 }
+# fields of the action prompt answer, once all of them are complete the rest of the generation is not needed
+ACTION_FIELDS = ["Thought", "Action", "Operation", "Command", "Description", "Ground truth"]
 
 
 def encode_image(image):
-    image = Image.open(BytesIO(base64.b64decode(image)))
+    # JPEG screenshots are forwarded without decoding, other formats are converted
+    encoded = base64_jpeg(image)
+    if encoded is not None:
+        return encoded
+    image = Image.open(BytesIO(image_bytes(image)))
     image = image.convert('RGB')
     buffered = BytesIO()
     image.save(buffered, format="JPEG")
@@ -55,15 +66,134 @@ def create_internvl_payload(prompt: str, images: list, previous_messages=None):
     return payload
 
 
-def query_internvl(payload: dict) -> dict:
-    while True:
-        try:
-            http_response = requests.post(API_URL, json=payload, timeout=25)
-            assert http_response.status_code == 200, f"Request failed with status_code: {http_response.status_code}"
-        except Exception as e:
-            print(e)
-        else:
-            break
-    output = json.loads(http_response.content)
+async def query_internvl(payload: dict, prompt_type="default") -> dict:
+    output = prompt_cache_stats.observe(prompt_type, payload, await post_json(API_URL, payload, timeout=25))
     print(output)
     return output["choices"][0]
+
+
+class IncrementalFieldParser:
+    """Extracts `Field: value` lines from a streamed completion as soon as each line is complete.
+
+    A field takes the value of the first line containing `Field:`, like `re.search(r"Field:(.*)\\n", text)` does
+    on the full text.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.values = {}
+        self.buffer = ""
+
+    def feed(self, text) -> list[tuple[str, str]]:
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split("\n")
+        return [found for line in lines for found in self.parse_line(line)]
+
+    def flush(self) -> list[tuple[str, str]]:
+        line, self.buffer = self.buffer, ""
+        return self.parse_line(line)
+
+    def parse_line(self, line) -> list[tuple[str, str]]:
+        found = []
+        for field in self.fields:
+            if field not in self.values and f"{field}:" in line:
+                self.values[field] = line.split(f"{field}:", 1)[1].strip()
+                found.append((field, self.values[field]))
+        return found
+
+    def is_complete(self) -> bool:
+        return len(self.values) == len(self.fields)
+
+
+class StreamStats:
+    """Token counts of streamed completions, used to estimate how many tokens early cancellation saves."""
+
+    def __init__(self):
+        self.completed_tokens = []
+        self.cancelled = 0
+        self.tokens_saved = 0
+
+    def record(self, tokens, cancelled):
+        if not cancelled:
+            self.completed_tokens.append(tokens)
+            return 0
+        self.cancelled += 1
+        if not self.completed_tokens:
+            return None
+        saved = max(0, round(sum(self.completed_tokens) / len(self.completed_tokens)) - tokens)
+        self.tokens_saved += saved
+        return saved
+
+
+stream_stats = StreamStats()
+
+
+async def query_internvl_stream(payload: dict, fields=None, on_field=None, prompt_type="action") -> dict:
+    """Streams the completion (`stream: true`) and stops reading once every field in `fields` is complete.
+
+    `on_field(field, value)` is called as each field line completes. Closing the response drops the connection,
+    which makes the server abort the generation, the same happens when the awaiting task is cancelled. Every streamed
+    chunk is counted as one token.
+    """
+    fields = ACTION_FIELDS if fields is None else fields
+    # the usage arrives in a last chunk, so it is only known for streams that were not cancelled
+    stream_payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+    for attempt in range(MAX_ATTEMPTS):
+        await backoff(attempt)
+        start = time.time()
+        parser = IncrementalFieldParser(fields)
+        content, tokens, first_field_time, finish_reason, usage = [], 0, None, None, None
+        try:
+            async with session.get().stream("POST", API_URL, json=stream_payload, timeout=25) as http_response:
+                if http_response.status_code != 200:
+                    raise UpstreamError(f"Request failed with status_code: {http_response.status_code}")
+                async for line in http_response.aiter_lines():
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get("usage") or usage
+                    if not chunk["choices"]:
+                        continue
+                    choice = chunk["choices"][0]
+                    finish_reason = choice.get("finish_reason") or finish_reason
+                    delta = (choice.get("delta") or {}).get("content") or ""
+                    if not delta:
+                        continue
+                    tokens += 1
+                    content.append(delta)
+                    for field, value in parser.feed(delta):
+                        if first_field_time is None:
+                            first_field_time = time.time() - start
+                        if on_field is not None:
+                            on_field(field, value)
+                    if parser.is_complete():
+                        finish_reason = "cancelled"
+                        break
+        except (httpx.HTTPError, UpstreamError, ValueError) as e:
+            # nothing was generated yet (an invalid chunk included), retry like query_internvl does
+            if content:
+                raise
+            print(f"{API_URL}: {e!r}")
+            continue
+        break
+    else:
+        raise UpstreamError(f"Stream from {API_URL} failed after {MAX_ATTEMPTS} attempts")
+
+    for field, value in parser.flush():
+        if first_field_time is None:
+            first_field_time = time.time() - start
+        if on_field is not None:
+            on_field(field, value)
+    saved = stream_stats.record(tokens, finish_reason == "cancelled")
+    prompt_cache_stats.observe(prompt_type, payload, {"usage": usage})
+    first_field = f"{first_field_time:.2f}s" if first_field_time is not None else "never"
+    print(f"InternVL stream: first field after {first_field}, {tokens} tokens in {time.time() - start:.2f}s, "
+          f"finish {finish_reason}, tokens saved {saved if saved is not None else 'unknown'}")
+    return {
+        "message": {"role": "assistant", "content": "".join(content)},
+        "finish_reason": finish_reason,
+        "fields": parser.values
+    }
@@ -0,0 +1,57 @@
+import asyncio
+import random
+
+import httpx
+
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 0.5
+POOL_SIZE = 64
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class AsyncSession:
+    """One httpx.AsyncClient with keep-alive connections for all upstream calls of the server process."""
+
+    def __init__(self, pool_size=POOL_SIZE):
+        self.pool_size = pool_size
+        self.client = None
+
+    def get(self) -> httpx.AsyncClient:
+        # created lazily, an AsyncClient belongs to the event loop it is first used on
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size))
+        return self.client
+
+
+session = AsyncSession()
+
+
+async def backoff(attempt):
+    if attempt > 0:
+        await asyncio.sleep(random.uniform(0, BACKOFF_BASE * 2 ** attempt))
+
+
+async def post_json(url, payload, timeout, attempts=MAX_ATTEMPTS) -> dict:
+    """POSTs `payload` with up to `attempts` tries and jittered backoff in between.
+
+    Every try is bounded by `timeout` seconds, cancelling the awaiting task aborts the request in flight.
+    """
+    last_error = None
+    for attempt in range(attempts):
+        await backoff(attempt)
+        try:
+            http_response = await session.get().post(url, json=payload, timeout=timeout)
+            if http_response.status_code == 200:
+                return http_response.json()
+            last_error = UpstreamError(f"Request failed with status_code: {http_response.status_code}")
+        except httpx.HTTPError as e:
+            last_error = e
+        except ValueError as e:
+            # a truncated or invalid body is retried like an HTTP error
+            last_error = UpstreamError(f"Request returned invalid JSON: {e}")
+        print(f"{url}: {last_error!r}")
+    raise UpstreamError(f"Request to {url} failed after {attempts} attempts: {last_error!r}")
@@ -0,0 +1,71 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class ChatMessage:
+    role: str
+    # (type, value) pairs, value is the text of a "text" part and the url of an "image_url" part
+    parts: tuple
+
+    @classmethod
+    def from_dict(cls, message) -> "ChatMessage":
+        content = message["content"]
+        if isinstance(content, str):
+            return cls(message["role"], (("text", content),))
+        return cls(message["role"], tuple(
+            ("text", part["text"]) if part["type"] == "text" else ("image_url", part["image_url"]["url"])
+            for part in content))
+
+    def to_dict(self) -> dict:
+        content = [{"type": "text", "text": value} if part_type == "text" else
+                   {"type": "image_url", "image_url": {"url": value}} for part_type, value in self.parts]
+        return {"role": self.role, "content": content}
+
+
+class ChatHistory:
+    """Append-only chat history in which every history shares its earlier messages with the one it was appended to.
+
+    `append` returns a new history in O(1) and leaves the old one unchanged, so a history can be kept as a snapshot
+    without copying. Iterating yields the messages as new OpenAI message dicts, built only when they are read.
+    """
+
+    __slots__ = ("parent", "message", "length")
+
+    def __init__(self, parent=None, message=None):
+        self.parent = parent
+        self.message = message
+        self.length = 0 if message is None else len(parent) + 1
+
+    @classmethod
+    def of(cls, messages) -> "ChatHistory":
+        """History from a list of OpenAI message dicts, an existing history is returned as it is."""
+        if isinstance(messages, ChatHistory):
+            return messages
+        history = cls()
+        for message in messages or []:
+            history = cls(history, ChatMessage.from_dict(message))
+        return history
+
+    def append(self, role, *parts) -> "ChatHistory":
+        return ChatHistory(self, ChatMessage(role, parts))
+
+    def append_text(self, role, text, image_urls=()) -> "ChatHistory":
+        return self.append(role, ("text", text), *(("image_url", url) for url in image_urls))
+
+    def messages(self) -> list:
+        messages = []
+        history = self
+        while history.message is not None:
+            messages.append(history.message)
+            history = history.parent
+        messages.reverse()
+        return messages
+
+    def to_list(self) -> list:
+        return [message.to_dict() for message in self.messages()]
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __len__(self):
+        return self.length
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image
+
+# 16x16 gradient bits, an 8x8 hash of a phone screen would not change when a line of text does
+DHASH_SIZE = 16
+
+
+def dhash(image, hash_size=DHASH_SIZE) -> int:
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            right = pixels[row * (hash_size + 1) + column + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def screenshot_hash(data, hash_size=DHASH_SIZE) -> int:
+    image = Image.open(BytesIO(data))
+    # a JPEG is decoded at a fraction of its size, the hash only needs a few pixels per bit
+    image.draft("L", ((hash_size + 1) * 8, hash_size * 8))
+    return dhash(image, hash_size)
+
+
+def hamming_distance(first, second) -> int:
+    return bin(first ^ second).count("1")
+
+
+class DescriptionCache:
+    """Screenshot descriptions keyed by the dHash of the screenshot, so an unchanged screen is not described again.
+
+    A screenshot whose hash differs from a cached one by at most `tolerance` bits reuses its description. The last
+    `max_entries` descriptions are kept in memory (LRU, 0 disables the cache). With `path` they are also written to
+    a SQLite file that workers on the same machine share.
+    """
+
+    def __init__(self, max_entries=0, tolerance=0, path=None):
+        self.max_entries = max_entries
+        self.tolerance = tolerance
+        self.path = path
+        self.entries = OrderedDict()
+        self.connection = None
+        self.lock = threading.Lock()
+        self.metrics = {"hits": 0, "near_hits": 0, "shared_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get_connection(self) -> sqlite3.Connection:
+        if self.connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            # several workers read and write the file at once
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS descriptions (hash TEXT PRIMARY KEY, description TEXT, last_used REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS descriptions_last_used ON descriptions (last_used)")
+        return self.connection
+
+    def get(self, key):
+        with self.lock:
+            match = (key, self.entries[key]) if key in self.entries else self.nearest(self.entries.items(), key)
+            if match is not None:
+                self.entries.move_to_end(match[0])
+                self.metrics["hits" if match[0] == key else "near_hits"] += 1
+                return match[1]
+            if self.path is not None:
+                match = self.find_shared(key)
+                if match is not None:
+                    self.remember(*match)
+                    self.get_connection().execute("UPDATE descriptions SET last_used = ? WHERE hash = ?",
+                                                  (time.time(), format(match[0], "x")))
+                    self.get_connection().commit()
+                    self.metrics["shared_hits"] += 1
+                    return match[1]
+            self.metrics["misses"] += 1
+            return None
+
+    def put(self, key, description):
+        with self.lock:
+            self.remember(key, description)
+            self.metrics["stores"] += 1
+            if self.path is not None:
+                connection = self.get_connection()
+                connection.execute("INSERT OR REPLACE INTO descriptions VALUES (?, ?, ?)",
+                                   (format(key, "x"), description, time.time()))
+                connection.execute("DELETE FROM descriptions WHERE hash IN (SELECT hash FROM descriptions "
+                                   "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+                connection.commit()
+
+    def nearest(self, entries, key):
+        """(key, description) of the entry closest to `key` within the tolerance, None if there is none."""
+        best = None
+        for cached_key, description in entries:
+            distance = hamming_distance(cached_key, key)
+            if distance <= self.tolerance and (best is None or distance < best[0]):
+                best = distance, cached_key, description
+        return best[1:] if best is not None else None
+
+    def find_shared(self, key):
+        if self.tolerance == 0:
+            row = self.get_connection().execute(
+                "SELECT description FROM descriptions WHERE hash = ?", (format(key, "x"),)).fetchone()
+            return (key, row[0]) if row is not None else None
+        rows = self.get_connection().execute(
+            "SELECT hash, description FROM descriptions ORDER BY last_used DESC LIMIT ?", (self.max_entries,))
+        return self.nearest(((int(cached_key, 16), description) for cached_key, description in rows), key)
+
+    def remember(self, key, description):
+        self.entries[key] = description
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.metrics["evictions"] += 1
+
+    def report(self):
+        if self.enabled:
+            print(f"Description cache: {self.metrics['hits']} hits, {self.metrics['near_hits']} within "
+                  f"{self.tolerance} bits, {self.metrics['shared_hits']} from {self.path}, "
+                  f"{self.metrics['misses']} misses, {self.metrics['evictions']} evicted")
@@ -1,10 +1,8 @@
 import asyncio
-import base64
-import copy
+import functools
 import json
 import re
 import time
-from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 import torch
@@ -16,11 +14,26 @@ from fastchat.serve.model_worker import BaseModelWorker, worker_id
 from fastchat.utils import build_logger
 from transformers import GenerationConfig
 
+import api_florence
+import api_internvl
 from api_florence import create_local_florence_payload, query_florence
-from api_internvl import create_internvl_payload, query_internvl
+from api_internvl import create_internvl_payload, query_internvl, query_internvl_stream
+from binary_transport import image_bytes, read_params
+from chat_history import ChatHistory
+from description_cache import DescriptionCache, screenshot_hash
+from image_store import ImageStore
+from prompt_cache_stats import prompt_cache_stats
+from sessions import SessionStore, StaleSessionState
 
 logger = build_logger("model_worker", f"model_worker_{worker_id}.log")
 app = FastAPI()
+image_store = ImageStore()
+description_cache = DescriptionCache()
+session_store = SessionStore()
+# prompt layout of the agent that puts static content first, see prompt.py of the agent
+PREFIX_LAYOUT = "prefix"
+# seconds between checks whether the agent waiting for a generation is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
 
 
 class ApiWorker(BaseModelWorker):
@@ -30,6 +43,8 @@ class ApiWorker(BaseModelWorker):
             worker_id: str,
             limit_worker_concurrency: int,
             worker_host: str, worker_port: int,
+            stream_action: bool = False,
+            speculative_action: bool = False,
     ):
         self.worker_addr = f"http://{worker_host}:{worker_port}"
         super().__init__(
@@ -43,13 +58,15 @@ class ApiWorker(BaseModelWorker):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
         self.torch_type = torch.bfloat16
+        self.stream_action = stream_action
+        self.speculative_action = speculative_action
 
     async def generate_decision(
             self,
             params: dict,
     ):
         try:
-            reflect = self.get_reflection(params)
+            reflect = await self.get_reflection(params)
 
         except Exception as e:
             logger.exception("Error encountered during generation")
@@ -63,36 +80,48 @@ class ApiWorker(BaseModelWorker):
             "text": reflect,
         }
 
-    def get_reflection(self, params: dict):
+    async def get_reflection(self, params: dict, timings=None):
         if not params["use_eval"]:
             return "failure", "", "", ""
+        timings = {} if timings is None else timings
+        output_description, chat_description = await timed(timings, "describe", self.describe(params))
+        statuses, reflects, answer, chat_eval, rates = await timed(
+            timings, "evaluate", self.evaluate(params, output_description))
+        return statuses, reflects, answer, output_description, chat_eval, rates, chat_description
+
+    async def describe(self, params: dict):
         print("--------------------")
         start = time.time()
         text = f"Please describe the screenshot above in details.\n"
-        end = time.time()
-        print(end - start)
-        start = time.time()
         chat_description = init_describe_chat()
-        payload = create_internvl_payload(text, [params["image"]], chat_description)
-        output_description = query_internvl(payload=payload)["message"]["content"] + "\n"
+        output_description, key = None, None
+        if description_cache.enabled:
+            # decoding the screenshot and the SQLite lookup would hold up the other requests on the event loop
+            key = await asyncio.to_thread(screenshot_hash, image_bytes(params["image"]))
+            output_description = await asyncio.to_thread(description_cache.get, key)
+        if output_description is None:
+            payload = create_internvl_payload(text, [params["image"]], chat_description)
+            output_description = await query_internvl(payload=payload, prompt_type="describe")
+            output_description = output_description["message"]["content"] + "\n"
+            if key is not None:
+                await asyncio.to_thread(description_cache.put, key, output_description)
         chat_description = add_response("user", text, chat_description)
         chat_description = add_response("assistant", output_description, chat_description)
         print("-------" + output_description)
         print("end decsription---")
-        end = time.time()
-        chat_eval = init_eval_chat(params["prompt_init_chat"])
-        prompt = [build_final_eval_v3_final_prompt(reflection, output_description) for reflection in
-                  params["prompt_reflection"]]
-        payload = [create_internvl_payload(prompt[0], [], chat_eval[0]),
-                   create_internvl_payload(prompt[1], [], chat_eval[1])]
+        print("internvl describe", time.time() - start)
+        return output_description, chat_description
 
-        print("internvl describe", end - start)
+    async def evaluate(self, params: dict, output_description):
         start = time.time()
-
-        with ThreadPoolExecutor(max_workers=len(payload)) as executor:
-            futures = [executor.submit(query_internvl, payl) for payl in payload]
-
-        output_reflect = [future.result()['message']['content'] + "\n" for future in futures]
+        # a session holds the evaluators' system chats, a ChatHistory is never modified so its steps share them
+        chat_eval = list(params.get("eval_chats") or init_eval_chat(params["prompt_init_chat"]))
+        prompt = [build_final_eval_v3_final_prompt(reflection, output_description, params.get("prompt_layout"))
+                  for reflection in params["prompt_reflection"]]
+        payload = [create_internvl_payload(prompt[0], [], chat_eval[0]),
+                   create_internvl_payload(prompt[1], [], chat_eval[1])]
+        outputs = await asyncio.gather(*[query_internvl(payl, "eval") for payl in payload])
+        output_reflect = [output['message']['content'] + "\n" for output in outputs]
         statuses = []
         reflects = []
         rates = []
@@ -116,52 +145,31 @@ class ApiWorker(BaseModelWorker):
             print("Answer in reflection: ", answer)
             chat_eval[i] = add_response("user", prompt[i], chat_eval[i])
             chat_eval[i] = add_response("assistant", out, chat_eval[i])
-        end = time.time()
-        print("reflecrion", end - start)
+        print("reflecrion", time.time() - start)
+        return statuses, reflects, answer, chat_eval, rates
 
-        return statuses, reflects, answer, output_description, chat_eval, rates, chat_description
-
-    async def generate_action(
-            self,
-            params: dict,
-    ):
+    async def act(self, params: dict, output_description, timings):
+        chat_action = init_action_chat()
+        prompt = build_action_prompt(params["prompt"], output_description, params.get("prompt_layout"))
+        payload = create_internvl_payload(prompt, [params["image"]], chat_action)
+        start = time.time()
+        florence_task = None
         try:
-            status_reflect, reflect_done, answer, output_description, chat_eval, rates, chat_description = (
-                self.get_reflection(params)
-            )
-            if "success" in status_reflect[0].lower() and "success" in status_reflect[1].lower() and (
-                    int(rates[0]) + int(rates[1])) >= 10:
-                return {
-                    "exit_code": 0,
-                    "summary": "",
-                    "thought": "",
-                    "action": "",
-                    "response": "",
-                    "success": '\n'.join(status_reflect),
-                    "command": "",
-                    "groundtruth": "",
-                    "reflection_status": '\n'.join(reflect_done),
-                    "description": "",
-                    "prompt": "",
-                    "bbox": None,
-                    "chat_action": "",
-
-                    "chat_eval": json.dumps(chat_eval[0]),
-                    "chat_eval_1": json.dumps(chat_eval[1]),
-                    "rates": rates,
-                    "chat_description": json.dumps(chat_description),
-                    "answer": answer
-
-                }
-            chat_action = init_action_chat()
-            prompt = f"""### Screenshot Information ###
-This is description of screenshot. You can generate your output based on it.
-{output_description} 
-### Background ###
-{params["prompt"]}"""
-            payload = create_internvl_payload(prompt, [params["image"]], chat_action)
-            start = time.time()
-            output_action = query_internvl(payload=payload)
+            if self.stream_action:
+                streamed_fields = {}
+
+                def on_field(field, value):
+                    nonlocal florence_task
+                    streamed_fields[field] = value
+                    command_so_far = streamed_fields.get("Command")
+                    if field == "Description" and needs_grounding(command_so_far, streamed_fields.get("Action") or ""):
+                        # ground the element while the model is still writing the remaining fields
+                        florence_task = asyncio.create_task(query_florence(create_grounding_payload(
+                            command_so_far, grounding_description(value), params["image"])))
+
+                output_action = await query_internvl_stream(payload, on_field=on_field)
+            else:
+                output_action = await query_internvl(payload=payload)
             print(output_action)
             output_action = output_action["message"]["content"] + "\n"
             chat_action = add_response("user", prompt, chat_action)
@@ -190,26 +198,97 @@ This is description of screenshot. You can generate your output based on it.
                 answer = answer.group(1).strip()
             print("answer: => ", answer)
 
-            end = time.time()
-            print("action gen", end - start)
+            timings["action"] = time.time() - start
+            print("action gen", timings["action"])
 
             response = None
-            if command and (
-                    "click" in command.lower() or "type" in command.lower() or "click" in action.lower() or "type" in action.lower()):
-                description = description.lower()
-                description = description.replace("address bar", "url address bar")
-
-                if description:
-                    payload_florence = create_local_florence_payload("click " + description, [params["image"]])
+            if needs_grounding(command, action):
+                description = grounding_description(description)
+                if florence_task is not None:
+                    response = await florence_task
                 else:
-                    print("Description is empty, command: ", command)
-                    payload_florence = create_local_florence_payload(str(command), [params["image"]])
+                    print("Query florence after payload")
+                    response = await query_florence(create_grounding_payload(command, description, params["image"]))
 
-                print("Query florence after payload")
-                response = query_florence(payload_florence)
+            # with a streamed action the grounding overlaps the generation, this is only the time waited after it
+            timings["grounding"] = time.time() - start - timings["action"]
+            print("florence", time.time() - start)
+        finally:
+            # a grounding started for an action that failed or was cancelled is not needed anymore
+            if florence_task is not None and not florence_task.done():
+                florence_task.cancel()
 
-            end = time.time()
-            print("florence", end - start)
+        return {
+            "summary": summary,
+            "thought": thought,
+            "action": action,
+            "response": response["click_point"] if response and "click_point" in response else None,
+            "bbox": response["box"] if response and "box" in response else None,
+            "command": command,
+            "groundtruth": groundtruth,
+            "description": description,
+            "prompt": prompt,
+            "chat_action": json.dumps(chat_action.to_list()),
+            "answer": answer
+        }
+
+    async def generate_action(
+            self,
+            params: dict,
+    ):
+        timings = {}
+        start = time.time()
+        action_task = None
+        try:
+            if self.speculative_action and params["use_eval"]:
+                # the action only needs the description, it is generated while the evaluators run and discarded
+                # if they find the task already done
+                output_description, chat_description = await timed(timings, "describe", self.describe(params))
+                action_task = asyncio.create_task(self.act(params, output_description, timings))
+                action_start = time.time()
+                status_reflect, reflect_done, answer, chat_eval, rates = await timed(
+                    timings, "evaluate", self.evaluate(params, output_description))
+            else:
+                status_reflect, reflect_done, answer, output_description, chat_eval, rates, chat_description = (
+                    await self.get_reflection(params, timings)
+                )
+            if is_task_done(status_reflect, rates):
+                if action_task is not None:
+                    discard(action_task)
+                    timings["discarded_action"] = time.time() - action_start
+                    print("Speculative action discarded, the evaluators report the task done")
+                timings["total"] = time.time() - start
+                return {
+                    "exit_code": 0,
+                    "summary": "",
+                    "thought": "",
+                    "action": "",
+                    "response": "",
+                    "success": '\n'.join(status_reflect),
+                    "command": "",
+                    "groundtruth": "",
+                    "reflection_status": '\n'.join(reflect_done),
+                    "description": "",
+                    "prompt": "",
+                    "bbox": None,
+                    "chat_action": "",
+
+                    "chat_eval": json.dumps(chat_eval[0].to_list()),
+                    "chat_eval_1": json.dumps(chat_eval[1].to_list()),
+                    "rates": rates,
+                    "chat_description": json.dumps(chat_description.to_list()),
+                    "answer": answer,
+                    "timings": timings
+
+                }
+            if action_task is not None:
+                output_action = await action_task
+            else:
+                output_action = await self.act(params, output_description, timings)
+            timings["total"] = time.time() - start
+            print("stage timings", {stage: round(seconds, 2) for stage, seconds in timings.items()})
+            prompt_cache_stats.report()
+            description_cache.report()
         except Exception as e:
             logger.exception("Error encountered during generation")
             return {
@@ -217,30 +296,61 @@ This is description of screenshot. You can generate your output based on it.
                 "text": "",
                 "error_code": str(e),
             }
+        finally:
+            if action_task is not None:
+                discard(action_task)
 
         return {
             "exit_code": 0,
-            "summary": summary,
-            "thought": thought,
-            "action": action,
-            "response": response["click_point"] if response and "click_point" in response else None,
-            "bbox": response["box"] if response and "box" in response else None,
+            **output_action,
             "success": '\n'.join(status_reflect),
-            "command": command,
-            "groundtruth": groundtruth,
             "reflection_status": '\n'.join(reflect_done),
-            "description": description,
-            "prompt": prompt,
-            "chat_action": json.dumps(chat_action),
-            "chat_eval": json.dumps(chat_eval[0]),
-            "chat_eval_1": json.dumps(chat_eval[1]),
+            "chat_eval": json.dumps(chat_eval[0].to_list()),
+            "chat_eval_1": json.dumps(chat_eval[1].to_list()),
             "rates": rates,
-            "chat_description": json.dumps(chat_description),
-            "answer": answer
-
+            "chat_description": json.dumps(chat_description.to_list()),
+            "timings": timings
         }
 
 
+def discard(task):
+    """Cancels a task whose result is not needed, an exception it already ended with is retrieved so asyncio does
+    not log it as never retrieved."""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+
+async def timed(timings, stage, coroutine):
+    start = time.time()
+    result = await coroutine
+    timings[stage] = time.time() - start
+    return result
+
+
+def is_task_done(statuses, rates):
+    return "success" in statuses[0].lower() and "success" in statuses[1].lower() and (
+            int(rates[0]) + int(rates[1])) >= 10
+
+
+def needs_grounding(command, action):
+    return bool(command) and ("click" in command.lower() or "type" in command.lower()
+                              or "click" in action.lower() or "type" in action.lower())
+
+
+def grounding_description(description):
+    description = description.lower()
+    return description.replace("address bar", "url address bar")
+
+
+def create_grounding_payload(command, description, image):
+    if description:
+        return create_local_florence_payload("click " + description, [image])
+    print("Description is empty, command: ", command)
+    return create_local_florence_payload(str(command), [image])
+
+
 def remove_punctuation(input_string):
     import string
     return ''.join(ch for ch in input_string if ch not in set(string.punctuation))
@@ -281,53 +391,44 @@ generation_config = GenerationConfig.from_dict(
 
 
 def add_response(role, prompt, chat_history):
-    new_chat_history = copy.deepcopy(chat_history)
-
-    content = [
-        {
-            'type': 'text',
-            'text': prompt
-        },
-    ]
-    new_chat_history.append({'role': role, 'content': content})
-    return new_chat_history
+    return ChatHistory.of(chat_history).append_text(role, prompt)
 
 
+# the system chats never change and a ChatHistory is never modified, so every request shares one
+@functools.lru_cache(maxsize=None)
 def init_describe_chat():
-    operation_history = []
     system_prompt = ('You are a helpful AI phone screenshot captioner. I need you to help me describe the phone '
                      'screenshot in great detail. Describe every UI element you see and is clickable and every text '
                      'you see. Try to recognize what application is opened now.')
-    operation_history.append({'role': 'system', 'content': [{'type': 'text', 'text': system_prompt}]})
-    return operation_history
+    return ChatHistory().append_text('system', system_prompt)
 
 
+@functools.lru_cache(maxsize=None)
 def init_action_chat():
-    operation_history = []
     system_prompt = ('You are a helpful AI american mobile phone operating assistant. You need to help me operate the '
                      'phone to complete the user\'s instruction. Do not allow location sharing and cookies.')
-    operation_history.append({'role': 'system', 'content': [{'type': 'text', 'text': system_prompt}]})
-    return operation_history
+    return ChatHistory().append_text('system', system_prompt)
 
 
 def init_numeral_chat():
-    operation_history = []
     system_prompt = ('You are a helpful AI mobile phone operating assistant. You need to help me caption the image, '
                      'say if there is numeral, and describe UI element which should be clicked.')
-    operation_history.append({'role': 'system', 'content': [{'type': 'text', 'text': system_prompt}]})
-    return operation_history
+    return ChatHistory().append_text('system', system_prompt)
 
 
 def init_eval_chat(chats):
-    operation_history = [[{'role': 'system', 'content': [{'type': 'text', 'text': chats[0]}]}],
-                         [{'role': 'system', 'content': [{'type': 'text', 'text': chats[1]}]}]]
-
-    return operation_history
+    return [ChatHistory().append_text('system', chats[0]), ChatHistory().append_text('system', chats[1])]
 
 
 def build_final_eval_v3_final_prompt(
-        prompt, cap
+        prompt, cap, layout=None
 ):
+    if layout == PREFIX_LAYOUT:
+        return f"""{prompt}
+The detailed final state of the screen:
+```md
+{cap}
+```"""
     prompt = f"""The detailed final state of the screen:
 ```md
 {cap}
@@ -336,12 +437,53 @@ def build_final_eval_v3_final_prompt(
     return prompt
 
 
+def build_action_prompt(prompt, description, layout=None):
+    # the prefix layout of the agent's prompt only pays off if the screenshot description comes after it
+    if layout == PREFIX_LAYOUT:
+        return f"""{prompt}
+### Screenshot Information ###
+This is description of screenshot. You can generate your output based on it.
+{description}"""
+    return f"""### Screenshot Information ###
+This is description of screenshot. You can generate your output based on it.
+{description} 
+### Background ###
+{prompt}"""
+
+
 def load_image(image_file):
-    image = Image.open(BytesIO(base64.b64decode(image_file)))
+    image = Image.open(BytesIO(image_bytes(image_file)))
     image = image.convert('RGB')
     return image
 
 
+def resolve_image(params) -> bool:
+    """Stores an inline image and replaces an `image_id` by the stored image, False for an unknown id."""
+    image = params.get("image")
+    if image is not None:
+        params["image_id"] = image_store.put(image_bytes(image), image if isinstance(image, str) else None)
+    elif params.get("image_id") is None:
+        return True
+    stored = image_store.get(params["image_id"])
+    if stored is None:
+        return False
+    # every payload built from the image reuses the stored base64 instead of decoding and encoding it again
+    params["image"] = stored.base64
+    return True
+
+
+def with_image_id(output, params) -> dict:
+    # the agent sends only this id when it sends the same screenshot again
+    if params.get("image_id") is None:
+        return output
+    return {**output, "image_id": params["image_id"]}
+
+
+def unknown_image_response(params):
+    return JSONResponse({"exit_code": 1, "text": "", "error_code": f"Unknown image_id {params['image_id']}"},
+                        status_code=404)
+
+
 def release_worker_semaphore():
     worker.semaphore.release()
 
@@ -358,27 +500,91 @@ def create_background_tasks():
     return background_tasks
 
 
+async def run_until_disconnected(request: Request, coroutine):
+    """Runs the generation, cancelling it together with its upstream requests when the agent disconnects."""
+    task = asyncio.create_task(coroutine)
+    while not task.done():
+        await asyncio.wait([task], timeout=DISCONNECT_POLL_INTERVAL)
+        if not task.done() and await request.is_disconnected():
+            task.cancel()
+            print("Agent disconnected, generation cancelled")
+            return {"exit_code": 1, "text": "", "error_code": "client disconnected"}
+    return task.result()
+
+
 @app.post("/worker_generate_decision")
 async def api_generate(request: Request):
-    params = await request.json()
+    params = await read_params(request)
+    if not resolve_image(params):
+        return unknown_image_response(params)
     await acquire_worker_semaphore()
-    output = await worker.generate_decision(params)
-    release_worker_semaphore()
-    return JSONResponse(output)
+    try:
+        output = await run_until_disconnected(request, worker.generate_decision(params))
+    finally:
+        release_worker_semaphore()
+    return JSONResponse(with_image_id(output, params))
 
 
 @app.post("/worker_generate_plan")
 async def api_generate(request: Request):
-    params = await request.json()
+    params = await read_params(request)
+    if not resolve_image(params):
+        return unknown_image_response(params)
+    await acquire_worker_semaphore()
+    try:
+        output = await run_until_disconnected(request, worker.generate_action(params))
+    finally:
+        release_worker_semaphore()
+    return JSONResponse(with_image_id(output, params))
+
+
+@app.post("/session")
+async def api_create_session(request: Request):
+    params = await read_params(request)
+    return JSONResponse({"session_id": session_store.create(params).session_id})
+
+
+@app.post("/session_generate_plan")
+async def api_session_generate(request: Request):
+    delta = await read_params(request)
+    if not resolve_image(delta):
+        return unknown_image_response(delta)
+    session = session_store.get(delta["session_id"])
+    if session is None:
+        # 410 and not 404, which means an unknown image_id to the agent
+        return JSONResponse({"exit_code": 1, "text": "", "error_code": f"Unknown session {delta['session_id']}"},
+                            status_code=410)
+    try:
+        params = session.apply(delta)
+    except StaleSessionState as e:
+        session_store.count("stale")
+        return JSONResponse({"exit_code": 1, "text": "", "error_code": str(e)}, status_code=409)
+    session_store.count("steps")
     await acquire_worker_semaphore()
-    output = await worker.generate_action(params)
-    release_worker_semaphore()
-    return JSONResponse(output)
+    try:
+        output = await run_until_disconnected(request, worker.generate_action(params))
+    finally:
+        release_worker_semaphore()
+    return JSONResponse(with_image_id(output, delta))
+
+
+@app.post("/session_close")
+async def api_close_session(request: Request):
+    params = await read_params(request)
+    session_store.close(params["session_id"])
+    return JSONResponse({"session_id": params["session_id"]})
+
+
+@app.post("/upload_image")
+async def api_upload_image(request: Request):
+    params = await read_params(request)
+    return JSONResponse({"image_id": image_store.put(image_bytes(params["image"]))})
 
 
 @app.post("/worker_get_status")
 async def api_get_status(request: Request):
-    return worker.get_status()
+    return {**worker.get_status(), "image_store": image_store.metrics, "prompt_cache": prompt_cache_stats.stats,
+            "description_cache": description_cache.metrics, "sessions": session_store.status()}
 
 
 @app.post("/count_token")
@@ -439,14 +645,76 @@ if __name__ == '__main__':
         default=5,
         help="Limit the model concurrency to prevent OOM.",
     )
+    parser.add_argument(
+        "--stream-action",
+        action="store_true",
+        help="Stream the action completion, start Florence grounding once Description is known and stop the "
+             "generation after the last needed field.",
+    )
+    parser.add_argument(
+        "--speculative-action",
+        action="store_true",
+        help="Generate the action while the evaluators run and discard it if they report the task done.",
+    )
+    parser.add_argument(
+        "--image-store-size",
+        type=int,
+        default=64,
+        help="Number of uploaded screenshots kept for requests referring to them by image_id.",
+    )
+    parser.add_argument(
+        "--description-cache-size",
+        type=int,
+        default=0,
+        help="Number of screenshot descriptions reused for screenshots with the same dHash, 0 disables the cache.",
+    )
+    parser.add_argument(
+        "--description-cache-tolerance",
+        type=int,
+        default=0,
+        help="Max number of differing dHash bits (of 256) for a screenshot to reuse a cached description.",
+    )
+    parser.add_argument(
+        "--description-cache-path",
+        type=str,
+        default=None,
+        help="SQLite file the description cache is written to and shared through with other workers.",
+    )
+    parser.add_argument(
+        "--session-idle-timeout",
+        type=float,
+        default=600,
+        help="Seconds after which a session without steps is evicted.",
+    )
+    parser.add_argument(
+        "--internvl-url",
+        type=str,
+        default=api_internvl.API_URL,
+        help="Chat completions endpoint of the InternVL server.",
+    )
+    parser.add_argument(
+        "--florence-url",
+        type=str,
+        default=api_florence.API_URL,
+        help="Generate endpoint of the Florence worker.",
+    )
     args = parser.parse_args()
+    image_store.max_entries = args.image_store_size
+    description_cache.max_entries = args.description_cache_size
+    description_cache.tolerance = args.description_cache_tolerance
+    description_cache.path = args.description_cache_path
+    session_store.idle_timeout = args.session_idle_timeout
+    api_internvl.API_URL = args.internvl_url
+    api_florence.API_URL = args.florence_url
 
     worker = ApiWorker(
         args.controller_address,
         worker_id,
         args.limit_worker_concurrency,
         args.host,
-        args.port
+        args.port,
+        args.stream_action,
+        args.speculative_action
     )
 
     uvicorn.run(app, host=args.host, port=args.port, log_level="info")
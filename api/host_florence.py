@@ -1,6 +1,5 @@
 import torch
 import uvicorn
-import base64
 import asyncio
 from fastapi import FastAPI, Request, BackgroundTasks
 from fastapi.responses import JSONResponse
@@ -13,6 +12,7 @@ import albumentations as A
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 
+from binary_transport import image_bytes, read_params
 from data import FlorenceDataset, collator
 import numpy as np
 from functools import partial
@@ -146,7 +146,7 @@ class FlorenceWorker(BaseModelWorker):
 
 
 def load_image(image_file, input_size=448, max_num=12):
-    image = base64.b64decode(image_file)
+    image = image_bytes(image_file)
     np_image = np.frombuffer(image, dtype=np.uint8)
     return np_image
 
@@ -170,7 +170,7 @@ def create_background_tasks():
 @app.post("/worker_generate")
 async def api_generate(request: Request):
     await acquire_worker_semaphore()
-    params = await request.json()
+    params = await read_params(request)
 
     output = await worker.generate(params)
     release_worker_semaphore()
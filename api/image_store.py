@@ -0,0 +1,49 @@
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+def image_id(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@dataclass(frozen=True)
+class StoredImage:
+    data: bytes
+    # encoded once and shared by every payload built from the image
+    base64: str
+
+
+class ImageStore:
+    """Bounded LRU store of uploaded screenshots keyed by the sha256 of their bytes."""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+        self.metrics = {"uploads": 0, "hits": 0, "misses": 0, "evictions": 0}
+
+    def put(self, data, data_base64=None) -> str:
+        key = image_id(data)
+        with self.lock:
+            if key in self.images:
+                self.images.move_to_end(key)
+                return key
+            self.images[key] = StoredImage(data, data_base64 or base64.b64encode(data).decode("utf-8"))
+            self.metrics["uploads"] += 1
+            while len(self.images) > self.max_entries:
+                self.images.popitem(last=False)
+                self.metrics["evictions"] += 1
+        return key
+
+    def get(self, key):
+        with self.lock:
+            image = self.images.get(key)
+            if image is None:
+                self.metrics["misses"] += 1
+                return None
+            self.images.move_to_end(key)
+            self.metrics["hits"] += 1
+            return image
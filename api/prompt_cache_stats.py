@@ -0,0 +1,72 @@
+import hashlib
+import os
+import threading
+from collections import deque
+
+# earlier prompts a new prompt is compared with, roughly what the server keeps cached during a task
+HISTORY_SIZE = 32
+
+
+def flatten_messages(payload) -> str:
+    """Chat payload as one string in the order the server reads it, images replaced by a hash of their data."""
+    parts = []
+    for message in payload.get("messages", []):
+        parts.append(f"<|{message['role']}|>")
+        content = message["content"]
+        if isinstance(content, str):
+            parts.append(content)
+            continue
+        for item in content:
+            if item["type"] == "text":
+                parts.append(item["text"])
+            else:
+                digest = hashlib.blake2b(item["image_url"]["url"].encode("utf-8"), digest_size=8).hexdigest()
+                parts.append(f"<image:{digest}>")
+    return "\n".join(parts)
+
+
+class PromptCacheStats:
+    """Expected and observed prefix cache hit rate of chat completions per prompt type.
+
+    Expected is the share of a prompt (in characters, images counted as one placeholder) that repeats the start of
+    one of the last prompts sent, the part a prefix cache could reuse. Observed is `cached_tokens` / `prompt_tokens`
+    of the usage the server reports, vLLM needs `--enable-prompt-tokens-details` for it.
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.history = deque(maxlen=history_size)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def observe(self, prompt_type, payload, output) -> dict:
+        prompt = flatten_messages(payload)
+        usage = output.get("usage") or {}
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        with self.lock:
+            shared = max((len(os.path.commonprefix([prompt, previous])) for previous in self.history), default=0)
+            self.history.append(prompt)
+            stats = self.stats.setdefault(prompt_type, {"requests": 0, "prompt_chars": 0, "shared_chars": 0,
+                                                        "reported": 0, "prompt_tokens": 0, "cached_tokens": 0})
+            stats["requests"] += 1
+            stats["prompt_chars"] += len(prompt)
+            stats["shared_chars"] += shared
+            if cached_tokens is not None:
+                stats["reported"] += 1
+                stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                stats["cached_tokens"] += cached_tokens
+        return output
+
+    def report(self):
+        with self.lock:
+            stats = {prompt_type: dict(values) for prompt_type, values in self.stats.items()}
+        for prompt_type, values in stats.items():
+            expected = values["shared_chars"] / max(1, values["prompt_chars"])
+            observed = "not reported"
+            if values["reported"]:
+                observed = f"{values['cached_tokens'] / max(1, values['prompt_tokens']):.0%} " \
+                           f"of {values['prompt_tokens']} tokens"
+            print(f"Prefix cache {prompt_type}: {values['requests']} requests, expected hit {expected:.0%}, "
+                  f"observed {observed}")
+
+
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,119 @@
+import hashlib
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from chat_history import ChatHistory
+
+# stands for the action history in the evaluator prompts of a session, see host_session.py of the agent
+ACTION_HISTORY_MARKER = "<|action_history|>"
+
+
+class StaleSessionState(Exception):
+    pass
+
+
+def prefix_hash(text) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+@dataclass
+class Session:
+    """Per-task state of an agent, so its steps only send what changed since the previous step."""
+    session_id: str
+    instruction: str
+    use_eval: bool
+    prompt_init_chat: list
+    # evaluator prompts with ACTION_HISTORY_MARKER where the action history goes
+    prompt_reflection: list
+    prompt_layout: str = None
+    prompt: str = ""
+    action_history: list = field(default_factory=list)
+    last_used: float = field(default_factory=time.time)
+    # system chats of the two evaluators, built once and shared by every step of the session
+    eval_chats: list = field(init=False)
+
+    def __post_init__(self):
+        self.eval_chats = [ChatHistory().append_text("system", chat) for chat in self.prompt_init_chat]
+
+    def apply(self, delta) -> dict:
+        """Applies the step delta and returns the full plan parameters, raises StaleSessionState if the delta was
+        computed against state this session does not have (e.g. a step whose response the agent never received)."""
+        prompt_keep = delta.get("prompt_keep", 0)
+        history_keep = delta.get("action_history_keep", 0)
+        if prefix_hash(self.prompt[:prompt_keep]) != delta.get("prompt_base", prefix_hash("")) or \
+                len(self.action_history) < history_keep:
+            raise StaleSessionState(f"Session {self.session_id} does not match the step delta")
+        self.prompt = self.prompt[:prompt_keep] + delta.get("prompt_append", "")
+        self.action_history = self.action_history[:history_keep] + delta.get("action_history_append", [])
+        last_actions = str(self.action_history)
+        params = {
+            "prompt": self.prompt,
+            "instruction": self.instruction,
+            "action_history": self.action_history,
+            "use_eval": self.use_eval,
+            "prompt_reflection": [prompt.replace(ACTION_HISTORY_MARKER, last_actions)
+                                  for prompt in self.prompt_reflection],
+            "prompt_init_chat": self.prompt_init_chat,
+            "eval_chats": self.eval_chats,
+        }
+        if self.prompt_layout is not None:
+            params["prompt_layout"] = self.prompt_layout
+        for name in ("image", "image_id"):
+            if name in delta:
+                params[name] = delta[name]
+        return params
+
+
+class SessionStore:
+    """Sessions by id, a session idle for longer than `idle_timeout` seconds is evicted."""
+
+    def __init__(self, idle_timeout=600):
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.metrics = {"created": 0, "steps": 0, "stale": 0, "evicted": 0, "closed": 0}
+
+    def create(self, params) -> Session:
+        session = Session(
+            session_id=uuid.uuid4().hex,
+            instruction=params["instruction"],
+            use_eval=params["use_eval"],
+            prompt_init_chat=params["prompt_init_chat"],
+            prompt_reflection=params["prompt_reflection"],
+            prompt_layout=params.get("prompt_layout"),
+        )
+        with self.lock:
+            self.evict_idle()
+            self.sessions[session.session_id] = session
+            self.metrics["created"] += 1
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            self.evict_idle()
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.time()
+            return session
+
+    def close(self, session_id):
+        with self.lock:
+            if self.sessions.pop(session_id, None) is not None:
+                self.metrics["closed"] += 1
+
+    def count(self, name):
+        with self.lock:
+            self.metrics[name] += 1
+
+    def evict_idle(self):
+        now = time.time()
+        for session_id in [session_id for session_id, session in self.sessions.items()
+                           if now - session.last_used > self.idle_timeout]:
+            del self.sessions[session_id]
+            self.metrics["evicted"] += 1
+
+    def status(self) -> dict:
+        with self.lock:
+            return {**self.metrics, "active": len(self.sessions)}
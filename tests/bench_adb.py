@@ -0,0 +1,120 @@
+import argparse
+import os
+import shutil
+import socketserver
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agent"))
+
+from adb_client import AdbClient
+
+FAKE_SERIAL = "emulator-5554"
+
+
+class FakeAdbServerHandler(socketserver.BaseRequestHandler):
+    """Stand-in for the adb server: answers the smart-socket requests used by AdbClient and the adb binary."""
+
+    def handle(self):
+        transport = False
+        while True:
+            request = self.read_request()
+            if request is None:
+                return
+            if request == "host:version":
+                self.reply_with_payload(f"{41:04x}")
+                return
+            if request in ("host:features", f"host-serial:{FAKE_SERIAL}:features"):
+                self.reply_with_payload("")
+                return
+            if request in (f"host:transport:{FAKE_SERIAL}", f"host:tport:serial:{FAKE_SERIAL}"):
+                self.request.sendall(b"OKAY")
+                if request.startswith("host:tport"):
+                    self.request.sendall((1).to_bytes(8, "little"))
+                transport = True
+                continue
+            if request.startswith("host:transport:") or request.startswith("host:tport:"):
+                self.fail(f"device '{request.split(':')[-1]}' not found")
+                return
+            if transport and (request.startswith("shell:") or request.startswith("exec:")):
+                command = request.split(":", 1)[1]
+                self.request.sendall(b"OKAY" + f"{command}\n".encode('utf-8'))
+                return
+            self.fail(f"unknown request {request}")
+            return
+
+    def read_request(self):
+        header = self.read_exactly(4)
+        if header is None:
+            return None
+        return self.read_exactly(int(header, 16)).decode('utf-8')
+
+    def read_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def reply_with_payload(self, payload):
+        data = payload.encode('utf-8')
+        self.request.sendall(b"OKAY" + f"{len(data):04x}".encode('ascii') + data)
+
+    def fail(self, message):
+        data = message.encode('utf-8')
+        self.request.sendall(b"FAIL" + f"{len(data):04x}".encode('ascii') + data)
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def measure(function, iterations):
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(name, latencies):
+    print(f"{name:<28} mean {statistics.mean(latencies):8.2f} ms   "
+          f"p50 {statistics.median(latencies):8.2f} ms   max {max(latencies):8.2f} ms")
+
+
+def run(iterations, adb_path):
+    server = FakeAdbServer(("127.0.0.1", 0), FakeAdbServerHandler)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = AdbClient(FAKE_SERIAL, port=port)
+    assert client.shell("input tap 10 10") == "input tap 10 10\n"
+    report("native client", measure(lambda: client.shell("input tap 10 10"), iterations))
+    client.close()
+
+    if shutil.which(adb_path) is None:
+        print(f"{adb_path} not found, skipping subprocess path")
+    else:
+        report("subprocess adb", measure(lambda: subprocess.run(
+            f"{adb_path} -P {port} -s {FAKE_SERIAL} shell input tap 10 10",
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            encoding='utf-8'
+        ), iterations))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--adb-path", type=str, default="adb")
+    args = parser.parse_args()
+    run(args.iterations, args.adb_path)
@@ -0,0 +1,72 @@
+import argparse
+import base64
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agent"))
+
+from PIL import Image
+
+from binary_transport import decode_frame, encode_frame
+from utils import ImageEncodeCache
+
+IMAGE_FIELDS = ("image",)
+
+
+def action_payload(image_base64):
+    # shape of create_qwen_payload_for_action
+    return {
+        "prompt": "### Background ###\n" + "Previous steps of the task. " * 200,
+        "instruction": "Open the settings and enable dark mode",
+        "action_history": ["Click on Settings", "Scroll down"],
+        "image": image_base64,
+        "use_eval": True,
+        "prompt_reflection": ["Was the step successful? " * 50] * 2,
+        "prompt_init_chat": ["You evaluate a phone agent. " * 20] * 2,
+    }
+
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(times)
+
+
+def measure(paths, repeat):
+    cache = ImageEncodeCache()
+    rows = {"json": [], "frame": []}
+    for path in paths:
+        payload = action_payload(cache.get(Image.open(path)).base64)
+        body, encode_time = timed(lambda: json.dumps(payload).encode("utf-8"), repeat)
+        # the server parses the body and gets the image bytes out of the base64 string
+        _, parse_time = timed(lambda: base64.b64decode(json.loads(body)["image"]), repeat)
+        rows["json"].append((len(body), encode_time, parse_time))
+        body, encode_time = timed(lambda: encode_frame(payload, IMAGE_FIELDS), repeat)
+        _, parse_time = timed(lambda: decode_frame(body)["image"], repeat)
+        rows["frame"].append((len(body), encode_time, parse_time))
+    print(f"{len(paths)} screenshots, median of {repeat} runs each")
+    for transport, values in rows.items():
+        sizes, encode_times, parse_times = zip(*values)
+        print(f"{transport:<6} request {statistics.mean(sizes) / 1024:8.1f} KiB   "
+              f"client encode {statistics.mean(encode_times):6.2f} ms   "
+              f"server parse {statistics.mean(parse_times):6.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--screenshots", type=str, required=True)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    paths = sorted(glob.glob(os.path.join(args.screenshots, "**", "*.jpg"), recursive=True) +
+                   glob.glob(os.path.join(args.screenshots, "**", "*.png"), recursive=True))
+    if not paths:
+        print(f"No screenshots found in {args.screenshots}")
+    else:
+        measure(paths, args.repeat)
@@ -0,0 +1,65 @@
+import argparse
+import base64
+import copy
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agent"))
+
+from chat_history import ChatHistory
+
+SYSTEM_PROMPT = "You are a helpful AI mobile phone operating assistant."
+
+
+def deepcopy_add_response(role, prompt, chat_history, image_url=None):
+    # add_response before ChatHistory
+    new_chat_history = copy.deepcopy(chat_history)
+    content = [{'type': 'text', 'text': prompt}]
+    if image_url:
+        content.append({'type': 'image_url', 'image_url': {'url': image_url}})
+    new_chat_history.append({'role': role, 'content': content})
+    return new_chat_history
+
+
+def history_add_response(role, prompt, chat_history, image_url=None):
+    return chat_history.append_text(role, prompt, [image_url] if image_url else [])
+
+
+def run_task(add_response, chat, steps, image_url):
+    """A use_memory task: every step appends the memory prompt with the screenshot and the answer, then the next
+    request is built from the whole chat."""
+    append_times = []
+    for step in range(steps):
+        start = time.perf_counter()
+        chat = add_response("user", f"### Memory prompt of step {step} ###\n" + "Recorded content. " * 50, chat,
+                            image_url)
+        chat = add_response("assistant", "### Important content ###\n" + "Noted. " * 30, chat)
+        append_times.append((time.perf_counter() - start) * 1000)
+        messages = [*chat, {"role": "user", "content": [{"type": "text", "text": "next"}]}]
+    return append_times, len(messages)
+
+
+def measure(name, add_response, chat, steps, image_url):
+    tracemalloc.start()
+    start = time.perf_counter()
+    append_times, messages = run_task(add_response, chat, steps, image_url)
+    elapsed = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<12} {messages} messages   append first {append_times[0]:7.3f} ms  last {append_times[-1]:7.3f} ms  "
+          f"median {statistics.median(append_times):7.3f} ms   task {elapsed:8.1f} ms   peak {peak / 2 ** 20:7.1f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--image-kib", type=int, default=200, help="Size of each screenshot before base64.")
+    args = parser.parse_args()
+    image_url = "data:image/jpeg;base64," + base64.b64encode(os.urandom(args.image_kib * 1024)).decode("utf-8")
+    system = [{'role': 'system', 'content': [{'type': 'text', 'text': SYSTEM_PROMPT}]}]
+    print(f"{args.steps} steps, two messages and one {args.image_kib} KiB screenshot appended per step")
+    measure("deepcopy", deepcopy_add_response, system, args.steps, image_url)
+    measure("ChatHistory", history_add_response, ChatHistory.of(system), args.steps, image_url)
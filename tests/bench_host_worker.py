@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import httpx
+from PIL import Image
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api", "host_api_worker.py")
+
+DESCRIPTION = "The screen shows the settings of the phone with a search bar on top and a list of options."
+EVALUATION = "Status: failure\nRate: 2\nThoughts: The task is not done yet.\n"
+ACTION = ("Thought: Settings are open, the dark mode option is in Display.\nAction: Click on Display\n"
+          "Operation: Open the display settings\nCommand: click\nDescription: Display option in the list\n"
+          "Ground truth: Display\n")
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    # many agents connect at once, the default backlog of 5 would refuse some of them
+    request_queue_size = 256
+
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    """vLLM chat completions and Florence grounding answering after a fixed delay, one thread per request."""
+    delay = 0.5
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.delay)
+        if self.path == "/worker_generate":
+            return self.send_json({"click_point": [540, 960], "box": [500, 900, 580, 1020]})
+        system_prompt = payload["messages"][0]["content"][0]["text"]
+        if "captioner" in system_prompt:
+            text = DESCRIPTION
+        elif "operating assistant" in system_prompt:
+            text = ACTION
+        else:
+            text = EVALUATION
+        if not payload.get("stream"):
+            return self.send_json({"choices": [{"message": {"role": "assistant", "content": text},
+                                                "finish_reason": "stop"}]})
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            for word in text.split(" "):
+                chunk = {"choices": [{"delta": {"content": word + " "}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # the worker stops reading once it has every field
+            pass
+
+    def send_json(self, output):
+        body = json.dumps(output).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_upstream(delay):
+    FakeUpstream.delay = delay
+    server = UpstreamServer(("127.0.0.1", 0), FakeUpstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def screenshot_base64():
+    buffered = BytesIO()
+    Image.new("RGB", (1080, 2400), (240, 240, 240)).save(buffered, format="JPEG")
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+def plan_payload(image_base64):
+    # shape of create_qwen_payload_for_action
+    return {
+        "prompt": "### Background ###\nOpen the settings and enable dark mode",
+        "image": image_base64,
+        "use_eval": True,
+        "prompt_reflection": ["Was the step successful?", "Is the task complete?"],
+        "prompt_init_chat": ["You evaluate a phone agent.", "You evaluate a phone agent."],
+    }
+
+
+async def agent(client, url, payload, steps, latencies, errors):
+    for _ in range(steps):
+        start = time.perf_counter()
+        output = (await client.post(f"{url}/worker_generate_plan", json=payload, timeout=120)).json()
+        latencies.append(time.perf_counter() - start)
+        if output["exit_code"] != 0:
+            errors.append(output["error_code"])
+
+
+async def run_agents(url, concurrency, steps, payload):
+    latencies, errors = [], []
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency)) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[agent(client, url, payload, steps, latencies, errors) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    print(f"{concurrency:>4} agents   {len(latencies) / elapsed:6.2f} steps/s   "
+          f"latency p50 {statistics.median(latencies):5.2f}s max {max(latencies):5.2f}s   errors {len(errors)}")
+    if errors:
+        print(f"     first error: {errors[0]}")
+
+
+def wait_until_up(url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"host_api_worker exited with {process.returncode}")
+        try:
+            if httpx.get(f"{url}/test_connection", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--steps", type=int, default=4, help="Requests sent by every simulated agent.")
+    parser.add_argument("--upstream-delay", type=float, default=0.5,
+                        help="Seconds the fake InternVL and Florence servers take per request.")
+    parser.add_argument("--stream-action", action="store_true")
+    parser.add_argument("--port", type=int, default=21102)
+    parser.add_argument("--worker-url", type=str, default=None,
+                        help="Load an already running worker instead of starting one against fake upstreams.")
+    args = parser.parse_args()
+
+    process = None
+    url = args.worker_url
+    if url is None:
+        upstream = start_upstream(args.upstream_delay)
+        upstream_url = f"http://127.0.0.1:{upstream.server_address[1]}"
+        command = [sys.executable, WORKER_SCRIPT, "--host", "127.0.0.1", "--port", str(args.port),
+                   "--limit-worker-concurrency", str(max(args.concurrency)),
+                   "--internvl-url", f"{upstream_url}/v1/chat/completions",
+                   "--florence-url", f"{upstream_url}/worker_generate"]
+        if args.stream_action:
+            command.append("--stream-action")
+        # the worker prints every output, keep the benchmark output readable
+        process = subprocess.Popen(command, cwd=os.path.dirname(WORKER_SCRIPT),
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_until_up(url, process)
+        payload = plan_payload(screenshot_base64())
+        print(f"{args.steps} plan requests per agent, every request makes 5 upstream calls")
+        for concurrency in args.concurrency:
+            asyncio.run(run_agents(url, concurrency, args.steps, payload))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
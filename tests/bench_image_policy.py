@@ -0,0 +1,107 @@
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agent"))
+
+from PIL import Image
+
+from utils import ImageEncodeCache
+
+DEFAULT_SWEEP = [
+    "full=",
+    "1280=action:1280,analysis:1280,reflection:1280,memory:1280",
+    "1024=action:1024,analysis:1024,reflection:1024,memory:1024",
+    "768=action:768:70,analysis:768:70,reflection:768:70,memory:768:70",
+]
+CALL_TYPES = ["action", "analysis", "reflection", "memory", "grounding"]
+
+
+def parse_sweep(entries):
+    return [entry.split("=", 1) for entry in entries]
+
+
+def measure_payloads(sweep, screenshot_dir):
+    """Offline part: payload size and encode time of every policy over saved screenshots."""
+    paths = sorted(glob.glob(os.path.join(screenshot_dir, "**", "*.jpg"), recursive=True) +
+                   glob.glob(os.path.join(screenshot_dir, "**", "*.png"), recursive=True))
+    if not paths:
+        print(f"No screenshots found in {screenshot_dir}")
+        return
+    images = [Image.open(path).convert("RGB") for path in paths]
+    print(f"{len(images)} screenshots")
+    for name, policies in sweep:
+        cache = ImageEncodeCache()
+        cache.configure(75, "4:2:0", policies)
+        for call_type in CALL_TYPES:
+            sizes, times = [], []
+            for image in images:
+                start = time.perf_counter()
+                encoded = cache.get(image.copy(), call_type)
+                times.append((time.perf_counter() - start) * 1000)
+                sizes.append(len(encoded.base64))
+            print(f"{name:<8} {call_type:<10} {encoded.size[0]:>5}x{encoded.size[1]:<5} "
+                  f"base64 {statistics.mean(sizes) / 1024:8.1f} KiB   encode {statistics.mean(times):7.1f} ms")
+
+
+def read_last_trajectory(path):
+    # run.py appends one JSON document per run to the same file
+    with open(path, "r") as f:
+        content = f.read()
+    decoder, position, trajectory = json.JSONDecoder(), 0, None
+    while position < len(content):
+        while position < len(content) and content[position].isspace():
+            position += 1
+        if position == len(content):
+            break
+        trajectory, position = decoder.raw_decode(content, position)
+    return trajectory
+
+
+def run_sweep(sweep, test_type, num, config_path):
+    """Online part: runs the test set once per policy and reports task latency and success rate."""
+    from run_test import extract_lines
+
+    lines = extract_lines(test_type, num)
+    for name, policies in sweep:
+        eval_save_folder = f"policy_sweep_{name}"
+        durations, successes = [], 0
+        for i, instruction in enumerate(lines):
+            action_file = f"{test_type}_{i}"
+            start = time.time()
+            os.system(
+                f"python3 ../agent/run.py "
+                f"--instruction \"{instruction}\" "
+                f"--action-file \"{action_file}\" "
+                f"--config-path {config_path} "
+                f"--eval-save-folder {eval_save_folder} "
+                f"--image-policy \"{policies}\""
+            )
+            durations.append(time.time() - start)
+            trajectory_path = f"../output/trajectories/{eval_save_folder}/trajectory_log_{action_file}.json"
+            if os.path.exists(trajectory_path):
+                steps = read_last_trajectory(trajectory_path)["steps"]
+                if steps and "failure" not in str(steps[-1]["other"]["status"]):
+                    successes += 1
+        print(f"{name:<8} tasks {len(durations)}   mean {statistics.mean(durations):7.1f}s   "
+              f"p50 {statistics.median(durations):7.1f}s   success {successes / len(durations):.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sweep", type=str, nargs="*", default=DEFAULT_SWEEP,
+                        help="name=image_policy entries, image_policy as in --image-policy of run.py")
+    parser.add_argument("--screenshots", type=str, default=None,
+                        help="only measure payload size and encode time over the screenshots in this folder")
+    parser.add_argument("--type", type=str, default="web", choices=["general", "web", "all"])
+    parser.add_argument("--num", type=int, default=10)
+    parser.add_argument("--config-path", type=str, default="../config.ini")
+    args = parser.parse_args()
+    if args.screenshots:
+        measure_payloads(parse_sweep(args.sweep), args.screenshots)
+    else:
+        run_sweep(parse_sweep(args.sweep), args.type, args.num, args.config_path)
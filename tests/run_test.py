@@ -1,11 +1,15 @@
+import configparser
 import glob
 import json
 import os
+import sys
 from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 
 from termcolor import cprint
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agent"))
+
 
 def get_tasks():
     path_to_trajectories = "./trajectories/test/"
@@ -33,7 +37,7 @@ def get_tasks():
     return done_tasks
 
 
-def process_instruction(i, instruction, type):
+def process_instruction(i, instruction, type, device_args=""):
     tasks = get_tasks()
     if instruction in tasks:
         return
@@ -47,10 +51,17 @@ def process_instruction(i, instruction, type):
         f"--instruction \"{instruction}\" "
         f"--action-file \"{type}_{i}\" "
         f"--config-path ../config.ini"
+        f"{device_args}"
         # f" >> ../output/output.txt"
     )
 
 
+def process_instruction_on_pool(pool, i, instruction, type):
+    with pool.leased() as device:
+        # the pool owns the emulator, run.py only drives it like an already connected device
+        process_instruction(i, instruction, type, f" --device-type real --device-id {device.device_id}")
+
+
 def extract_lines(type, num):
     file_name = "./test_sets/test_set.csv"
     df = pd.read_csv(file_name)
@@ -71,5 +82,40 @@ def run(type, max_workers: int = 1, num: int = 10):
         futures = [executor.submit(process_instruction, i, instruction, type) for i, instruction in enumerate(lines)]
 
 
+def run_pool(type, pool_size: int = 2, num: int = 10, config_path: str = "../config.ini"):
+    """
+        Same as run, but instructions are executed on a pool of warm emulators
+        which are reset with a quick-boot snapshot between tasks. An emulator
+        that cannot be reset is replaced by a newly booted one.
+    """
+    from emulator_pool import EmulatorPool
+
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    android_cfg = config["Android"]
+    pool = EmulatorPool(
+        size=pool_size,
+        avd_name=android_cfg["avd_name"],
+        emu_path=android_cfg["emu_path"],
+        adb_path=android_cfg["adb_path"],
+        aapt_path=android_cfg["aapt_path"],
+        snapshot=android_cfg["snapshot"],
+        clone_mode=android_cfg.get("clone_mode", "reflink")
+    )
+    lines = extract_lines(type, num)
+    try:
+        pool.start()
+        with ThreadPoolExecutor(max_workers=pool_size) as executor:
+            futures = [executor.submit(process_instruction_on_pool, pool, i, instruction, type)
+                       for i, instruction in enumerate(lines)]
+        # an emulator that cannot be reset is replaced, once none is left the remaining tasks fail here
+        for i, future in enumerate(futures):
+            if future.exception() is not None:
+                cprint(f"Task {type}_{i} not run: {future.exception()}", color="red")
+        pool.report()
+    finally:
+        pool.shutdown()
+
+
 if __name__ == "__main__":
     run("web", 1, 50)